@@ -0,0 +1,89 @@
+"""Benchmarks of the queries of ``SQLiteDatabase``.
+
+Every benchmark runs in a transaction rolled back at its end, rows inserted by a benchmark do not leak into the
+next one.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any
+
+import pytest
+
+if TYPE_CHECKING:
+    from benchmarks.conftest import Dataset
+
+pytestmark = pytest.mark.django_db
+
+PER_PAGE = 10
+
+
+def bench_get_user(benchmark: Any, database: Any, dataset: Dataset) -> None:
+    """Look up an existing user."""
+    benchmark(database.get_user, dataset.telegram_id)
+
+
+def bench_get_user_create(benchmark: Any, database: Any, dataset: Dataset) -> None:
+    """Create a user on its first message."""
+    benchmark(lambda: database.get_user(dataset.new_telegram_id()))
+
+
+def bench_insert_message_from_user(benchmark: Any, database: Any, dataset: Dataset) -> None:
+    """Append a prompt to the current conversation."""
+    benchmark(database.insert_message_from_user, "How do I profile a Django query?", dataset.telegram_id)
+
+
+def bench_insert_message_from_gpt(benchmark: Any, database: Any, dataset: Dataset) -> None:
+    """Append a reply and record its usage."""
+    usage = {"prompt_tokens": 120, "completion_tokens": 300, "total_tokens": 420}
+    reply = "Use the query log and EXPLAIN on the slow queries. " * 20
+    benchmark(database.insert_message_from_gpt, reply, dataset.telegram_id, usage)
+
+
+def bench_get_messages_by_user(benchmark: Any, database: Any, dataset: Dataset) -> None:
+    """Load the whole current conversation."""
+    benchmark(lambda: list(database.get_messages_by_user(dataset.telegram_id)))
+
+
+def bench_get_messages_within_token_budget(benchmark: Any, database: Any, dataset: Dataset) -> None:
+    """Load the context window of the current conversation."""
+    benchmark(lambda: list(database.get_messages_within_token_budget(dataset.telegram_id, 1000)))
+
+
+def bench_get_user_conversations(benchmark: Any, database: Any, dataset: Dataset) -> None:
+    """List the first page of conversations."""
+    benchmark(database.get_user_conversations, dataset.telegram_id, 1, PER_PAGE)
+
+
+def bench_get_conversation_messages(benchmark: Any, database: Any, dataset: Dataset) -> None:
+    """Print the first page of a conversation."""
+    from sqlitedb.models import CurrentConversation  # noqa: PLC0415
+
+    conversation_id = CurrentConversation.objects.get(user__telegram_id=dataset.telegram_id).conversation_id
+    benchmark(database.get_conversation_messages, conversation_id, dataset.telegram_id, 1, PER_PAGE)
+
+
+def bench_initiate_new_conversation(benchmark: Any, database: Any, dataset: Dataset) -> None:
+    """Start a new conversation."""
+    benchmark(database.initiate_new_conversation, dataset.telegram_id, "Benchmark")
+
+
+def bench_get_daily_token_usage(benchmark: Any, database: Any, dataset: Dataset) -> None:
+    """Check the daily quota before a completion."""
+    benchmark(database.get_daily_token_usage, dataset.telegram_id)
+
+
+def bench_delete_all_user_data(benchmark: Any, database: Any, dataset: Dataset) -> None:
+    """Delete a user's conversations and images, from a fresh copy of a dataset user each round."""
+    from sqlitedb.loaddata import LoadDataGenerator, LoadDataSpec  # noqa: PLC0415
+
+    generator = LoadDataGenerator(seed=42)
+
+    def setup() -> tuple[tuple[int], dict[str, Any]]:
+        telegram_id = dataset.new_telegram_id()
+        generator.generate(
+            LoadDataSpec(1, dataset.spec.conversations_per_user, dataset.spec.messages_per_conversation, telegram_id),
+        )
+        return (telegram_id,), {}
+
+    benchmark.pedantic(database.delete_all_user_data, setup=setup, rounds=20)
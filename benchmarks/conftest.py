@@ -0,0 +1,150 @@
+"""Fixtures of the database benchmarks.
+
+The database is the one of ``DATABASE_URL``: pytest-django creates a ``test_`` database next to it, in memory for
+SQLite. Every dataset size is generated once per session and removed before the next size is generated, so that the
+timings of a size are not skewed by the rows of another.
+"""
+
+from __future__ import annotations
+
+import os
+from typing import TYPE_CHECKING, Any, Self
+
+import pytest
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    from pytest_django import DjangoDbBlocker
+
+    from sqlitedb.loaddata import LoadDataSpec
+
+# Users x conversations per user x messages per conversation
+DATASET_SIZES = {
+    "small": (100, 5, 10),
+    "medium": (1000, 10, 20),
+    "large": (10000, 10, 40),
+}
+DEFAULT_SIZES = "small,medium"
+TELEGRAM_ID_START = 10_000_000
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    """Add the ``--dataset-sizes`` option."""
+    parser.addoption(
+        "--dataset-sizes",
+        default=DEFAULT_SIZES,
+        help=f"Comma separated dataset sizes to benchmark, among {', '.join(DATASET_SIZES)}.",
+    )
+
+
+def pytest_configure(config: pytest.Config) -> None:  # noqa: ARG001
+    """Configure Django before pytest-django sets up the test database."""
+    os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+    os.environ.setdefault("GPT_KEY", "sk-benchmark")
+    os.environ.setdefault("PROD", "False")
+    from loguru import logger  # noqa: PLC0415
+
+    from main import env  # noqa: PLC0415, F401 # Configure Django and load the environment
+
+    # Logging every query to the terminal would dominate the timings
+    logger.remove()
+
+
+def pytest_generate_tests(metafunc: pytest.Metafunc) -> None:
+    """Run the benchmarks using a dataset once per selected size."""
+    if "dataset" not in metafunc.fixturenames:
+        return
+    sizes = [size.strip() for size in metafunc.config.getoption("dataset_sizes").split(",") if size.strip()]
+    unknown = set(sizes) - set(DATASET_SIZES)
+    if unknown:
+        msg = f"Unknown dataset sizes {', '.join(sorted(unknown))}, expected some of {', '.join(DATASET_SIZES)}"
+        raise pytest.UsageError(msg)
+    metafunc.parametrize("dataset", sizes, indirect=True, scope="session")
+
+
+class Dataset(object):
+    """A generated dataset and the user the benchmarks query."""
+
+    def __init__(self: Self, size: str, spec: LoadDataSpec, counts: dict[str, int]) -> None:
+        self.size = size
+        self.spec = spec
+        self.counts = counts
+        # A user in the middle of the id range, so that lookups do not hit the first or last index page
+        self.telegram_id = spec.telegram_id_start + spec.users // 2
+        self.next_telegram_id = spec.telegram_id_start + spec.users
+
+    def new_telegram_id(self: Self) -> int:
+        """An id of a user not in the dataset."""
+        self.next_telegram_id += 1
+        return self.next_telegram_id
+
+
+def _backfill_token_counts(telegram_id: int) -> None:
+    """Fill the token counts of the conversations of a user, generated datasets have none."""
+    from chatgpt.tokens import DEFAULT_MODEL  # noqa: PLC0415
+    from sqlitedb.management.commands.backfill_token_counts import Command  # noqa: PLC0415
+    from sqlitedb.models import Conversation  # noqa: PLC0415
+
+    for conversation_id in Conversation.objects.filter(user__telegram_id=telegram_id).values_list("id", flat=True):
+        Command._backfill_conversation(conversation_id, DEFAULT_MODEL, 1000)  # noqa: SLF001
+
+
+def _truncate() -> None:
+    """Delete every row, children first, with plain deletes rather than the ORM cascade collector."""
+    from django.db import connection, transaction  # noqa: PLC0415
+
+    from sqlitedb.models import (  # noqa: PLC0415
+        Conversation,
+        CurrentConversation,
+        User,
+        UserConversations,
+        UserDailyUsage,
+        UserImages,
+    )
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model in (UserConversations, CurrentConversation, UserImages, UserDailyUsage, Conversation, User):
+            cursor.execute(f"DELETE FROM {connection.ops.quote_name(model._meta.db_table)}")  # noqa: S608, SLF001
+
+
+@pytest.fixture(scope="session")
+def dataset(
+    request: pytest.FixtureRequest,
+    django_db_setup: None,  # noqa: ARG001
+    django_db_blocker: DjangoDbBlocker,
+) -> Iterator[Dataset]:
+    """Generate the dataset of the requested size."""
+    from sqlitedb.loaddata import LoadDataGenerator, LoadDataSpec  # noqa: PLC0415
+
+    size = request.param
+    spec = LoadDataSpec(*DATASET_SIZES[size], telegram_id_start=TELEGRAM_ID_START)
+    with django_db_blocker.unblock():
+        counts = LoadDataGenerator(seed=42).generate(spec)
+        generated = Dataset(size, spec, counts)
+        _backfill_token_counts(generated.telegram_id)
+    yield generated
+    with django_db_blocker.unblock():
+        _truncate()
+
+
+@pytest.fixture
+def database() -> Any:
+    """The database wrapper used by the bot."""
+    from main import db  # noqa: PLC0415
+
+    return db
+
+
+@pytest.fixture(autouse=True)
+def _describe_benchmark(request: pytest.FixtureRequest) -> None:
+    """Record the dataset and database vendor in the JSON results."""
+    if "benchmark" not in request.fixturenames or "dataset" not in request.fixturenames:
+        return
+    from django.db import connection  # noqa: PLC0415
+
+    benchmark = request.getfixturevalue("benchmark")
+    current: Dataset = request.getfixturevalue("dataset")
+    benchmark.extra_info.update(
+        {"dataset": current.size, "vendor": connection.vendor, **{f"{k}_rows": v for k, v in current.counts.items()}},
+    )
@@ -0,0 +1,336 @@
+"""Load balancing of requests across OpenAI compatible backends."""
+
+from __future__ import annotations
+
+import json
+import random
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Self, TypeVar
+
+from loguru import logger
+from openai import OpenAI
+
+from chatgpt.exceptions import CancelledCompletionError
+from chatgpt.ratelimit import RateLimiter
+from chatgpt.resilience import AttemptTimer, RetryPolicy, failure_reason
+from monitoring.metrics import REGISTRY
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+T = TypeVar("T")
+
+LEAST_OUTSTANDING = "least_outstanding"
+EWMA = "ewma"
+ROUTING_STRATEGIES = (LEAST_OUTSTANDING, EWMA)
+# Weight of the latest latency in the moving average
+EWMA_ALPHA = 0.3
+# Ejections of a backend failing again right after coming back are doubled, up to this factor
+MAX_EJECTION_FACTOR = 8
+
+
+def _backend_gauge(attribute: str) -> Callable[[], dict[tuple[str, ...], float]]:
+    def collect() -> dict[tuple[str, ...], float]:
+        from main import gpt  # noqa: PLC0415
+
+        return {(backend.name,): float(getattr(backend, attribute)) for backend in gpt.backends.backends}
+
+    return collect
+
+
+backend_requests_total = REGISTRY.counter(
+    "openai_backend_requests_total",
+    "OpenAI requests by backend and outcome.",
+    ("backend", "outcome"),
+)
+request_seconds = REGISTRY.histogram(
+    "openai_request_seconds",
+    "Latency of OpenAI requests by backend, model and outcome, rate limiter wait excluded.",
+    ("backend", "model", "outcome"),
+)
+tokens_total = REGISTRY.counter(
+    "openai_tokens_total",
+    "Tokens used by OpenAI requests by backend, model and kind (prompt or completion).",
+    ("backend", "model", "kind"),
+)
+backend_ejections_total = REGISTRY.counter(
+    "openai_backend_ejections_total",
+    "Times a backend was ejected after consecutive failures.",
+    ("backend",),
+)
+REGISTRY.gauge(
+    "openai_backend_outstanding",
+    "OpenAI requests in flight by backend.",
+    ("backend",),
+    _backend_gauge("outstanding"),
+)
+REGISTRY.gauge(
+    "openai_backend_latency_ewma_seconds",
+    "Moving average of the latency of each backend.",
+    ("backend",),
+    _backend_gauge("ewma_latency"),
+)
+
+
+class Backend(object):
+    """An OpenAI compatible endpoint and its live statistics.
+
+    Args:
+        name (str): Name of the backend, used in logs and metrics.
+        base_url (str): Base URL of the API.
+        api_key (str): Key used to authenticate.
+        weight (float): Share of the traffic relative to other backends.
+        models (dict[str, str]): Models served by the backend, mapped to the name the backend knows them by.
+            ``"*"`` matches any model. An empty map serves every model under its own name.
+        timeout (float): Seconds before a request times out.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self: Self,
+        name: str,
+        base_url: str,
+        api_key: str,
+        *,
+        weight: float = 1.0,
+        models: dict[str, str] | None = None,
+        timeout: float = 10.0,
+    ) -> None:
+        self.name = name
+        self.weight = max(weight, 0.01)
+        self.models = models or {}
+        self.client = OpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=0)
+        self.outstanding = 0
+        self.ewma_latency = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+    def model_name(self: Self, model: str) -> str | None:
+        """Name of a model on this backend, None if it does not serve it."""
+        if not self.models:
+            return model
+        return self.models.get(model, self.models.get("*"))
+
+    def is_ejected(self: Self, now: float) -> bool:
+        """Whether the backend is temporarily out of the rotation."""
+        return now < self.ejected_until
+
+    def stats(self: Self) -> dict[str, Any]:
+        """Current statistics of the backend."""
+        return {
+            "name": self.name,
+            "weight": self.weight,
+            "outstanding": self.outstanding,
+            "ewma_latency": round(self.ewma_latency, 4),
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejections": self.ejections,
+            "ejected": self.is_ejected(time.monotonic()),
+        }
+
+
+class BackendPool(object):
+    """Route requests to the best available backend.
+
+    ``least_outstanding`` routing sends a request to the backend with the fewest requests in flight relative to
+    its weight. ``ewma`` routing also multiplies by the moving average of the backend latency, favouring fast
+    backends while still spreading load when they queue up.
+
+    Backends are ejected passively: after ``eject_failures`` consecutive transient failures a backend is
+    skipped for ``eject_seconds``, doubled for every ejection following a failed comeback. When every backend
+    serving a model is ejected, the one coming back first is used anyway.
+    """
+
+    def __init__(
+        self: Self,
+        backends: list[Backend],
+        routing: str = LEAST_OUTSTANDING,
+        eject_failures: int = 3,
+        eject_seconds: float = 30.0,
+        limiter: RateLimiter | None = None,
+    ) -> None:
+        if not backends:
+            msg = "At least one backend is required"
+            raise ValueError(msg)
+        if routing not in ROUTING_STRATEGIES:
+            msg = f"Unknown routing strategy {routing}, expected one of {', '.join(ROUTING_STRATEGIES)}"
+            raise ValueError(msg)
+        self.backends = backends
+        self.routing = routing
+        self.eject_failures = eject_failures
+        self.eject_seconds = eject_seconds
+        self.limiter = limiter or RateLimiter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls: type[Self]) -> Self:
+        """Build the pool from ``GPT_BACKENDS``, falling back to a single ``GPT_URL`` backend.
+
+        ``GPT_BACKENDS`` is a JSON list of objects with the keys ``name``, ``url``, ``key`` and optionally
+        ``weight``, ``models`` and ``timeout``.
+        """
+        from main import env  # noqa: PLC0415
+
+        timeout = env.float("GPT_TIMEOUT", 10)
+        config = env.str("GPT_BACKENDS", "")
+        if config:
+            backends = [
+                Backend(
+                    backend.get("name", f"backend-{index}"),
+                    backend["url"],
+                    backend["key"],
+                    weight=float(backend.get("weight", 1)),
+                    models=backend.get("models"),
+                    timeout=float(backend.get("timeout", timeout)),
+                )
+                for index, backend in enumerate(json.loads(config))
+            ]
+        else:
+            backends = [
+                Backend(
+                    "default",
+                    env.str("GPT_URL", "https://api.openai.com/v1"),
+                    env.str("GPT_KEY"),
+                    timeout=timeout,
+                ),
+            ]
+        pool = cls(
+            backends,
+            env.str("GPT_ROUTING", LEAST_OUTSTANDING),
+            env.int("GPT_EJECT_FAILURES", 3),
+            env.float("GPT_EJECT_SECONDS", 30),
+            RateLimiter.from_env(),
+        )
+        logger.info(f"Routing OpenAI requests across {', '.join(b.name for b in backends)} with {pool.routing}")
+        return pool
+
+    def _cost(self: Self, backend: Backend) -> float:
+        cost = (backend.outstanding + 1) / backend.weight
+        if self.routing == EWMA:
+            # Unmeasured backends get a tiny latency so that they receive traffic and get measured
+            cost *= backend.ewma_latency or 1e-3
+        return cost
+
+    def acquire(self: Self, model: str, tokens: int = 0) -> tuple[Backend, str]:
+        """Pick a backend for a request and count it as outstanding.
+
+        Healthy backends whose rate limiter lets the request through at once are preferred, so that a request does
+        not wait for a limited backend while another one is free.
+
+        Returns
+        -------
+            tuple[Backend, str]: The backend and the name of the model on it.
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = [backend for backend in self.backends if backend.model_name(model) is not None]
+            if not candidates:
+                msg = f"No backend serves the model {model}"
+                raise ValueError(msg)
+            healthy = [backend for backend in candidates if not backend.is_ejected(now)]
+            healthy = [b for b in healthy if self.limiter.has_budget(b.name, model, tokens)] or healthy
+            if healthy:
+                lowest = min(self._cost(backend) for backend in healthy)
+                backend = random.choice([b for b in healthy if self._cost(b) == lowest])  # noqa: S311
+            else:
+                backend = min(candidates, key=lambda b: b.ejected_until)
+            backend.outstanding += 1
+            backend.requests += 1
+        return backend, str(backend.model_name(model))
+
+    def release(self: Self, backend: Backend, latency: float, error: BaseException | None = None) -> None:
+        """Record the outcome of a request sent to a backend."""
+        if isinstance(error, CancelledCompletionError):
+            # Cut short by the user, its latency says nothing about the backend
+            with self._lock:
+                backend.outstanding -= 1
+            backend_requests_total.inc(backend=backend.name, outcome="cancelled")
+            return
+        outcome = "success" if error is None else failure_reason(error)
+        with self._lock:
+            backend.outstanding -= 1
+            if error is None or not RetryPolicy.is_retryable(error):
+                # Client errors are answered by a healthy backend
+                backend.consecutive_failures = 0
+                backend.ewma_latency = (
+                    latency
+                    if not backend.ewma_latency
+                    else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * backend.ewma_latency
+                )
+                if not backend.is_ejected(time.monotonic()):
+                    backend.ejections = 0
+            else:
+                backend.failures += 1
+                backend.consecutive_failures += 1
+                if backend.consecutive_failures >= self.eject_failures:
+                    self._eject(backend)
+        backend_requests_total.inc(backend=backend.name, outcome=outcome)
+
+    def _eject(self: Self, backend: Backend) -> None:
+        factor = min(2**backend.ejections, MAX_EJECTION_FACTOR)
+        backend.ejections += 1
+        backend.consecutive_failures = 0
+        backend.ejected_until = time.monotonic() + self.eject_seconds * factor
+        backend_ejections_total.inc(backend=backend.name)
+        logger.warning(f"Ejecting OpenAI backend {backend.name} for {self.eject_seconds * factor:.1f}s")
+
+    def call(
+        self: Self,
+        model: str,
+        request: Callable[[OpenAI, str], T],
+        tokens: int = 0,
+        user: Any = None,
+        timer: AttemptTimer | None = None,
+    ) -> T:
+        """Send a request to the best backend serving a model.
+
+        Args:
+            model (str): The requested model.
+            request (Callable): Called with the client of the chosen backend and the model name on it.
+            tokens (int): Estimated tokens used by the request, for rate limiting.
+            user (Any): Who the request is sent for, for fair queuing by the rate limiter.
+            timer (AttemptTimer | None): Started once the rate limiter let the request through.
+        """
+        backend, model_name = self.acquire(model, tokens)
+        try:
+            # Requests waiting for the limiter count as outstanding, steering traffic to other backends
+            # Keyed on the requested model, GPT_RATE_LIMITS names models as the bot requests them, not as mapped
+            reservation = self.limiter.acquire(backend.name, model, tokens, user)
+        except BaseException:
+            with self._lock:
+                backend.outstanding -= 1
+            raise
+        if timer is not None:
+            timer.start()
+        start = time.perf_counter()
+        try:
+            response = request(backend.client, model_name)
+        except Exception as e:
+            latency = time.perf_counter() - start
+            self.release(backend, latency, e)
+            if not isinstance(e, CancelledCompletionError):
+                request_seconds.observe(latency, backend=backend.name, model=model_name, outcome=failure_reason(e))
+            # The request may or may not have been counted by the provider, keep the reservation
+            raise
+        latency = time.perf_counter() - start
+        self.release(backend, latency)
+        request_seconds.observe(latency, backend=backend.name, model=model_name, outcome="success")
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            for kind in ("prompt", "completion"):
+                tokens_total.inc(
+                    getattr(usage, f"{kind}_tokens", 0) or 0,
+                    backend=backend.name,
+                    model=model_name,
+                    kind=kind,
+                )
+        self.limiter.settle(reservation, getattr(usage, "total_tokens", None))
+        return response
+
+    def stats(self: Self) -> list[dict[str, Any]]:
+        """Statistics of every backend."""
+        with self._lock:
+            return [backend.stats() for backend in self.backends]
@@ -0,0 +1,112 @@
+"""Exact-match cache of chat completions of stateless prompts."""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Self
+
+from chatgpt.cassette import request_key
+from chatgpt.tokens import count_tokens
+from chatgpt.utils import UserType
+from monitoring.metrics import REGISTRY, hit_ratio
+
+if TYPE_CHECKING:
+    from openai.types.chat import ChatCompletion
+
+cache_requests_total = REGISTRY.counter(
+    "openai_cache_requests_total",
+    "Cacheable chat completions by cache result (hit, miss or expired).",
+    ("result",),
+)
+cache_evictions_total = REGISTRY.counter(
+    "openai_cache_evictions_total",
+    "Cached chat completions evicted to stay under the cache size.",
+)
+cache_entries = REGISTRY.gauge("openai_cache_entries", "Chat completions held by the response cache.")
+REGISTRY.gauge(
+    "openai_cache_hit_ratio",
+    "Share of the cacheable chat completions answered from the response cache.",
+    callback=hit_ratio(cache_requests_total),
+)
+
+
+class ResponseCache(object):
+    """LRU cache of chat completions with a time to live, keyed by the model and the normalized messages.
+
+    Only prompts made of system messages and a single short user message are cached, e.g. the ``/start`` pun or
+    the first question of a conversation. Those carry no conversation history, so a cached answer never reveals
+    anything about the user it was first generated for. Cached completions are returned without their usage, the
+    tokens were not spent again.
+    """
+
+    def __init__(self: Self, max_entries: int = 0, ttl: float = 3600, max_prompt_tokens: int = 64) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_prompt_tokens = max_prompt_tokens
+        self._entries: OrderedDict[str, tuple[float, ChatCompletion]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls: type[Self]) -> Self:
+        """Build the cache configured with ``GPT_CACHE_*``, disabled unless ``GPT_CACHE_SIZE`` is set."""
+        from main import env  # noqa: PLC0415
+
+        return cls(
+            env.int("GPT_CACHE_SIZE", 0),
+            env.float("GPT_CACHE_TTL", 3600),
+            env.int("GPT_CACHE_MAX_PROMPT_TOKENS", 64),
+        )
+
+    @property
+    def enabled(self: Self) -> bool:
+        """Whether completions are cached at all."""
+        return self.max_entries > 0
+
+    def cacheable(self: Self, model: str, messages: list[dict[str, str]]) -> bool:
+        """Whether a request is stateless and short enough to be answered from the cache."""
+        if not self.enabled:
+            return False
+        user_messages = [message for message in messages if message.get("role") != UserType.SYSTEM.value]
+        return (
+            len(user_messages) == 1
+            and user_messages[0].get("role") == UserType.USER.value
+            and count_tokens(str(user_messages[0].get("content", "")), model) <= self.max_prompt_tokens
+        )
+
+    def get(self: Self, model: str, messages: list[dict[str, str]]) -> ChatCompletion | None:
+        """Return the cached completion of a request, None if it is not cached or expired."""
+        key = request_key(model, messages)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                cache_requests_total.inc(result="miss")
+                return None
+            expires, response = entry
+            if expires <= now:
+                del self._entries[key]
+                cache_entries.set(len(self._entries))
+                cache_requests_total.inc(result="expired")
+                return None
+            self._entries.move_to_end(key)
+        cache_requests_total.inc(result="hit")
+        return response.model_copy(update={"usage": None})
+
+    def put(self: Self, model: str, messages: list[dict[str, str]], response: ChatCompletion) -> None:
+        """Cache the completion of a request, evicting the least recently used ones over the cache size."""
+        key = request_key(model, messages)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                cache_evictions_total.inc()
+            cache_entries.set(len(self._entries))
+
+    def clear(self: Self) -> None:
+        """Drop every cached completion."""
+        with self._lock:
+            self._entries.clear()
+            cache_entries.set(0)
@@ -0,0 +1,134 @@
+"""Record and replay of OpenAI chat completions."""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Self
+
+from loguru import logger
+from openai.types.chat import ChatCompletion
+
+from chatgpt.exceptions import CassetteMissError
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+OFF = "off"
+RECORD = "record"
+REPLAY = "replay"
+CASSETTE_MODES = (OFF, RECORD, REPLAY)
+
+
+def normalize_messages(messages: list[dict[str, str]]) -> list[dict[str, str]]:
+    """Keep the role and content of messages, with whitespace collapsed."""
+    return [
+        {"role": str(message.get("role", "")), "content": " ".join(str(message.get("content", "")).split())}
+        for message in messages
+    ]
+
+
+def request_key(model: str, messages: list[dict[str, str]]) -> str:
+    """Key matching a recorded request, the hash of the model and the normalized messages."""
+    payload = json.dumps({"model": model, "messages": normalize_messages(messages)}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class Cassette(object):
+    """Gzipped JSON lines file of chat completions and their latency.
+
+    In ``record`` mode every completion is appended to the cassette. In ``replay`` mode requests are answered
+    from the cassette without being sent, after the recorded latency multiplied by ``latency_scale``. Identical
+    requests recorded several times are replayed in the recorded order, the last response being repeated once
+    they are exhausted, so that a replay is deterministic.
+    """
+
+    def __init__(self: Self, path: str, mode: str = OFF, latency_scale: float = 1.0) -> None:
+        if mode not in CASSETTE_MODES:
+            msg = f"Unknown cassette mode {mode}, expected one of {', '.join(CASSETTE_MODES)}"
+            raise ValueError(msg)
+        self.path = Path(path)
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self._entries: dict[str, list[dict[str, Any]]] = defaultdict(list)
+        self._positions: dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        if mode == REPLAY:
+            self._load()
+
+    @classmethod
+    def from_env(cls: type[Self]) -> Self:
+        """Build the cassette configured with ``GPT_CASSETTE_*``."""
+        from main import env  # noqa: PLC0415
+
+        return cls(
+            env.str("GPT_CASSETTE_PATH", "cassettes/openai.jsonl.gz"),
+            env.str("GPT_CASSETTE_MODE", OFF).lower(),
+            env.float("GPT_CASSETTE_LATENCY_SCALE", 1.0),
+        )
+
+    @property
+    def replaying(self: Self) -> bool:
+        """Whether requests are answered from the cassette."""
+        return self.mode == REPLAY
+
+    def _load(self: Self) -> None:
+        with gzip.open(self.path, "rt", encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries[entry["key"]].append(entry)
+        logger.info(f"Loaded {sum(map(len, self._entries.values()))} recorded completions from {self.path}")
+
+    def replay(self: Self, model: str, messages: list[dict[str, str]]) -> ChatCompletion:
+        """Answer a request from the cassette.
+
+        Raises
+        ------
+            CassetteMissError: If the request was not recorded.
+        """
+        key = request_key(model, messages)
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                raise CassetteMissError(key)
+            position = self._positions[key]
+            entry = entries[min(position, len(entries) - 1)]
+            self._positions[key] = position + 1
+        if self.latency_scale > 0:
+            time.sleep(entry["latency"] * self.latency_scale)
+        return ChatCompletion.model_validate(entry["response"])
+
+    def record(
+        self: Self,
+        model: str,
+        messages: list[dict[str, str]],
+        request: Callable[[], ChatCompletion],
+    ) -> ChatCompletion:
+        """Send a request and append it to the cassette with its response and latency."""
+        start = time.perf_counter()
+        response = request()
+        entry = {
+            "key": request_key(model, messages),
+            "model": model,
+            "messages": normalize_messages(messages),
+            "latency": round(time.perf_counter() - start, 4),
+            "recorded_at": int(time.time()),
+            "response": response.model_dump(mode="json"),
+        }
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # Every append adds a gzip member, gzip readers read them as a single stream
+            with gzip.open(self.path, "at", encoding="utf-8") as file:
+                file.write(line)
+        return response
+
+    def entries(self: Self) -> list[dict[str, Any]]:
+        """All recorded entries, in recording order per request."""
+        return [entry for entries in self._entries.values() for entry in entries]
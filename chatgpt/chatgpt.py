@@ -2,16 +2,33 @@
 
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Self
+import base64
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Self
 
-import openai
+import requests
 from loguru import logger
-from openai import OpenAI
 
-from chatgpt.exceptions import InvalidChoiceError
+from chatgpt.backends import BackendPool
+from chatgpt.cache import ResponseCache
+from chatgpt.cassette import RECORD, Cassette
+from chatgpt.exceptions import CancelledCompletionError, CircuitOpenError, InvalidChoiceError, QuotaExceededError
+from chatgpt.imagestore import ImageStore, image_store_reused_total, prompt_hash
+from chatgpt.resilience import ResilientCaller
+from chatgpt.similarity import SimilarPromptCache
+from chatgpt.streaming import stream_completion
+from chatgpt.titles import TITLE_WORDS, local_titles
+from chatgpt.tokens import count_tokens
 from chatgpt.utils import DataType, UserType, dummy_response
+from telegram.commands.utils import UserSettings
 
 if TYPE_CHECKING:
+    import threading
+    from pathlib import Path
+
+    from openai.types import Image
     from openai.types.chat import ChatCompletion
     from telethon.tl.types import User
 
@@ -24,10 +41,20 @@ class ChatGPT(object):
         from main import env  # noqa: PLC0415
 
         self.model = env.str("GPT_MODEL", "gpt-4o")
-        self.client = OpenAI(
-            api_key=env.str("GPT_KEY"),
-            base_url=env.str("GPT_URL", "https://api.openai.com/v1"),
-        )
+        # Maximum number of history tokens sent with each chat request, 0 sends the whole conversation
+        self.context_tokens = env.int("GPT_CONTEXT_TOKENS", 0)
+        # Completion tokens reserved from the TPM budget before the actual usage is known
+        self.completion_tokens_estimate = env.int("GPT_COMPLETION_TOKENS_ESTIMATE", 500)
+        self.image_model = env.str("GPT_IMAGE_MODEL", "dall-e-2")
+        self.images = ImageStore.from_env()
+        # Serve repeated image prompts from the image store instead of generating new images
+        self.reuse_images = env.bool("IMAGE_REUSE", False)
+        # Clients do not retry, retries are handled by the resilience layer and may go to another backend
+        self.backends = BackendPool.from_env()
+        self.resilience = ResilientCaller.from_env()
+        self.cassette = Cassette.from_env()
+        self.cache = ResponseCache.from_env()
+        self.similar = SimilarPromptCache.from_env()
 
     def build_message(self: Self, result: dict[dict[str, str], str]) -> list[dict[str, str]]:
         """Build Open API message."""
@@ -42,59 +69,142 @@ class ChatGPT(object):
 
         return messages
 
+    def estimate_prompt_tokens(self: Self, messages: list[dict[str, str]]) -> int:
+        """Estimate the prompt tokens of a chat request."""
+        # Every message carries a few tokens of formatting on top of its content
+        return sum(count_tokens(message["content"], self.model) + 4 for message in messages)
+
+    def estimate_tokens(self: Self, messages: list[dict[str, str]]) -> int:
+        """Estimate the prompt and completion tokens of a chat request."""
+        return self.estimate_prompt_tokens(messages) + self.completion_tokens_estimate
+
+    def _create_completion(
+        self: Self,
+        messages: list[dict[str, str]],
+        user_id: int | None = None,
+        *,
+        similar: bool = False,
+        cancel: threading.Event | None = None,
+    ) -> ChatCompletion:
+        """Create a chat completion with caching, rate limiting, retries, circuit breaking and hedging."""
+        cacheable = self.cache.cacheable(self.model, messages)
+        if cacheable:
+            cached = self.cache.get(self.model, messages)
+            if cached is not None:
+                logger.debug("Answered chat completion request from the cache")
+                return cached
+        if similar:
+            cached = self.similar.get(self.model, messages)
+            if cached is not None:
+                logger.debug("Answered chat completion request with the answer to a similar prompt")
+                return cached
+        response = self._send_completion(messages, user_id, cancel)
+        if cacheable:
+            self.cache.put(self.model, messages, response)
+        # Indexed whatever the user's preference, the answers are only served to users who opted in
+        self.similar.put(self.model, messages, response)
+        return response
+
+    def _send_completion(
+        self: Self,
+        messages: list[dict[str, str]],
+        user_id: int | None = None,
+        cancel: threading.Event | None = None,
+    ) -> ChatCompletion:
+        """Send a chat completion request, or answer it from the cassette.
+
+        Requests that may be cancelled are streamed, so that the connection can be closed once ``cancel`` is set.
+        """
+        if self.cassette.replaying:
+            return self.cassette.replay(self.model, messages)
+        tokens = self.estimate_tokens(messages)
+
+        def create(client: Any, model: str) -> ChatCompletion:
+            if cancel is None:
+                return client.chat.completions.create(model=model, messages=messages)
+            return stream_completion(client, model, messages, cancel)
+
+        # Streamed completions are timed until their last chunk, their latencies are tracked apart
+        operation = "chat.completions.stream" if cancel is not None else "chat.completions"
+
+        def request() -> ChatCompletion:
+            return self.resilience.call(
+                lambda timer: self.backends.call(self.model, create, tokens, user_id, timer),
+                f"{operation}:{self.model}",
+            )
+
+        if self.cassette.mode == RECORD:
+            return self.cassette.record(self.model, messages, request)
+        return request()
+
     def send_request(
         self: Self,
         messages: list[dict[str, str]],
+        user_id: int | None = None,
+        *,
+        similar: bool = False,
+        cancel: threading.Event | None = None,
     ) -> ChatCompletion:
-        """Send a request to OpenAI."""
+        """Send a request to OpenAI.
+
+        Args:
+            messages (list[dict[str, str]]): The chat messages.
+            user_id (int | None): Telegram id of the user the request is sent for, requests are rate limited
+                fairly across users.
+            similar (bool): Whether a single-turn prompt may be answered with the answer to a similar prompt.
+            cancel (threading.Event | None): Set when the reply is no longer wanted, the request is then aborted.
+
+        Raises
+        ------
+            CancelledCompletionError: If ``cancel`` was set before the completion ended.
+        """
         try:
             from main import env  # noqa: PLC0415
 
-            if env.bool("PROD", False):
+            if env.bool("PROD", False) or self.cassette.replaying:
                 logger.debug("Sent chat completion request to OPENAI")
-                response: ChatCompletion = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    timeout=10,
-                )
+                response = self._create_completion(messages, user_id, similar=similar, cancel=cancel)
                 logger.debug("Got chat completion response fromm open AI")
                 return response
             logger.debug("Returned patched chat completion response from open AI")
             return dummy_response
+        except (CircuitOpenError, CancelledCompletionError):
+            raise
         except Exception as e:
             logger.exception(f"Unable to get response from OpenAI {e}")
             raise
 
-    def send_text_completion_request(
-        self,
-        message: str,
-    ) -> ChatCompletion:
-        """Send a Text completion request to OpenAI."""
-        try:
-            from main import env  # noqa: PLC0415
+    def generate_titles(self: Self, messages: list[str]) -> list[str]:
+        """Generate titles for several conversations with a single completion.
 
-            if env.bool("PROD", False):
-                logger.debug("Sent text completion request to OPENAI")
-                system = [{"role": "system", "content": "You are Summary AI."}]
-                user = [
-                    {
-                        "role": "user",
-                        "content": f"If this is answer what will be the question(under 250 words):\n\n{message}",
-                    },
-                ]
-                response: ChatCompletion = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=system + user,
-                    timeout=10,
-                )
-                logger.debug("Got text completion response fromm open AI")
-                return response
-            logger.debug("Returned patched text completion response from open AI")
-            return dummy_response
+        Args:
+            messages (list[str]): The first user message of each conversation.
 
-        except Exception as e:
-            logger.exception(f"Unable to get response from OpenAI {e}")
-            raise
+        Returns
+        -------
+            list[str]: One title per message, in the same order.
+        """
+        openers = "\n".join(f"{index}. {json.dumps(message[:500])}" for index, message in enumerate(messages, 1))
+        prompt = [
+            {"role": "system", "content": "You name conversations."},
+            {
+                "role": "user",
+                "content": f"Write a short title (at most {TITLE_WORDS} words) for each of the following "
+                f"{len(messages)} conversation openers. Reply only with a JSON array of {len(messages)} strings "
+                f"in the same order.\n\n{openers}",
+            },
+        ]
+        content = str(self.send_request(prompt).choices[0].message.content).strip()
+        content = content.removeprefix("```json").removeprefix("```").removesuffix("```").strip()
+        try:
+            titles = json.loads(content)
+        except json.JSONDecodeError:
+            titles = [content] if len(messages) == 1 else []
+        if not isinstance(titles, list) or len(titles) != len(messages):
+            logger.warning(f"Unexpected titles completion, falling back to local titles: {content}")
+            return local_titles.generate(messages)
+        fallbacks = local_titles.generate(messages)
+        return [str(title).strip().strip('"') or fallback for title, fallback in zip(titles, fallbacks, strict=True)]
 
     def reply_start(self: Self, message: str) -> str:
         """Reply to start message."""
@@ -105,29 +215,181 @@ class ChatGPT(object):
         openapi_response = self.send_request(messages)
         return str(openapi_response.choices[0].message.content)
 
-    def chat(self: Self, user: User, message: str) -> str:
-        """Chat Open API."""
+    @staticmethod
+    def completion_usage(response: ChatCompletion, latency: float) -> dict[str, int]:
+        """Usage of a completion and its latency, as stored with the reply."""
+        usage = getattr(response, "usage", None)
+        return {
+            "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+            "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+            "total_tokens": getattr(usage, "total_tokens", 0) or 0,
+            "latency_ms": round(latency * 1000),
+        }
+
+    def aborted_usage(self: Self, messages: list[dict[str, str]], completion: str, latency: float) -> dict[str, int]:
+        """Estimated usage of a completion aborted while it was generated, whose usage OpenAI never returned."""
+        prompt_tokens = self.estimate_prompt_tokens(messages)
+        completion_tokens = count_tokens(completion, self.model) if completion else 0
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "latency_ms": round(latency * 1000),
+        }
+
+    def check_quota(self: Self, user_id: int) -> None:
+        """Raise QuotaExceededError if a user used up their daily token quota."""
+        from main import db  # noqa: PLC0415
+
+        used, quota = db.get_daily_token_usage(user_id)
+        if quota and used >= quota:
+            raise QuotaExceededError(used, quota)
+
+    def similar_answers_enabled(self: Self, user_id: int) -> bool:
+        """Whether a user opted in to answers to similar prompts."""
+        if not self.similar.enabled:
+            return False
+        from main import db  # noqa: PLC0415
+
+        return db.get_user(user_id).settings.get(UserSettings.SIMILAR_ANSWERS.value) == "on"
+
+    def chat(
+        self: Self,
+        user: User,
+        message: str,
+        cancel: threading.Event | None = None,
+        earlier: list[str] | None = None,
+    ) -> str:
+        """Chat Open API.
+
+        Args:
+            user (User): The user the message is from.
+            message (str): The message answered.
+            cancel (threading.Event | None): Set when the reply is no longer wanted.
+            earlier (list[str] | None): Unanswered messages the user sent before, stored before the message.
+
+        Raises
+        ------
+            CancelledCompletionError: If ``cancel`` was set before the reply was stored, it is then not stored.
+                The earlier messages are stored even then, and the tokens of a request already sent are added to
+                the daily usage of the user.
+        """
         from main import db  # noqa: PLC0415
 
+        if cancel is not None and cancel.is_set():
+            # Cancelled while waiting for its turn, the earlier messages are kept as the history of the next one
+            for text in earlier or []:
+                db.insert_message_from_user(text, user.id)
+            raise CancelledCompletionError
+        # Checked before the message is stored, so that it is not left unanswered in the conversation
+        self.check_quota(user.id)
+        for text in earlier or []:
+            db.insert_message_from_user(text, user.id)
         db.insert_message_from_user(message, user.id)
-        messages = db.get_messages_by_user(user.id)
+        if self.context_tokens:
+            messages = db.get_messages_within_token_budget(user.id, self.context_tokens)
+        else:
+            messages = db.get_messages_by_user(user.id)
         self.message_history[user.username] = self.build_message(messages)
-        openapi_response = self.send_request(self.message_history[user.username])
+        start = time.perf_counter()
+        try:
+            openapi_response = self.send_request(
+                self.message_history[user.username],
+                user.id,
+                similar=self.similar_answers_enabled(user.id),
+                cancel=cancel,
+            )
+        except CancelledCompletionError as e:
+            if e.completion is not None:
+                # Aborted once sent, the prompt and the answer generated so far count towards the quota
+                latency = time.perf_counter() - start
+                db.record_usage(user.id, self.aborted_usage(self.message_history[user.username], e.completion, latency))
+            raise
+        usage = self.completion_usage(openapi_response, time.perf_counter() - start)
+        if cancel is not None and cancel.is_set():
+            # Answered from a cache or finished just before the cancellation, the reply is not stored but counts
+            db.record_usage(user.id, usage)
+            raise CancelledCompletionError
         reply = str(openapi_response.choices[0].message.content)
-        db.insert_message_from_gpt(reply, user.id)
+        db.insert_message_from_gpt(reply, user.id, usage)
         self.message_history[user.username].append(
             {"role": UserType.ASSISTANT.value, "content": reply},
         )
         return reply
 
-    def image_gen(self: Self, telegram_user: User, message: str) -> str:
-        """Generate an image from the text."""
-        response = openai.Image.create(prompt=message, n=1, size="512x512")
-        image_url = str(response["data"][0]["url"])
+    @staticmethod
+    def _image_bytes(image: Image) -> bytes:
+        """Content of a generated image, returned inline or to be downloaded before its URL expires."""
+        if image.b64_json:
+            return base64.b64decode(image.b64_json)
+        response = requests.get(str(image.url), timeout=20)
+        response.raise_for_status()
+        return response.content
+
+    def _reused_images(self: Self, key: str, n: int) -> list[str]:
+        """Hashes of ``n`` stored images generated from the same request, empty if there are not enough."""
+        from main import db  # noqa: PLC0415
+
+        digests = [digest for digest in db.get_stored_image_hashes(key) if self.images.get(digest) is not None]
+        return digests[:n] if len(digests) >= n else []
+
+    def _request_images(self: Self, message: str, size: str, n: int, user_id: int) -> list[Image]:
+        """Send an image generation request for ``n`` variants."""
+
+        def generate(client: Any, model: str) -> Any:
+            # DALL-E returns URLs by default, newer models always return the image inline
+            extra = {"response_format": "b64_json"} if model.startswith("dall-e") else {}
+            return client.images.generate(model=model, prompt=message, n=n, size=size, **extra)
+
+        # Never hedged, a duplicate image generation costs as much as the first one
+        response = self.resilience.call(
+            lambda timer: self.backends.call(self.image_model, generate, user=user_id, timer=timer),
+            f"images.generate:{self.image_model}",
+            hedge=False,
+        )
+        return list(response.data)
+
+    def image_gen(self: Self, telegram_user: User, message: str, size: str = "512x512", n: int = 1) -> list[Path]:
+        """Generate images from the text and keep them in the image store.
+
+        Args:
+            telegram_user (User): The user the images are generated for.
+            message (str): The prompt.
+            size (str): The dimensions of the images.
+            n (int): The number of variants.
+
+        Returns
+        -------
+            list[Path]: The paths of the images in the image store.
+        """
         from main import db  # noqa: PLC0415
 
-        db.insert_images_from_gpt(message, image_url, telegram_user.id)
-        return image_url
+        key = prompt_hash(message, size, self.image_model)
+        digests = self._reused_images(key, n) if self.reuse_images else []
+        if digests:
+            logger.debug(f"Serving images {digests} from the image store")
+            image_store_reused_total.inc(len(digests))
+            db.insert_images_from_gpt(message, [("", digest) for digest in digests], telegram_user.id, size, key)
+            return [self.images.path(digest) for digest in digests]
+
+        with ThreadPoolExecutor(max_workers=n, thread_name_prefix="image") as pool:
+            if self.image_model.startswith("dall-e-3"):
+                # DALL-E 3 only generates one image per request, the variants are requested concurrently
+                futures = [pool.submit(self._request_images, message, size, 1, telegram_user.id) for _ in range(n)]
+                images = [image for future in futures for image in future.result()]
+            else:
+                images = self._request_images(message, size, n, telegram_user.id)
+            # Images returned as URLs are downloaded concurrently
+            contents = list(pool.map(self._image_bytes, images))
+        digests = self.images.put_many(contents)
+        db.insert_images_from_gpt(
+            message,
+            [(image.url or "", digest) for image, digest in zip(images, digests, strict=True)],
+            telegram_user.id,
+            size,
+            key,
+        )
+        return [self.images.path(digest) for digest in digests]
 
     def _clean_up_user_messages(self: Self, telegram_user: User) -> int:
         """Delete all user's message data."""
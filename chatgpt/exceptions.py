@@ -1,2 +1,37 @@
+from typing import Self
+
+
 class InvalidChoiceError(Exception):
     pass
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while the OpenAI circuit breaker is open."""
+
+    def __init__(self: Self, retry_after: float) -> None:
+        self.retry_after = retry_after
+        super().__init__(f"OpenAI is unavailable, retry in {retry_after:.0f}s")
+
+
+class QuotaExceededError(Exception):
+    """Raised instead of sending a request for a user who used up their daily token quota."""
+
+    def __init__(self: Self, used: int, quota: int) -> None:
+        self.used = used
+        self.quota = quota
+        super().__init__(f"Daily token quota exceeded, {used}/{quota} tokens used")
+
+
+class CassetteMissError(KeyError):
+    """Raised when replaying a request that is not in the cassette."""
+
+
+class CancelledCompletionError(Exception):
+    """Raised instead of returning a chat completion whose reply is no longer wanted.
+
+    ``completion`` is the part of the answer received before the request was aborted, None if it was not sent.
+    """
+
+    def __init__(self: Self, completion: str | None = None) -> None:
+        self.completion = completion
+        super().__init__("The chat completion was cancelled")
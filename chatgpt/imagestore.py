@@ -0,0 +1,210 @@
+"""Content-addressed local store of generated images."""
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Self
+
+from loguru import logger
+
+from monitoring.metrics import REGISTRY
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+# Extensions of the formats the images API returns, the first one is used for unknown content
+EXTENSIONS = ("png", "jpg", "webp", "gif")
+
+image_store_bytes = REGISTRY.gauge("image_store_bytes", "Bytes of images held by the local image store.")
+image_store_reused_total = REGISTRY.counter(
+    "image_store_reused_total",
+    "Image requests answered with a stored image generated from the same request.",
+)
+image_store_evictions_total = REGISTRY.counter(
+    "image_store_evictions_total",
+    "Images evicted from the local image store to stay under its size limit.",
+)
+
+
+def prompt_hash(prompt: str, size: str, model: str) -> str:
+    """Key of an image request, identical for prompts differing only by case and whitespace."""
+    normalized = " ".join(prompt.lower().split())
+    return hashlib.sha256(f"{model}\n{size}\n{normalized}".encode()).hexdigest()
+
+
+def image_extension(data: bytes) -> str:
+    """Extension of an image from its magic bytes, png when the format is not recognized."""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[:6] in {b"GIF87a", b"GIF89a"}:
+        return "gif"
+    return "png"
+
+
+class ImageStore(object):
+    """Images stored once under the sha256 of their content, with the extension of their format.
+
+    Files are written to a temporary file, fsynced and renamed so that a crash never leaves a partial image under
+    a valid name. Once the store grows over ``max_bytes``, the least recently used images, by modification time
+    which is refreshed on every read, are evicted down to 90% of the limit.
+    """
+
+    def __init__(self: Self, root: str, max_bytes: int = 0) -> None:
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._size: int | None = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls: type[Self]) -> Self:
+        """Build the store configured with ``IMAGE_STORE_DIR`` and ``IMAGE_STORE_MAX_MB``, 0 for no limit."""
+        from main import env  # noqa: PLC0415
+
+        return cls(env.str("IMAGE_STORE_DIR", "images"), env.int("IMAGE_STORE_MAX_MB", 1024) * 1024 * 1024)
+
+    def _path(self: Self, digest: str, extension: str) -> Path:
+        # Fanned out in two levels of directories to keep directories small
+        return self.root / digest[:2] / digest[2:4] / f"{digest}.{extension}"
+
+    def path(self: Self, digest: str) -> Path:
+        """Path of a stored image, whatever its format, the png path if it is not stored."""
+        for extension in EXTENSIONS:
+            path = self._path(digest, extension)
+            if path.exists():
+                return path
+        return self._path(digest, EXTENSIONS[0])
+
+    def _files(self: Self) -> list[Path]:
+        if not self.root.exists():
+            return []
+        return [file for extension in EXTENSIONS for file in self.root.glob(f"*/*/*.{extension}")]
+
+    def _current_size(self: Self) -> int:
+        if self._size is None:
+            self._size = sum(file.stat().st_size for file in self._files())
+            image_store_bytes.set(self._size)
+        return self._size
+
+    def put(self: Self, data: bytes) -> str:
+        """Store an image, return its sha256."""
+        return self.put_many([data])[0]
+
+    def put_many(self: Self, contents: Iterable[bytes]) -> list[str]:
+        """Store several images, e.g. the variants of a request, return their sha256.
+
+        The store is evicted once all of them are written, so that none of them is evicted before it is sent.
+        """
+        digests = []
+        paths = set()
+        with self._lock:
+            for data in contents:
+                digest = hashlib.sha256(data).hexdigest()
+                paths.add(self._write(digest, data))
+                digests.append(digest)
+            if self.max_bytes and self._current_size() > self.max_bytes:
+                self._evict(keep=paths)
+        return digests
+
+    def _write(self: Self, digest: str, data: bytes) -> Path:
+        """Write an image unless it is already stored, the lock being held."""
+        path = self.path(digest)
+        if path.exists():
+            path.touch()
+            return path
+        path = self._path(digest, image_extension(data))
+        size = self._current_size()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            Path(temporary).replace(path)
+        except BaseException:
+            Path(temporary).unlink(missing_ok=True)
+            raise
+        # The rename is only durable once the directory entry is
+        directory = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        self._size = size + len(data)
+        image_store_bytes.set(self._size)
+        return path
+
+    def get(self: Self, digest: str) -> Path | None:
+        """Path of a stored image, None if it is not or no longer stored."""
+        path = self.path(digest)
+        try:
+            # Refresh the modification time, which orders evictions
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def _evict(self: Self, keep: set[Path]) -> None:
+        """Delete the least recently used images until the store is under 90% of its limit."""
+        target = self.max_bytes * 0.9
+        files = []
+        for file in self._files():
+            with contextlib.suppress(FileNotFoundError):
+                stat = file.stat()
+                files.append((stat.st_mtime, stat.st_size, file))
+        size = sum(file_size for _, file_size, _ in files)
+        evicted = 0
+        for _, file_size, file in sorted(files, key=lambda entry: entry[0]):
+            if size <= target:
+                break
+            if file in keep:
+                continue
+            file.unlink(missing_ok=True)
+            size -= file_size
+            evicted += 1
+        self._size = size
+        image_store_bytes.set(size)
+        image_store_evictions_total.inc(evicted)
+        logger.info(f"Evicted {evicted} images from {self.root}, {size / 1024 / 1024:.1f}MB left")
+
+    def purge_unreferenced(self: Self, referenced: set[str], grace: float, *, dry_run: bool = False) -> tuple[int, int]:
+        """Delete the images no stored message references any more, e.g. those of purged messages.
+
+        Images are stored before the message referencing them, so images modified within the last ``grace`` seconds
+        are kept.
+
+        Args:
+            referenced (set[str]): The sha256 of the images still referenced.
+            grace (float): Seconds during which a new image is kept even if it is not referenced yet.
+            dry_run (bool): Only count what would be deleted.
+
+        Returns
+        -------
+            tuple[int, int]: The number of images and the bytes deleted.
+        """
+        cutoff = time.time() - grace
+        files = size = 0
+        with self._lock:
+            for file in self._files():
+                if file.stem in referenced:
+                    continue
+                with contextlib.suppress(FileNotFoundError):
+                    stat = file.stat()
+                    if stat.st_mtime > cutoff:
+                        continue
+                    if not dry_run:
+                        file.unlink()
+                    files += 1
+                    size += stat.st_size
+            if not dry_run and self._size is not None:
+                self._size = max(self._size - size, 0)
+                image_store_bytes.set(self._size)
+        return files, size
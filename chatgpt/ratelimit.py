@@ -0,0 +1,202 @@
+"""Client-side request and token rate limiting of OpenAI requests."""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Self
+
+from loguru import logger
+
+from monitoring.metrics import REGISTRY
+
+WILDCARD = "*"
+
+rate_limit_wait_seconds = REGISTRY.histogram(
+    "openai_rate_limit_wait_seconds",
+    "Time OpenAI requests waited for the client-side rate limiter.",
+    ("backend", "model"),
+)
+rate_limit_waiting = REGISTRY.gauge(
+    "openai_rate_limit_waiting",
+    "OpenAI requests queued by the client-side rate limiter.",
+    ("backend", "model"),
+)
+
+
+class TokenBucket(object):
+    """Bucket refilled continuously with ``per_minute`` tokens a minute, up to ``per_minute`` tokens.
+
+    The level may go below zero when a request turns out to use more tokens than estimated, the debt is paid
+    back by the refill before new requests are let through.
+    """
+
+    def __init__(self: Self, per_minute: float) -> None:
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self: Self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self: Self, amount: float, now: float) -> float:
+        """Seconds until ``amount`` tokens are available, 0 if they are available now."""
+        self._refill(now)
+        # A request larger than the bucket is let through once the bucket is full
+        missing = min(amount, self.capacity) - self.level
+        return max(missing / self.rate, 0.0)
+
+    def adjust(self: Self, amount: float) -> None:
+        """Add tokens to the bucket, or remove them when ``amount`` is negative."""
+        self.level = min(self.capacity, self.level + amount)
+
+
+class ModelLimits(object):
+    """Requests per minute and tokens per minute allowed for a model, 0 meaning unlimited."""
+
+    def __init__(self: Self, rpm: int = 0, tpm: int = 0) -> None:
+        self.rpm = rpm
+        self.tpm = tpm
+
+
+class Reservation(object):
+    """Capacity granted to a request, settled once its actual usage is known."""
+
+    def __init__(self: Self, key: tuple[str, str], tokens: int) -> None:
+        self.key = key
+        self.tokens = tokens
+
+
+class _LimitedKey(object):
+    """Buckets and queue of waiting requests of one (backend, model) pair."""
+
+    def __init__(self: Self, limits: ModelLimits) -> None:
+        self.requests = TokenBucket(limits.rpm) if limits.rpm else None
+        self.tokens = TokenBucket(limits.tpm) if limits.tpm else None
+        # Waiting tickets by user, in round-robin order
+        self.waiting: OrderedDict[Any, deque[object]] = OrderedDict()
+
+    def wait_time(self: Self, tokens: int, now: float) -> float:
+        waits = [0.0]
+        if self.requests is not None:
+            waits.append(self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            waits.append(self.tokens.wait_time(tokens, now))
+        return max(waits)
+
+    def consume(self: Self, tokens: int) -> None:
+        if self.requests is not None:
+            self.requests.adjust(-1)
+        if self.tokens is not None:
+            self.tokens.adjust(-tokens)
+
+
+class RateLimiter(object):
+    """Limit requests and tokens per minute for every (backend, model) pair.
+
+    Requests over the limit are queued rather than rejected. Waiting requests are served round-robin across
+    users: a user sending a burst of requests only gets every other slot while someone else is waiting, instead
+    of delaying everyone behind the burst.
+
+    Token usage is reserved from a local estimate before the request is sent and corrected with the ``usage``
+    returned by the API once it answers.
+    """
+
+    def __init__(self: Self, limits: dict[str, ModelLimits] | None = None) -> None:
+        self.limits = limits or {}
+        self._keys: dict[tuple[str, str], _LimitedKey | None] = {}
+        self._condition = threading.Condition()
+
+    @classmethod
+    def from_env(cls: type[Self]) -> Self:
+        """Build a limiter from ``GPT_RATE_LIMITS``, a JSON object mapping models to ``rpm`` and ``tpm``."""
+        from main import env  # noqa: PLC0415
+
+        config = json.loads(env.str("GPT_RATE_LIMITS", "") or "{}")
+        return cls(
+            {model: ModelLimits(int(limit.get("rpm", 0)), int(limit.get("tpm", 0))) for model, limit in config.items()},
+        )
+
+    def _limited_key(self: Self, key: tuple[str, str]) -> _LimitedKey | None:
+        if key not in self._keys:
+            limits = self.limits.get(key[1], self.limits.get(WILDCARD))
+            self._keys[key] = _LimitedKey(limits) if limits and (limits.rpm or limits.tpm) else None
+        return self._keys[key]
+
+    def has_budget(self: Self, backend: str, model: str, tokens: int) -> bool:
+        """Whether a request would be sent at once, without waiting for the limiter.
+
+        Args:
+            backend (str): Name of the backend.
+            model (str): The requested model.
+            tokens (int): Estimated tokens used by the request.
+        """
+        with self._condition:
+            limited = self._limited_key((backend, model))
+            return limited is None or (not limited.waiting and limited.wait_time(tokens, time.monotonic()) <= 0)
+
+    def acquire(self: Self, backend: str, model: str, tokens: int, user: Any = None) -> Reservation:
+        """Wait until a request may be sent.
+
+        Args:
+            backend (str): Name of the backend, each backend has its own key and thus its own limits.
+            model (str): The requested model, before the model map of the backend is applied.
+            tokens (int): Estimated tokens used by the request, prompt and completion.
+            user (Any): Who the request is sent for, used for fair queuing.
+
+        Returns
+        -------
+            Reservation: To be settled with the actual usage once the request completed.
+        """
+        key = (backend, model)
+        reservation = Reservation(key, tokens)
+        with self._condition:
+            limited = self._limited_key(key)
+            if limited is None:
+                return reservation
+            ticket = object()
+            limited.waiting.setdefault(user, deque()).append(ticket)
+            start = time.monotonic()
+            rate_limit_waiting.inc(backend=backend, model=model)
+            try:
+                while True:
+                    tickets = next(iter(limited.waiting.values()))
+                    if tickets[0] is not ticket:
+                        self._condition.wait()
+                        continue
+                    wait = limited.wait_time(tokens, time.monotonic())
+                    if wait <= 0:
+                        break
+                    self._condition.wait(wait)
+                limited.consume(tokens)
+            finally:
+                self._dequeue(limited, user, ticket)
+                rate_limit_waiting.dec(backend=backend, model=model)
+        waited = time.monotonic() - start
+        rate_limit_wait_seconds.observe(waited, backend=backend, model=model)
+        if waited > 1:
+            logger.debug(f"Request to {model} on {backend} waited {waited:.1f}s for the rate limiter")
+        return reservation
+
+    def _dequeue(self: Self, limited: _LimitedKey, user: Any, ticket: object) -> None:
+        """Remove a ticket and move its user to the back of the round, so that other users go first."""
+        tickets = limited.waiting.pop(user)
+        tickets.remove(ticket)
+        if tickets:
+            limited.waiting[user] = tickets
+        self._condition.notify_all()
+
+    def settle(self: Self, reservation: Reservation, used_tokens: int | None) -> None:
+        """Correct the token bucket with the tokens actually used by a request."""
+        if used_tokens is None or used_tokens == reservation.tokens:
+            return
+        with self._condition:
+            limited = self._keys.get(reservation.key)
+            if limited is None or limited.tokens is None:
+                return
+            limited.tokens.adjust(reservation.tokens - used_tokens)
+            self._condition.notify_all()
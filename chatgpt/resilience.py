@@ -0,0 +1,341 @@
+"""Retries, circuit breaking and hedging of OpenAI requests."""
+
+from __future__ import annotations
+
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import TYPE_CHECKING, Self, TypeVar
+
+import openai
+from loguru import logger
+
+from chatgpt.exceptions import CancelledCompletionError, CircuitOpenError
+from monitoring.metrics import REGISTRY
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS_CODES = frozenset({408, 409, 429})
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+retries_total = REGISTRY.counter("openai_retries_total", "OpenAI requests retried after a failure.", ("reason",))
+failures_total = REGISTRY.counter("openai_failures_total", "OpenAI requests failed after all retries.", ("reason",))
+circuit_state = REGISTRY.gauge("openai_circuit_state", "OpenAI circuit breaker state (0 closed, 1 half open, 2 open).")
+circuit_rejections_total = REGISTRY.counter(
+    "openai_circuit_rejections_total",
+    "OpenAI requests rejected without being sent because the circuit was open.",
+)
+hedges_total = REGISTRY.counter("openai_hedges_total", "Hedged OpenAI requests by winner.", ("winner",))
+hedges_skipped_total = REGISTRY.counter(
+    "openai_hedges_skipped_total",
+    "Slow OpenAI requests that were not hedged because the extra request budget was spent.",
+)
+
+
+def failure_reason(error: BaseException) -> str:
+    """Short label describing an error, used in metrics."""
+    if isinstance(error, openai.APIStatusError):
+        return str(error.status_code)
+    if isinstance(error, openai.APITimeoutError):
+        return "timeout"
+    if isinstance(error, openai.APIConnectionError):
+        return "connection"
+    return type(error).__name__
+
+
+class RetryPolicy(object):
+    """Exponential backoff with full jitter for transient errors.
+
+    The delay before retry ``n`` is drawn uniformly between 0 and ``min(max_delay, base_delay * 2**n)``, so that
+    clients failing together do not retry together. A ``Retry-After`` header sent by the server takes precedence.
+    """
+
+    def __init__(self: Self, max_retries: int = 3, base_delay: float = 0.5, max_delay: float = 8.0) -> None:
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @staticmethod
+    def is_retryable(error: BaseException) -> bool:
+        """Whether a request failing with this error may succeed when sent again."""
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+        return isinstance(error, openai.APIConnectionError)
+
+    def delay(self: Self, retry: int, error: BaseException | None = None) -> float:
+        """Seconds to wait before the given retry, starting at 0."""
+        if isinstance(error, openai.APIStatusError):
+            retry_after = error.response.headers.get("retry-after")
+            try:
+                if retry_after is not None:
+                    return min(max(float(retry_after), 0.0), self.max_delay)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**retry))  # noqa: S311
+
+
+class CircuitBreaker(object):
+    """Fail fast while the upstream is down.
+
+    The circuit opens after ``failure_threshold`` consecutive failures. While open, requests are rejected with
+    ``CircuitOpenError`` for ``reset_timeout`` seconds, after which a single probe request is let through: the
+    circuit closes if it succeeds and opens again if it fails.
+    """
+
+    def __init__(self: Self, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _set_state(self: Self, state: str) -> None:
+        if state != self.state:
+            logger.warning(f"OpenAI circuit breaker {self.state} -> {state}")
+        self.state = state
+        circuit_state.set(_STATE_VALUES[state])
+
+    def before_call(self: Self) -> None:
+        """Reserve the right to send a request, raise CircuitOpenError if it must not be sent."""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if self.state == OPEN and remaining <= 0:
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+        circuit_rejections_total.inc()
+        raise CircuitOpenError(max(remaining, 0.0))
+
+    def record_success(self: Self) -> None:
+        """Record a successful request."""
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            self._set_state(CLOSED)
+
+    def record_cancelled(self: Self) -> None:
+        """Record a request cancelled by the caller, which says nothing about the health of the upstream."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self: Self) -> None:
+        """Record a failed request."""
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+
+class LatencyTracker(object):
+    """Sliding window of the latest request latencies."""
+
+    def __init__(self: Self, window: int = 200, min_samples: int = 20) -> None:
+        self.min_samples = min_samples
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self: Self, latency: float) -> None:
+        """Record the latency of a successful request."""
+        with self._lock:
+            self._latencies.append(latency)
+
+    def percentile(self: Self, fraction: float) -> float | None:
+        """Latency percentile over the window, None until enough requests were observed."""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+class AttemptTimer(object):
+    """Time the request sent by an attempt, from the moment the rate limiter let it through.
+
+    Waiting for the rate limiter says nothing about how slow the upstream is, a throttled request is neither
+    observed as slow nor hedged into the same saturated limiter.
+    """
+
+    def __init__(self: Self) -> None:
+        self.started_at: float | None = None
+        # Set once the request is sent, or once the attempt ended without sending it
+        self.sent = threading.Event()
+
+    def start(self: Self) -> None:
+        """Mark the request as sent."""
+        self.started_at = time.perf_counter()
+        self.sent.set()
+
+    def elapsed(self: Self) -> float | None:
+        """Seconds since the request was sent, None if it was not."""
+        return None if self.started_at is None else time.perf_counter() - self.started_at
+
+
+class HedgeBudget(object):
+    """Token bucket limiting hedged requests to a fraction of all requests.
+
+    Every request adds ``ratio`` tokens to the bucket and every hedge spends one, so that hedging never adds
+    more than ``ratio`` extra requests per request, even when the upstream slows down as a whole.
+    """
+
+    def __init__(self: Self, ratio: float, burst: float = 10.0) -> None:
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = 0.0
+        self._lock = threading.Lock()
+
+    def deposit(self: Self) -> None:
+        """Account for a request."""
+        with self._lock:
+            self.tokens = min(self.tokens + self.ratio, self.burst)
+
+    def withdraw(self: Self) -> bool:
+        """Spend a token for a hedge, return False when the budget is exhausted."""
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class ResilientCaller(object):
+    """Send a request through the circuit breaker, retrying and hedging it as configured.
+
+    Hedging is enabled when ``hedge_ratio`` is positive: when a request is still running after the observed
+    ``hedge_percentile`` latency, an identical request is sent and whichever finishes first is used. The other
+    request is left to finish in the background and its result is discarded. Latencies are tracked per operation,
+    e.g. streamed completions of a model, since an image generation is always slower than a chat completion.
+    """
+
+    def __init__(
+        self: Self,
+        retry: RetryPolicy,
+        breaker: CircuitBreaker,
+        hedge_ratio: float = 0.0,
+        hedge_percentile: float = 0.95,
+    ) -> None:
+        self.retry = retry
+        self.breaker = breaker
+        self.latencies: dict[str, LatencyTracker] = {}
+        self._latencies_lock = threading.Lock()
+        self.hedge_budget = HedgeBudget(hedge_ratio)
+        self.hedge_percentile = hedge_percentile
+        self._executor = ThreadPoolExecutor(thread_name_prefix="openai-hedge") if hedge_ratio > 0 else None
+
+    @classmethod
+    def from_env(cls: type[Self]) -> Self:
+        """Build a caller configured with the ``GPT_*`` environment variables."""
+        from main import env  # noqa: PLC0415
+
+        return cls(
+            RetryPolicy(
+                env.int("GPT_MAX_RETRIES", 3),
+                env.float("GPT_RETRY_BASE_DELAY", 0.5),
+                env.float("GPT_RETRY_MAX_DELAY", 8.0),
+            ),
+            CircuitBreaker(env.int("GPT_CIRCUIT_FAILURES", 5), env.float("GPT_CIRCUIT_RESET", 30.0)),
+            env.float("GPT_HEDGE_BUDGET", 0.0),
+            env.float("GPT_HEDGE_PERCENTILE", 0.95),
+        )
+
+    def _tracker(self: Self, operation: str) -> LatencyTracker:
+        with self._latencies_lock:
+            if operation not in self.latencies:
+                self.latencies[operation] = LatencyTracker()
+            return self.latencies[operation]
+
+    def call(self: Self, request: Callable[[AttemptTimer], T], operation: str = "request", *, hedge: bool = True) -> T:
+        """Send a request, retrying transient errors.
+
+        Args:
+            request (Callable): Sends the request, called with the timer to start once it is actually sent.
+            operation (str): The kind of request, e.g. the endpoint and model, latencies are tracked per operation.
+            hedge (bool): Whether the request may be hedged, False for requests too costly to send twice.
+
+        Raises
+        ------
+            CircuitOpenError: If the circuit is open, before or between attempts.
+        """
+        retry = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                response = self._attempt(request, self._tracker(operation), hedge=hedge)
+            except CancelledCompletionError:
+                self.breaker.record_cancelled()
+                raise
+            except Exception as e:
+                retryable = self.retry.is_retryable(e)
+                # Client errors such as an invalid request say nothing about the health of the upstream
+                if retryable or not isinstance(e, openai.APIStatusError):
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                if not retryable or retry >= self.retry.max_retries:
+                    failures_total.inc(reason=failure_reason(e))
+                    raise
+                delay = self.retry.delay(retry, e)
+                retries_total.inc(reason=failure_reason(e))
+                logger.warning(f"OpenAI request failed ({e}), retrying in {delay:.2f}s")
+                retry += 1
+                time.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return response
+
+    @staticmethod
+    def _timed(request: Callable[[AttemptTimer], T], latencies: LatencyTracker, timer: AttemptTimer) -> T:
+        try:
+            response = request(timer)
+        finally:
+            timer.sent.set()
+        elapsed = timer.elapsed()
+        if elapsed is not None:
+            latencies.observe(elapsed)
+        return response
+
+    def _attempt(self: Self, request: Callable[[AttemptTimer], T], latencies: LatencyTracker, *, hedge: bool) -> T:
+        threshold = latencies.percentile(self.hedge_percentile)
+        if self._executor is None or not hedge or threshold is None:
+            return self._timed(request, latencies, AttemptTimer())
+
+        self.hedge_budget.deposit()
+        timer = AttemptTimer()
+        primary = self._executor.submit(self._timed, request, latencies, timer)
+        # The request is slow once it was sent for longer than the threshold, waiting for the rate limiter excluded
+        timer.sent.wait()
+        done, _ = wait([primary], timeout=max(threshold - (timer.elapsed() or 0.0), 0.0))
+        if done:
+            return primary.result()
+        if not self.hedge_budget.withdraw():
+            hedges_skipped_total.inc()
+            return primary.result()
+
+        logger.debug(f"OpenAI request slower than {threshold:.2f}s, sending a hedged request")
+        hedged = self._executor.submit(self._timed, request, latencies, AttemptTimer())
+        pending: set[Future[T]] = {primary, hedged}
+        error: BaseException | None = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    hedges_total.inc(winner="primary" if future is primary else "hedge")
+                    return future.result()
+                error = future.exception()
+        # Both requests failed
+        raise error  # type: ignore[misc]
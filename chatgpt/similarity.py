@@ -0,0 +1,178 @@
+"""Near-duplicate cache of chat completions of single-turn prompts, based on SimHash signatures."""
+
+from __future__ import annotations
+
+import hashlib
+import re
+import threading
+import time
+from collections import Counter
+from itertools import pairwise
+from typing import TYPE_CHECKING, Self
+
+import numpy as np
+
+from chatgpt.cassette import request_key
+from chatgpt.tokens import count_tokens
+from chatgpt.utils import UserType
+from monitoring.metrics import REGISTRY, hit_ratio
+
+if TYPE_CHECKING:
+    from openai.types.chat import ChatCompletion
+
+# Signatures are made of several 64 bit words, the similarity of short prompts is too noisy with a single word
+SIGNATURE_WORDS = 4
+SIGNATURE_BITS = SIGNATURE_WORDS * 64
+_BIT_POSITIONS = np.arange(64, dtype=np.uint64)
+_WORD = re.compile(r"\w+")
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+
+similar_cache_requests_total = REGISTRY.counter(
+    "openai_similar_cache_requests_total",
+    "Chat completions looked up in the near-duplicate cache by result (hit or miss).",
+    ("result",),
+)
+REGISTRY.gauge(
+    "openai_similar_cache_hit_ratio",
+    "Share of the chat completions looked up in the near-duplicate cache answered from it.",
+    callback=hit_ratio(similar_cache_requests_total),
+)
+similar_cache_similarity = REGISTRY.histogram(
+    "openai_similar_cache_similarity",
+    "Signature similarity of the prompts answered from the near-duplicate cache.",
+    buckets=(0.8, 0.85, 0.9, 0.95, 0.98, 1.0),
+)
+
+
+def features(text: str) -> Counter[str]:
+    """Words and word pairs of a lower-cased text, ignoring punctuation, with their counts."""
+    words = _WORD.findall(text.lower())
+    return Counter(words + [f"{first} {second}" for first, second in pairwise(words)])
+
+
+def simhash(text: str) -> np.ndarray:
+    """SimHash signature of a text, texts sharing most of their features get signatures a few bits apart."""
+    counts = features(text)
+    if not counts:
+        return np.zeros(SIGNATURE_WORDS, dtype=np.uint64)
+    digest_size = SIGNATURE_WORDS * 8
+    digests = b"".join(hashlib.blake2b(feature.encode(), digest_size=digest_size).digest() for feature in counts)
+    hashes = np.frombuffer(digests, dtype="<u8").reshape(len(counts), SIGNATURE_WORDS)
+    weights = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+    # Features x words x bits, every feature votes for the bits it has set and against the others
+    bits = ((hashes[:, :, None] >> _BIT_POSITIONS) & np.uint64(1)).astype(np.float64)
+    votes = np.einsum("f,fwb->wb", weights, 2 * bits - 1)
+    return np.where(votes > 0, np.left_shift(np.uint64(1), _BIT_POSITIONS), np.uint64(0)).sum(axis=1, dtype=np.uint64)
+
+
+def similarity(first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    """Fraction of equal bits between signatures, vectorized over the leading dimensions of ``first``."""
+    return 1 - np.bitwise_count(np.bitwise_xor(first, second)).sum(axis=-1) / SIGNATURE_BITS
+
+
+def namespace(model: str, messages: list[dict[str, str]], prompt: str) -> int:
+    """Key of the requests a prompt may be matched with: same model, system messages and numbers.
+
+    Numbers are part of the key since questions differing only by a number get nearly identical signatures but
+    different answers.
+    """
+    system = [message for message in messages if message.get("role") == UserType.SYSTEM.value]
+    key = request_key(model, [*system, {"role": "numbers", "content": " ".join(_NUMBER.findall(prompt))}])
+    return int(key[:15], 16)
+
+
+def single_prompt(messages: list[dict[str, str]]) -> str | None:
+    """The user message of a single-turn request, None for requests carrying a conversation history."""
+    others = [message for message in messages if message.get("role") != UserType.SYSTEM.value]
+    if len(others) != 1 or others[0].get("role") != UserType.USER.value:
+        return None
+    return str(others[0].get("content", ""))
+
+
+class SimilarPromptCache(object):
+    """Answer single-turn prompts with the completion of a previous prompt whose signature is similar enough.
+
+    Signatures are kept in a ring buffer of ``max_entries`` slots and looked up with a vectorized scan of the
+    Hamming distances, which takes microseconds for tens of thousands of entries. Like the exact-match cache, only
+    single-turn short prompts are indexed and answered, so no conversation history is ever shared between users,
+    and cached completions are returned without their usage.
+    """
+
+    def __init__(
+        self: Self,
+        max_entries: int = 0,
+        ttl: float = 3600,
+        threshold: float = 0.9,
+        max_prompt_tokens: int = 64,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.max_prompt_tokens = max_prompt_tokens
+        self._signatures = np.zeros((max_entries, SIGNATURE_WORDS), dtype=np.uint64)
+        self._namespaces = np.zeros(max_entries, dtype=np.int64)
+        self._expires = np.zeros(max_entries, dtype=np.float64)
+        self._responses: list[ChatCompletion | None] = [None] * max_entries
+        self._next = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls: type[Self]) -> Self:
+        """Build the cache configured with ``GPT_SIMILAR_CACHE_*``, disabled unless its size is set."""
+        from main import env  # noqa: PLC0415
+
+        return cls(
+            env.int("GPT_SIMILAR_CACHE_SIZE", 0),
+            env.float("GPT_SIMILAR_CACHE_TTL", 3600),
+            env.float("GPT_SIMILAR_CACHE_THRESHOLD", 0.9),
+            env.int("GPT_SIMILAR_CACHE_MAX_PROMPT_TOKENS", 64),
+        )
+
+    @property
+    def enabled(self: Self) -> bool:
+        """Whether completions are indexed at all."""
+        return self.max_entries > 0
+
+    def prompt(self: Self, model: str, messages: list[dict[str, str]]) -> str | None:
+        """The prompt of a request that may be indexed and answered, None otherwise."""
+        if not self.enabled:
+            return None
+        prompt = single_prompt(messages)
+        if prompt is None or count_tokens(prompt, model) > self.max_prompt_tokens:
+            return None
+        return prompt
+
+    def get(self: Self, model: str, messages: list[dict[str, str]]) -> ChatCompletion | None:
+        """Return the completion of the most similar indexed prompt, None if none is similar enough."""
+        prompt = self.prompt(model, messages)
+        if prompt is None:
+            return None
+        signature = simhash(prompt)
+        space = namespace(model, messages, prompt)
+        with self._lock:
+            scores = similarity(self._signatures, signature)
+            scores[(self._namespaces != space) | (self._expires <= time.monotonic())] = -1
+            best = int(np.argmax(scores))
+            score = float(scores[best])
+            response = self._responses[best]
+        if score < self.threshold or response is None:
+            similar_cache_requests_total.inc(result="miss")
+            return None
+        similar_cache_requests_total.inc(result="hit")
+        similar_cache_similarity.observe(score)
+        return response.model_copy(update={"usage": None})
+
+    def put(self: Self, model: str, messages: list[dict[str, str]], response: ChatCompletion) -> None:
+        """Index the completion of a request, overwriting the oldest entry once the cache is full."""
+        prompt = self.prompt(model, messages)
+        if prompt is None:
+            return
+        signature = simhash(prompt)
+        space = namespace(model, messages, prompt)
+        with self._lock:
+            slot = self._next % self.max_entries
+            self._signatures[slot] = signature
+            self._namespaces[slot] = space
+            self._expires[slot] = time.monotonic() + self.ttl
+            self._responses[slot] = response
+            self._next += 1
@@ -0,0 +1,90 @@
+"""Chat completions streamed so that they can be aborted while they are generated."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any
+
+from openai.types.chat import ChatCompletion
+
+from chatgpt.exceptions import CancelledCompletionError
+from monitoring.metrics import REGISTRY
+
+if TYPE_CHECKING:
+    import threading
+
+    from openai import OpenAI
+    from openai.types.chat import ChatCompletionChunk
+
+completions_aborted_total = REGISTRY.counter(
+    "openai_completions_aborted_total",
+    "Streamed chat completions aborted before the end of the answer, by stage (waiting or streaming).",
+    ("stage",),
+)
+
+
+def completion_text(chunks: list[ChatCompletionChunk]) -> str:
+    """Content of the answer in the chunks received so far."""
+    return "".join(choice.delta.content or "" for chunk in chunks for choice in chunk.choices if choice.index == 0)
+
+
+def completion_from_chunks(chunks: list[ChatCompletionChunk]) -> ChatCompletion:
+    """Assemble the chunks of a streamed chat completion into the completion returned without streaming."""
+    first = chunks[0]
+    content = completion_text(chunks)
+    finish_reason = next(
+        (choice.finish_reason for chunk in chunks for choice in chunk.choices if choice.finish_reason),
+        "stop",
+    )
+    usage = next((chunk.usage for chunk in reversed(chunks) if chunk.usage is not None), None)
+    return ChatCompletion(
+        id=first.id,
+        object="chat.completion",
+        created=first.created,
+        model=first.model,
+        choices=[
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": finish_reason,
+            },
+        ],
+        usage=usage,
+    )
+
+
+def stream_completion(
+    client: OpenAI,
+    model: str,
+    messages: list[dict[str, Any]],
+    cancel: threading.Event,
+) -> ChatCompletion:
+    """Create a chat completion as a stream, closing the connection at the first chunk received after ``cancel`` is set.
+
+    Closing the connection makes OpenAI stop generating the answer, so the completion tokens that were not
+    generated yet are not billed.
+
+    Raises
+    ------
+        CancelledCompletionError: If ``cancel`` is set before the completion ends, with the answer received so far
+            if the request was sent.
+    """
+    if cancel.is_set():
+        raise CancelledCompletionError
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    chunks: list[ChatCompletionChunk] = []
+    with stream:
+        for chunk in stream:
+            if cancel.is_set():
+                # Leaving the block closes the connection
+                completions_aborted_total.inc(stage="streaming" if chunks else "waiting")
+                raise CancelledCompletionError(completion_text(chunks))
+            chunks.append(chunk)
+    if not chunks:
+        msg = "OpenAI returned an empty completion stream"
+        raise ValueError(msg)
+    return completion_from_chunks(chunks)
@@ -0,0 +1,231 @@
+"""Conversation title generation."""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import math
+import re
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter
+from functools import cache
+from typing import Self
+
+from asgiref.sync import sync_to_async
+from loguru import logger
+
+from chatgpt.exceptions import CircuitOpenError
+from sqlitedb.utils import PENDING_TITLE
+
+TITLE_WORDS = 6
+KEYWORDS = 4
+
+_WORD_RE = re.compile(r"[^\W_][\w'+#.-]*")
+
+_STOP_WORDS = """
+    a about above after again against all am an and any are as at be because been before being below between both
+    but by can could did do does doing down during each few for from further had has have having he her here hers
+    herself him himself his how i if in into is it its itself just me more most my myself no nor not now of off on
+    once only or other our ours ourselves out over own same she should so some such than that the their theirs them
+    themselves then there these they this those through to too under until up very was we were what when where which
+    while who whom why will with would you your yours yourself yourselves im ive id dont cant wont isnt whats hows
+    hi hello hey thanks thank please pls ok okay yes yeah sure help want need know tell explain show give make get
+    write create find
+    like let lets something anything thing things way use using also much many really maybe kind sort one two
+"""
+STOP_WORDS = frozenset(_STOP_WORDS.split())
+
+
+def fallback_title(message: str, words: int = TITLE_WORDS) -> str:
+    """Build a title from the first words of a message."""
+    title = " ".join(message.split()[:words])
+    return title[:255] or "Untitled"
+
+
+class TitleStrategy(ABC):
+    """How conversation titles are produced.
+
+    ``initial_title`` is used when a conversation is created. When ``deferred`` is True the conversation is also
+    queued for the background worker, which replaces its title with the output of ``generate``.
+    """
+
+    name = "base"
+    deferred = True
+
+    def initial_title(self: Self, message: str) -> str:
+        """Title given to a conversation when it is created."""
+        return PENDING_TITLE
+
+    @abstractmethod
+    def generate(self: Self, messages: list[str]) -> list[str]:
+        """Generate one title per first message."""
+
+
+class LocalTitleStrategy(TitleStrategy):
+    """Zero-latency extractive titles.
+
+    Words of the first message are ranked by TF-IDF after stop-word filtering, and the best ``KEYWORDS`` words
+    are kept in their original order. Document frequencies are accumulated over every message seen by the
+    process, so that words common to many conversations are ranked down over time.
+    """
+
+    name = "local"
+    deferred = False
+
+    def __init__(self: Self) -> None:
+        self.documents = 0
+        self.document_frequency: Counter[str] = Counter()
+        self._lock = threading.Lock()
+
+    def initial_title(self: Self, message: str) -> str:
+        return self.generate([message])[0]
+
+    def _observe(self: Self, messages: list[list[str]]) -> None:
+        with self._lock:
+            self.documents += len(messages)
+            for words in messages:
+                self.document_frequency.update({word.lower() for word in words})
+
+    def _idf(self: Self, word: str) -> float:
+        return math.log((1 + self.documents) / (1 + self.document_frequency[word])) + 1
+
+    def title(self: Self, words: list[str], message: str) -> str:
+        """Build the title of a single tokenized message."""
+        candidates = [(index, word) for index, word in enumerate(words) if word.lower() not in STOP_WORDS]
+        if not candidates:
+            return fallback_title(message)
+        frequencies = Counter(word.lower() for _, word in candidates)
+        first_seen: dict[str, tuple[int, str]] = {}
+        for index, word in candidates:
+            first_seen.setdefault(word.lower(), (index, word))
+
+        def score(word: str) -> float:
+            # Slightly favour longer words, which tend to carry the topic
+            return frequencies[word] * self._idf(word) * (1 + min(len(word), 12) / 24)
+
+        keywords = sorted(first_seen, key=score, reverse=True)[:KEYWORDS]
+        ordered = sorted(first_seen[keyword] for keyword in keywords)
+        # Keep the casing of words like PostgreSQL or CSV
+        title = " ".join(word if word.lower() != word else word.capitalize() for _, word in ordered)
+        return title[:255]
+
+    def generate(self: Self, messages: list[str]) -> list[str]:
+        tokenized = [[word.rstrip(".-'") for word in _WORD_RE.findall(message)] for message in messages]
+        self._observe(tokenized)
+        return [self.title(words, message) for words, message in zip(tokenized, messages, strict=True)]
+
+
+class LLMTitleStrategy(TitleStrategy):
+    """Titles generated by the model in the background, conversations start with a placeholder title."""
+
+    name = "llm"
+
+    def generate(self: Self, messages: list[str]) -> list[str]:
+        from main import gpt  # noqa: PLC0415
+
+        return gpt.generate_titles(messages)
+
+
+class HybridTitleStrategy(LLMTitleStrategy):
+    """Local titles right away, upgraded later by the model in the background."""
+
+    name = "hybrid"
+
+    def initial_title(self: Self, message: str) -> str:
+        return local_titles.generate([message])[0]
+
+
+local_titles = LocalTitleStrategy()
+
+TITLE_STRATEGIES: dict[str, type[TitleStrategy]] = {
+    LocalTitleStrategy.name: LocalTitleStrategy,
+    LLMTitleStrategy.name: LLMTitleStrategy,
+    HybridTitleStrategy.name: HybridTitleStrategy,
+}
+
+
+@cache
+def get_title_strategy() -> TitleStrategy:
+    """Return the strategy selected with ``TITLE_STRATEGY``."""
+    from main import env  # noqa: PLC0415
+
+    name = env.str("TITLE_STRATEGY", LLMTitleStrategy.name).lower()
+    if name == LocalTitleStrategy.name:
+        return local_titles
+    if name not in TITLE_STRATEGIES:
+        logger.warning(f"Unknown title strategy {name}, using {LLMTitleStrategy.name}")
+        name = LLMTitleStrategy.name
+    return TITLE_STRATEGIES[name]()
+
+
+class TitleWorker(object):
+    """Background job filling in the placeholder titles of new conversations.
+
+    Conversations are created with a placeholder title so that the first message of a conversation is answered
+    without waiting for a title. The worker wakes up when notified, or every ``interval`` seconds, waits ``delay``
+    seconds to let more conversations queue up and names up to ``batch_size`` of them with a single completion.
+    """
+
+    def __init__(self: Self) -> None:
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup: asyncio.Event | None = None
+        self.batch_size = 8
+        self.interval = 60.0
+        self.delay = 1.0
+
+    def notify(self: Self) -> None:
+        """Wake the worker up, safe to call from any thread."""
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def process_pending(self: Self) -> int:
+        """Generate titles for one batch of pending conversations.
+
+        Returns
+        -------
+            int: The number of conversations named.
+        """
+        from main import db  # noqa: PLC0415
+
+        pending = db.get_conversations_pending_title(self.batch_size)
+        if not pending:
+            return 0
+        messages = [message for _, message in pending]
+        try:
+            titles = get_title_strategy().generate(messages)
+        except CircuitOpenError as e:
+            # Keep the conversations pending, they are named once OpenAI is back
+            logger.info(f"Postponing title generation, {e}")
+            return 0
+        except Exception as e:
+            logger.exception(f"Unable to generate titles, falling back to local titles {e}")
+            titles = local_titles.generate(messages)
+        return db.set_conversation_titles(
+            {conversation_id: title for (conversation_id, _), title in zip(pending, titles, strict=True)},
+        )
+
+    async def run(self: Self) -> None:
+        """Process pending titles until cancelled."""
+        from main import env  # noqa: PLC0415
+
+        self.batch_size = env.int("TITLE_BATCH_SIZE", self.batch_size)
+        self.interval = env.float("TITLE_INTERVAL", self.interval)
+        self.delay = env.float("TITLE_BATCH_DELAY", self.delay)
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        logger.info("Starting title worker")
+        while True:
+            try:
+                # Not thread sensitive, so that the completion does not block the handlers DB thread
+                while await sync_to_async(self.process_pending, thread_sensitive=False)() >= self.batch_size:
+                    pass
+            except Exception as e:
+                logger.exception(f"Title worker failed {e}")
+            with contextlib.suppress(TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            self._wakeup.clear()
+            await asyncio.sleep(self.delay)
+
+
+title_worker = TitleWorker()
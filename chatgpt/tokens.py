@@ -0,0 +1,53 @@
+"""Local token counting."""
+
+from __future__ import annotations
+
+from functools import cache
+from typing import Any
+
+from loguru import logger
+
+DEFAULT_MODEL = "gpt-4o"
+DEFAULT_ENCODING = "o200k_base"
+# Average number of characters per token for English text, used when tiktoken is unavailable
+CHARS_PER_TOKEN = 4
+
+
+@cache
+def _encoding(model: str) -> Any:
+    """Return the tiktoken encoding for a model, or None if it cannot be loaded.
+
+    tiktoken downloads its BPE files on first use, so it can fail on hosts without network access.
+    """
+    try:
+        import tiktoken  # noqa: PLC0415
+    except ImportError:
+        logger.info("tiktoken is not installed, estimating token counts from text length")
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception as e:
+        logger.warning(f"Unable to load tiktoken encoding, estimating token counts from text length {e}")
+        return None
+
+
+def count_tokens(text: str, model: str = DEFAULT_MODEL) -> int:
+    """Count the tokens of a text for the given model.
+
+    Args:
+        text (str): The text to tokenize.
+        model (str): The model whose tokenizer should be used.
+
+    Returns
+    -------
+        int: The number of tokens in the text.
+    """
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
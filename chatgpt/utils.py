@@ -4,6 +4,8 @@ import secrets
 import string
 from enum import Enum
 
+from openai.types.chat import ChatCompletion
+
 from telegram.commands.utils import SupportedCommands
 
 
@@ -12,6 +14,7 @@ class UserType(Enum):
 
     ASSISTANT = "assistant"
     USER = "user"
+    SYSTEM = "system"
 
 
 class DataType(Enum):
@@ -41,25 +44,28 @@ def generate_random_string(length: int = 10) -> str:
     # Return the result string
 
 
-dummy_response = {
-    "choices": [
-        {
-            "finish_reason": "stop",
-            "index": 0,
-            "message": {
-                "content": "The 2020 World Series was played in Texas at Globe Life Field in Arlington.",
-                "role": "assistant",
+# Returned instead of sending requests when PROD is False, run scripts/openai_standin.py for realistic responses
+dummy_response = ChatCompletion.model_validate(
+    {
+        "choices": [
+            {
+                "finish_reason": "stop",
+                "index": 0,
+                "message": {
+                    "content": "The 2020 World Series was played in Texas at Globe Life Field in Arlington.",
+                    "role": "assistant",
+                },
+                "logprobs": None,
             },
-            "logprobs": "null",
+        ],
+        "created": 1677664795,
+        "id": "chatcmpl-7QyqpwdfhqwajicIEznoc6Q47XAyW",
+        "model": "gpt-4o-mini",
+        "object": "chat.completion",
+        "usage": {
+            "completion_tokens": 17,
+            "prompt_tokens": 57,
+            "total_tokens": 74,
         },
-    ],
-    "created": 1677664795,
-    "id": "chatcmpl-7QyqpwdfhqwajicIEznoc6Q47XAyW",
-    "model": "gpt-4o-mini",
-    "object": "chat.completion",
-    "usage": {
-        "completion_tokens": 17,
-        "prompt_tokens": 57,
-        "total_tokens": 74,
     },
-}
+)
@@ -0,0 +1,131 @@
+"""Prometheus text exposition of the metrics registry, served over HTTP from the bot process."""
+
+from __future__ import annotations
+
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING, Any, Self
+
+from loguru import logger
+
+from monitoring.metrics import REGISTRY, Counter, Gauge, Histogram, MetricsRegistry
+
+if TYPE_CHECKING:
+    from monitoring.metrics import LabelValues, Metric
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape_help(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape(value: str) -> str:
+    return _escape_help(value).replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values, strict=True)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _render_metric(metric: Metric) -> list[str]:
+    lines = [
+        f"# HELP {metric.name} {_escape_help(metric.description)}",
+        f"# TYPE {metric.name} {metric.kind}",
+    ]
+    if isinstance(metric, Histogram):
+        for key, sample in sorted(metric.snapshot().items()):
+            cumulative = 0
+            for bound, count in zip(metric.buckets, sample.buckets, strict=True):
+                cumulative += count
+                le = _labels(metric.labels, key, f'le="{_number(bound)}"')
+                lines.append(f"{metric.name}_bucket{le} {cumulative}")
+            inf = _labels(metric.labels, key, 'le="+Inf"')
+            lines.append(f"{metric.name}_bucket{inf} {sample.count}")
+            lines.append(f"{metric.name}_sum{_labels(metric.labels, key)} {_number(sample.sum)}")
+            lines.append(f"{metric.name}_count{_labels(metric.labels, key)} {sample.count}")
+    elif isinstance(metric, Counter | Gauge):
+        lines.extend(
+            f"{metric.name}{_labels(metric.labels, key)} {_number(value)}"
+            for key, value in sorted(metric.snapshot().items())
+        )
+    return lines
+
+
+def render(registry: MetricsRegistry = REGISTRY) -> str:
+    """Render every metric of a registry in the Prometheus text format.
+
+    Args:
+        registry (MetricsRegistry): The registry to render.
+
+    Returns
+    -------
+        str: The metrics, one sample per line.
+    """
+    lines = []
+    for metric in registry.metrics():
+        try:
+            lines.extend(_render_metric(metric))
+        except Exception as e:
+            # A failing gauge callback must not hide the other metrics
+            logger.warning(f"Unable to collect metric {metric.name} {e}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve ``GET /metrics``."""
+
+    def log_message(self: Self, format: str, *args: Any) -> None:  # noqa: A002
+        """Do not log scrapes."""
+
+    def do_GET(self: Self) -> None:
+        """Answer a scrape."""
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render(self.server.registry).encode()  # type: ignore[attr-defined]
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """Threaded HTTP server exposing a registry, answering scrapes even while the event loop is busy."""
+
+    daemon_threads = True
+
+    def __init__(self: Self, address: tuple[str, int], registry: MetricsRegistry = REGISTRY) -> None:
+        super().__init__(address, MetricsHandler)
+        self.registry = registry
+
+
+def start_metrics_server(host: str, port: int, registry: MetricsRegistry = REGISTRY) -> MetricsServer:
+    """Serve the metrics of a registry on ``http://host:port/metrics`` from a daemon thread.
+
+    Args:
+        host (str): The address to listen on.
+        port (int): The port to listen on, 0 picks a free one.
+        registry (MetricsRegistry): The registry to expose.
+
+    Returns
+    -------
+        MetricsServer: The running server.
+    """
+    server = MetricsServer((host, port), registry)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,36 @@
+"""Lag of the event loop, i.e. how late callbacks run because something blocks the loop."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Self
+
+from monitoring.metrics import REGISTRY
+
+event_loop_lag_seconds = REGISTRY.histogram(
+    "event_loop_lag_seconds",
+    "Delay between the scheduled and the actual wake-up of a sleeping task on the event loop.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+event_loop_lag_last_seconds = REGISTRY.gauge("event_loop_lag_last_seconds", "Latest event loop lag measured.")
+
+
+class EventLoopMonitor(object):
+    """Measure the event loop lag by sleeping ``interval`` seconds and timing how late the task wakes up.
+
+    A handler blocking the loop, e.g. with a synchronous query, delays the handling of every other update by as
+    much. Sleeping costs nothing while the loop is idle, so the overhead is one wake-up per interval.
+    """
+
+    def __init__(self: Self, interval: float = 0.5) -> None:
+        self.interval = interval
+
+    async def run(self: Self) -> None:
+        """Measure the lag forever."""
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(time.perf_counter() - start - self.interval, 0.0)
+            event_loop_lag_seconds.observe(lag)
+            event_loop_lag_last_seconds.set(lag)
@@ -0,0 +1,222 @@
+"""In-process metrics registry."""
+
+from __future__ import annotations
+
+import bisect
+import threading
+from typing import TYPE_CHECKING, Self
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+LabelValues = tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Metric(object):
+    """Base class of all metrics, a set of samples keyed by label values."""
+
+    kind = "untyped"
+
+    def __init__(self: Self, name: str, description: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._lock = threading.Lock()
+
+    def _key(self: Self, labels: dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+
+class Counter(Metric):
+    """A monotonically increasing value."""
+
+    kind = "counter"
+
+    def __init__(self: Self, name: str, description: str, labels: tuple[str, ...] = ()) -> None:
+        super().__init__(name, description, labels)
+        self.values: dict[LabelValues, float] = {}
+
+    def inc(self: Self, amount: float = 1, **labels: str) -> None:
+        """Increment the counter."""
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self: Self, **labels: str) -> float:
+        """Current value of the counter."""
+        return self.values.get(self._key(labels), 0)
+
+    def total(self: Self) -> float:
+        """Sum of the counter over all label values."""
+        return sum(self.values.values())
+
+    def snapshot(self: Self) -> dict[LabelValues, float]:
+        """Copy of the values of the counter, safe to read while it is updated."""
+        with self._lock:
+            return dict(self.values)
+
+
+class Gauge(Metric):
+    """A value that can go up and down, optionally computed on collection by a callback."""
+
+    kind = "gauge"
+
+    def __init__(
+        self: Self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...] = (),
+        callback: Callable[[], dict[LabelValues, float]] | None = None,
+    ) -> None:
+        super().__init__(name, description, labels)
+        self._values: dict[LabelValues, float] = {}
+        self.callback = callback
+
+    def set(self: Self, value: float, **labels: str) -> None:
+        """Set the gauge."""
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self: Self, amount: float = 1, **labels: str) -> None:
+        """Increment the gauge."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self: Self, amount: float = 1, **labels: str) -> None:
+        """Decrement the gauge."""
+        self.inc(-amount, **labels)
+
+    @property
+    def values(self: Self) -> dict[LabelValues, float]:
+        """Current values of the gauge."""
+        if self.callback:
+            return self.callback()
+        return self._values
+
+    def snapshot(self: Self) -> dict[LabelValues, float]:
+        """Copy of the values of the gauge, safe to read while it is updated."""
+        if self.callback:
+            return dict(self.callback())
+        with self._lock:
+            return dict(self._values)
+
+
+class HistogramSample(object):
+    """Bucket counts, sum and count of one label set of a histogram."""
+
+    def __init__(self: Self, buckets: int) -> None:
+        self.buckets = [0] * buckets
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(
+        self: Self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values: dict[LabelValues, HistogramSample] = {}
+
+    def observe(self: Self, value: float, **labels: str) -> None:
+        """Record an observation."""
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            sample = self.values.get(key)
+            if sample is None:
+                sample = self.values[key] = HistogramSample(len(self.buckets))
+            if index < len(self.buckets):
+                sample.buckets[index] += 1
+            sample.sum += value
+            sample.count += 1
+
+    def snapshot(self: Self) -> dict[LabelValues, HistogramSample]:
+        """Copy of the samples of the histogram, safe to read while it is updated."""
+        copies = {}
+        with self._lock:
+            for key, sample in self.values.items():
+                copy = copies[key] = HistogramSample(len(self.buckets))
+                copy.buckets = list(sample.buckets)
+                copy.sum = sample.sum
+                copy.count = sample.count
+        return copies
+
+
+class MetricsRegistry(object):
+    """Registry of all metrics of the process, metrics are created on first use."""
+
+    def __init__(self: Self) -> None:
+        self._metrics: dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self: Self, metric: Metric) -> Metric:
+        with self._lock:
+            existing = self._metrics.setdefault(metric.name, metric)
+        if type(existing) is not type(metric):
+            msg = f"Metric {metric.name} is already registered as a {existing.kind}"
+            raise ValueError(msg)
+        return existing
+
+    def counter(self: Self, name: str, description: str, labels: tuple[str, ...] = ()) -> Counter:
+        """Get or create a counter."""
+        return self._get_or_create(Counter(name, description, labels))  # type: ignore[return-value]
+
+    def gauge(
+        self: Self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...] = (),
+        callback: Callable[[], dict[LabelValues, float]] | None = None,
+    ) -> Gauge:
+        """Get or create a gauge."""
+        return self._get_or_create(Gauge(name, description, labels, callback))  # type: ignore[return-value]
+
+    def histogram(
+        self: Self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """Get or create a histogram."""
+        return self._get_or_create(Histogram(name, description, labels, buckets))  # type: ignore[return-value]
+
+    def metrics(self: Self) -> list[Metric]:
+        """All registered metrics sorted by name."""
+        with self._lock:
+            return [self._metrics[name] for name in sorted(self._metrics)]
+
+
+def hit_ratio(counter: Counter, hit: str = "hit") -> Callable[[], dict[LabelValues, float]]:
+    """Gauge callback computing the share of a counter labelled with a single result that is ``hit``.
+
+    Args:
+        counter (Counter): A counter with a single label, e.g. the requests of a cache by result.
+        hit (str): The label value counted as a hit.
+
+    Returns
+    -------
+        Callable: The callback, reporting nothing until the counter was incremented.
+    """
+
+    def collect() -> dict[LabelValues, float]:
+        values = counter.snapshot()
+        total = sum(values.values())
+        return {(): values.get((hit,), 0) / total} if total else {}
+
+    return collect
+
+
+REGISTRY = MetricsRegistry()
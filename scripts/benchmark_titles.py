@@ -0,0 +1,122 @@
+"""Benchmark the latency of conversation title strategies.
+
+For each strategy two latencies are reported per conversation: ``visible`` is the time until the conversation has a
+meaningful title and ``final`` is the time until its title stops changing. Hybrid titles are visible immediately but
+final only once the model answered.
+
+Usage::
+
+    python -m scripts.benchmark_titles --strategies local,llm,hybrid --from-db 50
+    python -m scripts.benchmark_titles --file openers.txt --batch-size 8
+"""
+
+from __future__ import annotations
+
+import argparse
+import statistics
+import time
+from pathlib import Path
+
+SAMPLE_MESSAGES = [
+    "Can you help me write a Python script to parse CSV files?",
+    "What is the difference between TCP and UDP?",
+    "How do I configure PgBouncer in front of PostgreSQL for a Django app?",
+    "Give me a recipe for a vegan chocolate cake",
+    "Why does my React component render twice in development mode?",
+    "Explain how transformers use attention, in simple words",
+    "hi",
+    "Plan a three day trip to Kyoto in autumn",
+]
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Return the nearest-rank percentile of a list of values."""
+    ordered = sorted(values)
+    index = min(round(fraction * (len(ordered) - 1)), len(ordered) - 1)
+    return ordered[index]
+
+
+def load_messages(file_path: str | None, from_db: int) -> list[str]:
+    """Load the first messages to benchmark with."""
+    if file_path:
+        with Path(file_path).open() as file:
+            return [line.strip() for line in file if line.strip()]
+    if from_db:
+        from sqlitedb.models import UserConversations  # noqa: PLC0415
+
+        first_messages = (
+            UserConversations.objects.filter(from_bot=False)
+            .order_by("conversation_id", "id")
+            .distinct("conversation_id")
+            if _supports_distinct_on()
+            else UserConversations.objects.filter(from_bot=False).order_by("id")
+        )
+        return list(first_messages.values_list("message", flat=True)[:from_db])
+    return SAMPLE_MESSAGES
+
+
+def _supports_distinct_on() -> bool:
+    from django.db import connection  # noqa: PLC0415
+
+    return bool(connection.features.can_distinct_on_fields)
+
+
+def benchmark_strategy(name: str, messages: list[str], batch_size: int) -> tuple[list[float], list[float]]:
+    """Measure visible and final title latencies of a strategy, in seconds, per message."""
+    from chatgpt.titles import TITLE_STRATEGIES, local_titles  # noqa: PLC0415
+
+    strategy = local_titles if name == "local" else TITLE_STRATEGIES[name]()
+    visible: list[float] = []
+    final: list[float] = []
+    for first in range(0, len(messages), batch_size):
+        batch = messages[first : first + batch_size]
+        initial_latencies = []
+        for message in batch:
+            start = time.perf_counter()
+            strategy.initial_title(message)
+            initial_latencies.append(time.perf_counter() - start)
+        if not strategy.deferred:
+            visible += initial_latencies
+            final += initial_latencies
+            continue
+        start = time.perf_counter()
+        strategy.generate(batch)
+        # Every title of the batch becomes final when the single completion returns
+        generated = time.perf_counter() - start
+        final += [initial + generated for initial in initial_latencies]
+        visible += initial_latencies if name == "hybrid" else final[-len(batch) :]
+    return visible, final
+
+
+def main() -> None:
+    """Run the benchmark and print a summary table."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--strategies", default="local,llm,hybrid", help="Comma separated strategies to benchmark.")
+    parser.add_argument("--file", help="File with one conversation opener per line.")
+    parser.add_argument("--from-db", type=int, default=0, help="Use the first message of N stored conversations.")
+    parser.add_argument("--batch-size", type=int, default=8, help="Titles generated per completion.")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of passes over the messages.")
+    args = parser.parse_args()
+
+    from main import env  # noqa: PLC0415, F401 # Configure Django and load the environment
+
+    messages = load_messages(args.file, args.from_db) * args.repeat
+    print(f"Benchmarking {len(messages)} titles")  # noqa: T201
+    print(f"{'strategy':<10}{'visible p50':>14}{'visible p95':>14}{'final p50':>14}{'final p95':>14}")  # noqa: T201
+    for name in args.strategies.split(","):
+        try:
+            visible, final = benchmark_strategy(name.strip(), messages, args.batch_size)
+        except Exception as e:
+            print(f"{name:<10}failed: {e!r}")  # noqa: T201
+            continue
+        print(  # noqa: T201
+            f"{name:<10}"
+            f"{statistics.median(visible) * 1000:>12.2f}ms"
+            f"{percentile(visible, 0.95) * 1000:>12.2f}ms"
+            f"{statistics.median(final) * 1000:>12.2f}ms"
+            f"{percentile(final, 0.95) * 1000:>12.2f}ms",
+        )
+
+
+if __name__ == "__main__":
+    main()
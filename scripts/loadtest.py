@@ -0,0 +1,451 @@
+"""End-to-end load test of the bot handlers with simulated Telegram users.
+
+The handlers registered by ``telegram.replier.register_handlers`` are driven with synthetic ``NewMessage`` and
+``CallbackQuery`` events through a fake Telegram client that records the replies instead of sending them. Chat
+completions and images are served by the local OpenAI stand-in and data is stored in a temporary SQLite database,
+unless ``DATABASE_URL`` is set.
+
+Like the bot, which runs with ``sequential_updates``, events are handled one at a time unless
+``--concurrent-updates`` is given. Latencies are measured from the moment a user sends an event until its handlers
+returned, so they include the time spent waiting behind other users' events.
+
+Usage::
+
+    python -m scripts.loadtest --users 50 --messages 20 --mix chat=70,list=10,page=5,new=5,start=5,print=5
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Self
+
+from loguru import logger
+from telethon import events
+from telethon.tl.types import PeerUser, User
+
+from scripts.openai_standin import RouteConfig, StandinConfig, start_in_background
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+
+FIRST_TELEGRAM_ID = 1_000_000
+
+DEFAULT_MIX = "chat=70,list=10,page=5,new=5,start=5,print=5"
+
+# Text of the event sent for each action, callbacks are prefixed with "callback:"
+ACTIONS = {
+    "chat": "chat",
+    "list": "/list",
+    "page": "callback:next_page:1",
+    "new": "/new",
+    "start": "/start",
+    "print": "/print",
+    "settings": "/settings",
+    "image": "/image",
+}
+
+_PROMPTS = [
+    "How do I reverse a list in Python?",
+    "Explain the CAP theorem briefly",
+    "Write a haiku about databases",
+    "What is the capital of Australia?",
+    "Summarize the plot of Hamlet in two sentences",
+    "Why is the sky blue?",
+    "Suggest a name for a coffee shop",
+    "How does HTTPS work?",
+]
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Return the nearest-rank percentile of a list of values."""
+    ordered = sorted(values)
+    return ordered[min(round(fraction * (len(ordered) - 1)), len(ordered) - 1)]
+
+
+class FakeMessage(object):
+    """Message sent by a simulated user, or by the bot."""
+
+    def __init__(self: Self, message_id: int, text: str, sender_id: int, reply_to: FakeMessage | None = None) -> None:
+        self.id = message_id
+        self.text = self.message = self.raw_text = text
+        self.sender_id = sender_id
+        self.reply_to = reply_to
+        self.date = datetime.now(UTC)
+
+    async def get_reply_message(self: Self) -> FakeMessage | None:
+        """Message this message replies to."""
+        return self.reply_to
+
+    async def edit(self: Self, text: str = "", **_: Any) -> FakeMessage:
+        """Edit a message of the bot, e.g. the status of an image job."""
+        self.text = self.message = self.raw_text = text
+        return self
+
+    async def delete(self: Self) -> None:
+        """Delete a message of the bot."""
+
+
+class FakeClient(object):
+    """Stand-in for ``TelegramClient`` dispatching synthetic events and recording outgoing calls."""
+
+    def __init__(self: Self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+        self.handlers: list[tuple[Callable[[Any], Awaitable[None]], Any]] = []
+        self.users: dict[int, User] = {}
+        self.calls: Counter[str] = Counter()
+        self._message_id = 0
+
+    def next_message_id(self: Self) -> int:
+        """Allocate a message id."""
+        self._message_id += 1
+        return self._message_id
+
+    def add_event_handler(self: Self, callback: Callable[[Any], Awaitable[None]], event: Any = None) -> None:
+        """Register a handler, with the event builders given to ``events.register`` by default."""
+        builders = [event] if event is not None else events._get_handlers(callback) or []  # noqa: SLF001
+        self.handlers.extend((callback, builder) for builder in builders)
+
+    async def get_entity(self: Self, peer: Any) -> User:
+        """Return the simulated user of a peer."""
+        return self.users[getattr(peer, "user_id", peer)]
+
+    async def send_message(self: Self, entity: Any, message: str, **_: Any) -> FakeMessage:
+        """Record a sent message."""
+        self.calls["send_message"] += 1
+        return FakeMessage(self.next_message_id(), message, 0)
+
+    async def send_file(self: Self, entity: Any, file: Any, **_: Any) -> FakeMessage:
+        """Record a sent file."""
+        self.calls["send_file"] += 1
+        return FakeMessage(self.next_message_id(), "", 0)
+
+    async def dispatch(self: Self, event: FakeEvent) -> list[str]:
+        """Run the handlers matching an event, in registration order, as Telethon does.
+
+        Returns
+        -------
+            list[str]: The names of the handlers that ran.
+        """
+        handled = []
+        for callback, builder in self.handlers:
+            match = event.matches(builder)
+            if match is None:
+                continue
+            event.pattern_match = match
+            handled.append(callback.__name__)
+            try:
+                await callback(event)
+            except events.StopPropagation:
+                break
+        return handled
+
+    async def _dispatch_update(self: Self, update: FakeEvent) -> None:
+        """Dispatch an update again, as ``TelegramClient._dispatch_update`` does."""
+        await self.dispatch(update)
+
+
+class FakeEvent(object):
+    """Attributes and methods of Telethon events used by the handlers."""
+
+    def __init__(self: Self, client: FakeClient, user: User) -> None:
+        self.client = client
+        self.sender = user
+        self.sender_id = self.chat_id = user.id
+        self.peer_id = PeerUser(user.id)
+        self.pattern_match: Any = None
+        # Dispatched again as is, e.g. by the admission filter
+        self.original_update = self
+
+    def matches(self: Self, builder: Any) -> Any:
+        """Match object of the builder pattern, True without pattern, None if the builder does not apply."""
+        raise NotImplementedError
+
+    async def get_sender(self: Self) -> User:
+        """Return the simulated user."""
+        return self.sender
+
+    async def respond(self: Self, message: str = "", **_: Any) -> FakeMessage:
+        """Record a message sent to the chat."""
+        self.client.calls["respond"] += 1
+        return FakeMessage(self.client.next_message_id(), message, 0)
+
+    async def reply(self: Self, message: str = "", **_: Any) -> FakeMessage:
+        """Record a reply to the event message."""
+        self.client.calls["reply"] += 1
+        return FakeMessage(self.client.next_message_id(), message, 0)
+
+    async def send_file(self: Self, entity: Any = None, file: Any = None, **_: Any) -> FakeMessage:
+        """Record a file sent to the chat."""
+        return await self.client.send_file(entity, file)
+
+
+class FakeNewMessage(FakeEvent):
+    """Synthetic ``NewMessage`` event."""
+
+    def __init__(self: Self, client: FakeClient, user: User, text: str) -> None:
+        super().__init__(client, user)
+        self.message = FakeMessage(client.next_message_id(), text, user.id)
+        self.id = self.message.id
+        self.text = self.raw_text = text
+
+    def matches(self: Self, builder: Any) -> Any:
+        if not isinstance(builder, events.NewMessage):
+            return None
+        if builder.pattern is None:
+            return True
+        return builder.pattern(self.message.text)
+
+    async def get_message(self: Self) -> FakeMessage:
+        """Return the event message."""
+        return self.message
+
+
+class FakeCallbackQuery(FakeEvent):
+    """Synthetic ``CallbackQuery`` event, a button pressed under a bot message."""
+
+    def __init__(self: Self, client: FakeClient, user: User, data: str) -> None:
+        super().__init__(client, user)
+        self.data = data.encode()
+        self.query = type("Query", (), {"user_id": user.id, "data": self.data, "query_id": client.next_message_id()})()
+        self.message = FakeMessage(client.next_message_id(), "", 0)
+
+    def matches(self: Self, builder: Any) -> Any:
+        if not isinstance(builder, events.CallbackQuery):
+            return None
+        if builder.match is None:
+            return True
+        if isinstance(builder.match, bytes):
+            return True if builder.match == self.data else None
+        return builder.match(self.data)
+
+    async def answer(self: Self, *_: Any, **__: Any) -> None:
+        """Record the callback answer."""
+        self.client.calls["answer"] += 1
+
+    async def edit(self: Self, message: str = "", **_: Any) -> FakeMessage:
+        """Record an edit of the message the button belongs to."""
+        self.client.calls["edit"] += 1
+        return self.message
+
+    async def get_message(self: Self) -> FakeMessage:
+        """Return the message the button belongs to."""
+        return self.message
+
+
+class LoadTest(object):
+    """Simulated users sending events to the handlers, and the measurements of the run."""
+
+    def __init__(self: Self, client: FakeClient, mix: dict[str, int], think_time: float, seed: int) -> None:
+        self.client = client
+        self.actions = list(mix)
+        self.weights = [mix[action] for action in self.actions]
+        self.think_time = think_time
+        self.rng = random.Random(seed)  # noqa: S311
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: Counter[str] = Counter()
+        self.unhandled: Counter[str] = Counter()
+        self.queue: asyncio.Queue[tuple[FakeEvent, str, float, asyncio.Future[None]]] = asyncio.Queue()
+        self.pending: set[asyncio.Task[None]] = set()
+
+    def make_user(self: Self, index: int) -> User:
+        """Create a simulated user."""
+        telegram_id = FIRST_TELEGRAM_ID + index
+        user = User(id=telegram_id, bot=False, username=f"loadtest{index}", first_name=f"Load {index}")
+        self.client.users[telegram_id] = user
+        return user
+
+    def make_event(self: Self, user: User, action: str) -> FakeEvent:
+        """Create the event of an action."""
+        text = ACTIONS[action]
+        if text.startswith("callback:"):
+            return FakeCallbackQuery(self.client, user, text.removeprefix("callback:"))
+        if action == "chat":
+            text = self.rng.choice(_PROMPTS)
+        elif action == "image":
+            text = f"/image {self.rng.choice(_PROMPTS)}"
+        return FakeNewMessage(self.client, user, text)
+
+    async def handle(self: Self, event: FakeEvent, action: str, sent: float) -> None:
+        """Dispatch an event."""
+        try:
+            if not await self.client.dispatch(event):
+                self.unhandled[action] += 1
+        except Exception as e:
+            self.errors[action] += 1
+            logger.opt(exception=e).debug(f"Handler of {action} failed")
+
+    async def finish(self: Self, event: FakeEvent, action: str, sent: float, done: asyncio.Future[None]) -> None:
+        """Wait for the reply or the images generated once the handler returned, then record the latency."""
+        from telegram.completions import completions  # noqa: PLC0415
+        from telegram.jobs import image_jobs  # noqa: PLC0415
+
+        await completions.wait(event.sender_id)
+        await image_jobs.wait(event.sender_id)
+        self.latencies[action].append(time.perf_counter() - sent)
+        done.set_result(None)
+
+    async def process(self: Self, event: FakeEvent, action: str, sent: float, done: asyncio.Future[None]) -> None:
+        """Dispatch an event and wait for its reply."""
+        await self.handle(event, action, sent)
+        await self.finish(event, action, sent, done)
+
+    async def dispatcher(self: Self, concurrent: bool) -> None:
+        """Handle queued events, one at a time unless ``concurrent``."""
+        while True:
+            event, action, sent, done = await self.queue.get()
+            if concurrent:
+                task = asyncio.create_task(self.process(event, action, sent, done))
+            else:
+                # The next event is dispatched while the reply is generated, as Telethon does
+                await self.handle(event, action, sent)
+                task = asyncio.create_task(self.finish(event, action, sent, done))
+            self.pending.add(task)
+            task.add_done_callback(self.pending.discard)
+
+    async def simulate_user(self: Self, index: int, messages: int) -> None:
+        """Send ``messages`` events, waiting for each to be handled and a think time between them."""
+        user = self.make_user(index)
+        # First message of every user starts a conversation
+        actions = ["chat", *self.rng.choices(self.actions, self.weights, k=messages - 1)]
+        for action in actions[:messages]:
+            done: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+            await self.queue.put((self.make_event(user, action), action, time.perf_counter(), done))
+            await done
+            if self.think_time:
+                await asyncio.sleep(self.rng.expovariate(1 / self.think_time))
+
+    async def run(self: Self, users: int, messages: int, *, concurrent: bool) -> float:
+        """Run the simulation, return its duration in seconds."""
+        from telegram.jobs import image_jobs  # noqa: PLC0415
+
+        dispatcher = asyncio.create_task(self.dispatcher(concurrent))
+        start = time.perf_counter()
+        await asyncio.gather(*(self.simulate_user(index, messages) for index in range(users)))
+        # Image generations run as jobs after their handler returned
+        await image_jobs.join()
+        duration = time.perf_counter() - start
+        dispatcher.cancel()
+        return duration
+
+    def report(self: Self, duration: float, queries: dict[str, float]) -> str:
+        """Summary table of the run."""
+        total = sum(map(len, self.latencies.values()))
+        lines = [
+            f"{total} events in {duration:.1f}s, {total / duration:.1f} events/s",
+            f"{'action':<10}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}",
+        ]
+        for action, latencies in sorted(self.latencies.items()):
+            lines.append(
+                f"{action:<10}{len(latencies):>7}{self.errors[action]:>8}"
+                f"{statistics.median(latencies) * 1000:>10.1f}"
+                f"{percentile(latencies, 0.95) * 1000:>10.1f}"
+                f"{percentile(latencies, 0.99) * 1000:>10.1f}",
+            )
+        if self.unhandled:
+            lines.append(f"Events without handler: {dict(self.unhandled)}")
+        lines.append(f"Client calls: {dict(self.client.calls)}")
+        query_count = sum(queries.values())
+        lines.append(f"DB queries: {int(query_count)} total, {query_count / max(total, 1):.1f}/event")
+        lines.extend(f"  {handler:<36}{int(count):>8}" for handler, count in sorted(queries.items()))
+        return "\n".join(lines)
+
+
+def parse_mix(mix: str) -> dict[str, int]:
+    """Parse an ``action=weight,...`` mix."""
+    weights = {}
+    for item in mix.split(","):
+        action, _, weight = item.partition("=")
+        if action.strip() not in ACTIONS:
+            msg = f"Unknown action {action}, expected one of {', '.join(ACTIONS)}"
+            raise argparse.ArgumentTypeError(msg)
+        weights[action.strip()] = int(weight or 1)
+    return weights
+
+
+def configure_environment(args: argparse.Namespace) -> None:
+    """Point the bot at the stand-in and a temporary database, before Django and the bot are loaded."""
+    if not os.environ.get("GPT_URL") or args.standin:
+        standin = start_in_background(
+            StandinConfig(
+                chat=RouteConfig(args.chat_latency, args.chat_error_rate, args.chat_token_rate),
+                images=RouteConfig(args.image_latency),
+                seed=args.seed,
+            ),
+        )
+        os.environ["GPT_URL"] = standin.base_url
+        os.environ.setdefault("GPT_KEY", "sk-loadtest")
+        os.environ["PROD"] = "True"
+    if "DATABASE_URL" not in os.environ:
+        database = Path(tempfile.mkdtemp(prefix="tgpt-loadtest-"), "db.sqlite3")
+        # Wait for locks rather than failing when updates are handled concurrently
+        os.environ["DATABASE_URL"] = f"sqlite:///{database}?timeout=30&transaction_mode=IMMEDIATE"
+
+
+def migrate() -> None:
+    """Load the bot and create the database tables."""
+    from django.core.management import call_command  # noqa: PLC0415
+
+    import main  # noqa: F401, PLC0415 # Configures Django
+
+    call_command("migrate", verbosity=0)
+
+
+async def run_load_test(args: argparse.Namespace) -> None:
+    """Set up the handlers and run the load test."""
+    from sqlitedb.instrumentation import queries_total  # noqa: PLC0415
+    from telegram.replier import register_handlers  # noqa: PLC0415
+    from telegram.tasks import start_background_tasks  # noqa: PLC0415
+
+    client = FakeClient(asyncio.get_running_loop())
+    register_handlers(client)  # type: ignore[arg-type]
+    if args.background_tasks:
+        start_background_tasks(client)  # type: ignore[arg-type]
+
+    load_test = LoadTest(client, args.mix, args.think_time, args.seed)
+    queries_before = dict(queries_total.values)
+    duration = await load_test.run(args.users, args.messages, concurrent=args.concurrent_updates)
+    queries = {
+        key[0]: value - queries_before.get(key, 0)
+        for key, value in queries_total.values.items()
+        if value - queries_before.get(key, 0)
+    }
+    print(load_test.report(duration, queries))  # noqa: T201
+
+
+def main() -> None:
+    """Parse the arguments and run the load test."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20, help="Number of concurrent simulated users.")
+    parser.add_argument("--messages", type=int, default=10, help="Events sent by each user.")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help="Weights of the actions.")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean seconds between events of a user.")
+    parser.add_argument("--concurrent-updates", action="store_true", help="Handle events concurrently.")
+    parser.add_argument("--background-tasks", action="store_true", help="Run the background tasks, e.g. titles.")
+    parser.add_argument("--standin", action="store_true", help="Use the OpenAI stand-in even if GPT_URL is set.")
+    parser.add_argument("--chat-latency", default="lognormal:0.3:0.5", help="Stand-in time to first token.")
+    parser.add_argument("--chat-token-rate", type=float, default=0, help="Stand-in completion tokens per second.")
+    parser.add_argument("--chat-error-rate", type=float, default=0.0, help="Stand-in chat error rate.")
+    parser.add_argument("--image-latency", default="lognormal:2:0.3", help="Stand-in image latency.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the simulation.")
+    parser.add_argument("--log-level", default="WARNING", help="Log level of the bot.")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+    configure_environment(args)
+    migrate()
+    asyncio.run(run_load_test(args))
+
+
+if __name__ == "__main__":
+    main()
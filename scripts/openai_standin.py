@@ -0,0 +1,389 @@
+"""Local stand-in for the OpenAI API, with configurable latency, token rate and error rate.
+
+Serves chat completions (including streaming), image generations and the generated images, so that the bot can be
+run and benchmarked without network access. Point the bot at it with ``PROD=True GPT_URL=http://127.0.0.1:8080/v1``.
+
+Latency distributions are given as ``fixed:SECONDS``, ``uniform:LOW:HIGH``, ``exponential:MEAN`` or
+``lognormal:MEDIAN:SIGMA``. Chat latency is the time to the first token, the completion is then produced at
+``--chat-token-rate`` tokens per second.
+
+Usage::
+
+    python -m scripts.openai_standin --port 8080 --chat-latency lognormal:0.4:0.5 --chat-error-rate 0.01
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import hashlib
+import json
+import math
+import random
+import struct
+import sys
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Self
+
+CHARS_PER_TOKEN = 4
+
+_VOCABULARY = (
+    "the a of to and in is it that for on with as this be are by you at from or an can will use data model "
+    "request response server client python query cache index latency token stream image message user bot time "
+    "value system result process thread queue batch memory network database function return error retry example "
+    "first then each when which because however therefore simple quick answer question"
+)
+
+_WORDS = _VOCABULARY.split()
+
+
+class LatencyDistribution(object):
+    """Random latency, in seconds, parsed from a ``kind:param[:param]`` specification."""
+
+    def __init__(self: Self, spec: str) -> None:
+        kind, *params = spec.split(":")
+        self.kind = kind
+        self.params = [float(param) for param in params]
+        expected = {"fixed": 1, "uniform": 2, "exponential": 1, "lognormal": 2}
+        if expected.get(kind) != len(self.params):
+            msg = f"Invalid latency distribution {spec}"
+            raise ValueError(msg)
+
+    def sample(self: Self, rng: random.Random) -> float:
+        """Draw a latency."""
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return rng.uniform(*self.params)
+        if self.kind == "exponential":
+            return rng.expovariate(1 / self.params[0]) if self.params[0] > 0 else 0.0
+        median, sigma = self.params
+        return rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+
+
+class RouteConfig(object):
+    """Simulated behaviour of one API route."""
+
+    def __init__(
+        self: Self,
+        latency: str = "fixed:0",
+        error_rate: float = 0.0,
+        token_rate: float = 0.0,
+    ) -> None:
+        self.latency = LatencyDistribution(latency)
+        self.error_rate = error_rate
+        # Completion tokens per second, 0 for instant completions
+        self.token_rate = token_rate
+
+
+class StandinConfig(object):
+    """Configuration of the stand-in server."""
+
+    def __init__(
+        self: Self,
+        chat: RouteConfig | None = None,
+        images: RouteConfig | None = None,
+        completion_tokens: int = 60,
+        error_statuses: tuple[int, ...] = (429, 500, 503),
+        seed: int | None = None,
+    ) -> None:
+        self.chat = chat or RouteConfig()
+        self.images = images or RouteConfig()
+        # Mean number of completion tokens, the actual count is exponentially distributed
+        self.completion_tokens = completion_tokens
+        self.error_statuses = error_statuses
+        # Only to be used while holding rng_lock
+        self.rng = random.Random(seed)  # noqa: S311
+        self.rng_lock = threading.Lock()
+        self.stats: dict[str, dict[str, float]] = {}
+        self.stats_lock = threading.Lock()
+
+    def record(self: Self, route: str, status: int, duration: float) -> None:
+        """Record a served request."""
+        with self.stats_lock:
+            stats = self.stats.setdefault(route, {"requests": 0, "errors": 0, "seconds": 0.0})
+            stats["requests"] += 1
+            stats["errors"] += status >= 400
+            stats["seconds"] += duration
+
+
+def count_tokens(text: str) -> int:
+    """Rough token count of a text."""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def png_image(width: int, height: int, seed: str) -> bytes:
+    """Encode a solid colour PNG image, the colour derived from ``seed``."""
+    red, green, blue = hashlib.sha256(seed.encode()).digest()[:3]
+    row = b"\x00" + bytes((red, green, blue)) * width
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(row * height))
+        + chunk(b"IEND", b"")
+    )
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """Serve the OpenAI routes used by the bot."""
+
+    protocol_version = "HTTP/1.1"
+    server: StandinServer
+
+    def log_message(self: Self, format: str, *args: Any) -> None:  # noqa: A002
+        """Silence the per-request access log."""
+
+    @property
+    def config(self: Self) -> StandinConfig:
+        """Configuration of the server."""
+        return self.server.config
+
+    def _send_json(self: Self, status: int, body: dict[str, Any]) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(self: Self, status: int) -> None:
+        self._send_json(
+            status,
+            {"error": {"message": f"Simulated error {status}", "type": "server_error", "code": status}},
+        )
+
+    def _read_json(self: Self) -> dict[str, Any]:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")  # type: ignore[no-any-return]
+
+    def _simulate(self: Self, route: RouteConfig) -> tuple[float, int | None]:
+        """Sample the latency of a request and whether it fails."""
+        with self.config.rng_lock:
+            rng = self.config.rng
+            latency = route.latency.sample(rng)
+            error = rng.choice(self.config.error_statuses) if rng.random() < route.error_rate else None
+        return latency, error
+
+    def do_GET(self: Self) -> None:
+        """Serve generated images, models and statistics."""
+        start = time.perf_counter()
+        path = self.path.split("?")[0]
+        if path.startswith("/images/") and path.endswith(".png"):
+            name = path.removeprefix("/images/").removesuffix(".png")
+            size = name.rsplit("-", 1)[-1]
+            width, _, height = size.partition("x")
+            try:
+                payload = png_image(int(width), int(height), name)
+            except ValueError:
+                self._send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            self.config.record("image_file", 200, time.perf_counter() - start)
+        elif path.endswith("/models"):
+            self._send_json(
+                200,
+                {"object": "list", "data": [{"id": "gpt-4o", "object": "model", "owned_by": "standin"}]},
+            )
+        elif path == "/stats":
+            with self.config.stats_lock:
+                self._send_json(200, self.config.stats)
+        else:
+            self._send_error(404)
+
+    def do_POST(self: Self) -> None:
+        """Serve chat completions and image generations."""
+        start = time.perf_counter()
+        path = self.path.split("?")[0]
+        body = self._read_json()
+        if path.endswith("/chat/completions"):
+            route, status = "chat", self._chat_completion(body)
+        elif path.endswith("/images/generations"):
+            route, status = "images", self._image_generation(body)
+        else:
+            self._send_error(404)
+            return
+        self.config.record(route, status, time.perf_counter() - start)
+
+    def _completion_text(self: Self) -> list[str]:
+        with self.config.rng_lock:
+            rng = self.config.rng
+            tokens = max(1, round(rng.expovariate(1 / max(self.config.completion_tokens, 1))))
+            # About one word per token and a third, as in English text
+            return [rng.choice(_WORDS) for _ in range(max(1, tokens * 3 // 4))]
+
+    def _chat_completion(self: Self, body: dict[str, Any]) -> int:
+        route = self.config.chat
+        latency, error = self._simulate(route)
+        time.sleep(latency)
+        if error is not None:
+            self._send_error(error)
+            return error
+
+        words = self._completion_text()
+        content = " ".join(words).capitalize() + "."
+        prompt_tokens = sum(count_tokens(str(message.get("content", ""))) + 4 for message in body.get("messages", []))
+        completion_tokens = count_tokens(content)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model = body.get("model", "gpt-4o")
+        created = int(time.time())
+
+        if not body.get("stream"):
+            if route.token_rate:
+                time.sleep(completion_tokens / route.token_rate)
+            self._send_json(
+                200,
+                {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                            "logprobs": None,
+                        },
+                    ],
+                    "usage": usage,
+                },
+            )
+            return 200
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(delta: dict[str, str], finish_reason: str | None = None, **extra: Any) -> None:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                **extra,
+            }
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+
+        event({"role": "assistant", "content": ""})
+        pieces = content.split(" ")
+        for index, piece in enumerate(pieces):
+            if route.token_rate:
+                time.sleep(count_tokens(piece) / route.token_rate)
+            event({"content": piece if index == len(pieces) - 1 else f"{piece} "})
+        event({}, "stop")
+        if body.get("stream_options", {}).get("include_usage"):
+            event({}, None, usage=usage)
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+        return 200
+
+    def _write_chunk(self: Self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _image_generation(self: Self, body: dict[str, Any]) -> int:
+        route = self.config.images
+        latency, error = self._simulate(route)
+        time.sleep(latency)
+        if error is not None:
+            self._send_error(error)
+            return error
+
+        size = body.get("size") or "1024x1024"
+        host = self.headers.get("Host", f"{self.server.server_address[0]}:{self.server.server_address[1]}")
+        data = []
+        for _ in range(int(body.get("n") or 1)):
+            name = f"{uuid.uuid4().hex}-{size}"
+            if body.get("response_format") == "b64_json":
+                width, _, height = size.partition("x")
+                data.append({"b64_json": base64.b64encode(png_image(int(width), int(height), name)).decode()})
+            else:
+                data.append({"url": f"http://{host}/images/{name}.png"})
+        self._send_json(200, {"created": int(time.time()), "data": data})
+        return 200
+
+
+class StandinServer(ThreadingHTTPServer):
+    """Threaded HTTP server holding the stand-in configuration."""
+
+    daemon_threads = True
+
+    def __init__(self: Self, address: tuple[str, int], config: StandinConfig) -> None:
+        super().__init__(address, StandinHandler)
+        self.config = config
+
+    @property
+    def base_url(self: Self) -> str:
+        """Base URL to use as ``GPT_URL``."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def handle_error(self: Self, request: Any, client_address: Any) -> None:
+        """Ignore clients closing their connection, e.g. when they abort a streamed completion."""
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+def start_in_background(config: StandinConfig, host: str = "127.0.0.1", port: int = 0) -> StandinServer:
+    """Start a stand-in server in a daemon thread, on a free port by default."""
+    server = StandinServer((host, port), config)
+    threading.Thread(target=server.serve_forever, name="openai-standin", daemon=True).start()
+    return server
+
+
+def main() -> None:
+    """Run the stand-in server until interrupted."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--chat-latency", default="lognormal:0.4:0.5", help="Time to first token distribution.")
+    parser.add_argument("--chat-token-rate", type=float, default=80, help="Completion tokens per second, 0 for none.")
+    parser.add_argument("--chat-error-rate", type=float, default=0.0, help="Fraction of failed chat requests.")
+    parser.add_argument("--image-latency", default="lognormal:3:0.3", help="Image generation latency distribution.")
+    parser.add_argument("--image-error-rate", type=float, default=0.0, help="Fraction of failed image requests.")
+    parser.add_argument("--completion-tokens", type=int, default=60, help="Mean completion length in tokens.")
+    parser.add_argument("--error-statuses", default="429,500,503", help="Statuses of simulated errors.")
+    parser.add_argument("--seed", type=int, help="Seed of the random generator, for reproducible runs.")
+    args = parser.parse_args()
+
+    config = StandinConfig(
+        chat=RouteConfig(args.chat_latency, args.chat_error_rate, args.chat_token_rate),
+        images=RouteConfig(args.image_latency, args.image_error_rate),
+        completion_tokens=args.completion_tokens,
+        error_statuses=tuple(int(status) for status in args.error_statuses.split(",")),
+        seed=args.seed,
+    )
+    server = StandinServer((args.host, args.port), config)
+    print(f"OpenAI stand-in listening on {server.base_url}")  # noqa: T201
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(config.stats, indent=2))  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
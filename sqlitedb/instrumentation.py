@@ -0,0 +1,127 @@
+"""Attribute SQL queries to the handler that issued them."""
+
+from __future__ import annotations
+
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import cache
+from typing import TYPE_CHECKING, Any, Self
+
+from django.db.backends.signals import connection_created
+from loguru import logger
+
+from monitoring.metrics import REGISTRY
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterator
+
+    from django.db.backends.base.base import BaseDatabaseWrapper
+
+queries_total = REGISTRY.counter("db_queries_total", "SQL queries executed.", ("handler",))
+query_seconds_total = REGISTRY.counter("db_query_seconds_total", "Time spent executing SQL queries.", ("handler",))
+queries_per_request = REGISTRY.histogram(
+    "db_queries_per_request",
+    "SQL queries issued by a single handler invocation.",
+    ("handler",),
+    buckets=(1, 2, 5, 10, 20, 50, 100, 250),
+)
+n_plus_one_total = REGISTRY.counter("db_n_plus_one_total", "Handler invocations flagged as N+1.", ("handler",))
+
+
+class QueryStats(object):
+    """Queries issued while handling a single event."""
+
+    def __init__(self: Self, handler: str) -> None:
+        self.handler = handler
+        self.count = 0
+        self.duration = 0.0
+        self.slowest_sql = ""
+        self.slowest_duration = 0.0
+        self.statements: Counter[str] = Counter()
+
+    def record(self: Self, sql: str, duration: float) -> None:
+        """Record an executed statement."""
+        self.count += 1
+        self.duration += duration
+        self.statements[sql] += 1
+        if duration > self.slowest_duration:
+            self.slowest_duration = duration
+            self.slowest_sql = sql
+
+
+_current_stats: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+
+def _query_wrapper(
+    execute: Callable[..., Any],
+    sql: str,
+    params: Any,
+    many: bool,
+    context: dict[str, Any],
+) -> Any:
+    """Execute wrapper installed on every connection, it only measures when a handler is being tracked."""
+    stats = _current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.record(sql, time.perf_counter() - start)
+
+
+def _install_wrapper(connection: BaseDatabaseWrapper, **_: Any) -> None:
+    """Install the query wrapper on newly created connections, i.e. on every thread that talks to the DB."""
+    if _query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_query_wrapper)
+
+
+connection_created.connect(_install_wrapper, dispatch_uid="sqlitedb.instrumentation")
+
+
+@cache
+def _n_plus_one_threshold() -> int:
+    from main import env  # noqa: PLC0415
+
+    return env.int("DB_N_PLUS_ONE_THRESHOLD", 10)
+
+
+def _report(stats: QueryStats) -> None:
+    """Export the stats of a finished handler and warn about repeated statements."""
+    if not stats.count:
+        return
+    queries_total.inc(stats.count, handler=stats.handler)
+    query_seconds_total.inc(stats.duration, handler=stats.handler)
+    queries_per_request.observe(stats.count, handler=stats.handler)
+
+    sql, repeats = stats.statements.most_common(1)[0]
+    if repeats >= _n_plus_one_threshold():
+        n_plus_one_total.inc(handler=stats.handler)
+        logger.warning(
+            f"Possible N+1 in {stats.handler}: statement executed {repeats} times out of {stats.count} queries: {sql}",
+        )
+    logger.debug(
+        f"{stats.handler} issued {stats.count} queries in {stats.duration * 1000:.1f}ms, "
+        f"slowest {stats.slowest_duration * 1000:.1f}ms: {stats.slowest_sql}",
+    )
+
+
+@contextmanager
+def track_queries(handler: str) -> Iterator[QueryStats]:
+    """Attribute the queries executed inside the block, including in ``sync_to_async`` threads, to ``handler``.
+
+    Nested blocks are attributed to the outermost handler.
+    """
+    stats = _current_stats.get()
+    if stats is not None:
+        yield stats
+        return
+    stats = QueryStats(handler)
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+        _report(stats)
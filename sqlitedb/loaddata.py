@@ -0,0 +1,240 @@
+"""Synthetic dataset generator for scale testing."""
+
+from __future__ import annotations
+
+import csv
+import io
+import random
+from datetime import timedelta
+from typing import TYPE_CHECKING, Self
+
+from django.db import connection, transaction
+from django.utils import timezone
+from loguru import logger
+
+from chatgpt.tokens import count_tokens
+from sqlitedb.models import Conversation, CurrentConversation, User, UserConversations
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+# First telegram_id used for generated users, far away from real Telegram ids in the fixtures
+DEFAULT_TELEGRAM_ID_START = 1_500_000_000
+
+_VOCABULARY = (
+    "the be to of and a in that have it for not on with he as you do at this but his by from they we say her she or "
+    "an will my one all would there their what so up out if about who get which go me when make can like time no "
+    "just him know take people into year your good some could them see other than then now look only come its over "
+    "think also back after use two how our work first well way even new want because any these give day most us "
+    "python django telegram image conversation question answer model token database query cache latency server"
+)
+
+
+class LoadDataSpec(object):
+    """Shape of the generated dataset."""
+
+    def __init__(
+        self: Self,
+        users: int,
+        conversations_per_user: int,
+        messages_per_conversation: int,
+        telegram_id_start: int = DEFAULT_TELEGRAM_ID_START,
+    ) -> None:
+        self.users = users
+        self.conversations_per_user = conversations_per_user
+        self.messages_per_conversation = messages_per_conversation
+        self.telegram_id_start = telegram_id_start
+
+    @property
+    def total_messages(self: Self) -> int:
+        """Number of messages the spec generates."""
+        return self.users * self.conversations_per_user * self.messages_per_conversation
+
+
+class MessageFactory(object):
+    """Generate message texts with realistic length distributions.
+
+    User prompts are short and bot replies are long, both follow a log-normal distribution of word counts.
+    """
+
+    def __init__(self: Self, seed: int | None = None) -> None:
+        self.random = random.Random(seed)  # noqa: S311
+        self.vocabulary = _VOCABULARY.split(" ")
+
+    def words(self: Self, mu: float, sigma: float, limit: int) -> str:
+        """Return a random sentence whose word count is drawn from a log-normal distribution."""
+        count = min(max(int(self.random.lognormvariate(mu, sigma)), 1), limit)
+        return " ".join(self.random.choices(self.vocabulary, k=count))
+
+    def user_message(self: Self) -> str:
+        """A user prompt, ~12 words on average."""
+        return self.words(2.3, 0.7, 400)
+
+    def bot_message(self: Self) -> str:
+        """A bot reply, ~120 words on average."""
+        return self.words(4.6, 0.8, 1500)
+
+    def title(self: Self) -> str:
+        """A conversation title."""
+        return self.words(1.4, 0.4, 12).capitalize()
+
+
+class LoadDataGenerator(object):
+    """Bulk insert synthetic users, conversations and messages.
+
+    Rows are inserted with ``bulk_create`` in batches. On PostgreSQL, messages, which are by far the largest
+    table, are streamed with ``COPY`` instead.
+    """
+
+    def __init__(self: Self, batch_size: int = 5000, seed: int | None = None, use_copy: bool | None = None) -> None:
+        self.batch_size = batch_size
+        self.factory = MessageFactory(seed)
+        self.use_copy = connection.vendor == "postgresql" if use_copy is None else use_copy
+
+    def generate(self: Self, spec: LoadDataSpec) -> dict[str, int]:
+        """Generate the dataset described by ``spec``.
+
+        Returns
+        -------
+            dict[str, int]: The number of rows inserted per table.
+        """
+        counts = {"user": 0, "conversation": 0, "user_conversations": 0}
+        # Users are processed in chunks so that memory stays bounded whatever the dataset size
+        users_per_chunk = max(self.batch_size // max(spec.conversations_per_user, 1), 1)
+        for first in range(0, spec.users, users_per_chunk):
+            size = min(users_per_chunk, spec.users - first)
+            with transaction.atomic():
+                users = self._create_users(spec.telegram_id_start + first, size)
+                conversations = self._create_conversations(users, spec.conversations_per_user)
+                messages = self._create_messages(conversations, spec.messages_per_conversation)
+            counts["user"] += len(users)
+            counts["conversation"] += len(conversations)
+            counts["user_conversations"] += messages
+            logger.info(f"Generated {first + size}/{spec.users} users, {counts['user_conversations']} messages")
+        return counts
+
+    def _create_users(self: Self, telegram_id_start: int, size: int) -> list[User]:
+        users = User.objects.bulk_create(
+            [User(name=f"Load User {telegram_id_start + i}", telegram_id=telegram_id_start + i) for i in range(size)],
+            batch_size=self.batch_size,
+        )
+        if users and users[0].pk is None:
+            # Backends that cannot return ids from bulk inserts
+            users = list(
+                User.objects.filter(telegram_id__gte=telegram_id_start, telegram_id__lt=telegram_id_start + size),
+            )
+        return users
+
+    def _create_conversations(self: Self, users: list[User], per_user: int) -> list[Conversation]:
+        conversations = Conversation.objects.bulk_create(
+            [Conversation(user=user, title=self.factory.title()) for user in users for _ in range(per_user)],
+            batch_size=self.batch_size,
+        )
+        if conversations and conversations[0].pk is None:
+            conversations = list(Conversation.objects.filter(user__in=users))
+        latest = {conversation.user_id: conversation for conversation in conversations}  # type: ignore[attr-defined]
+        CurrentConversation.objects.bulk_create(
+            [CurrentConversation(user_id=user_id, conversation=conv) for user_id, conv in latest.items()],
+            batch_size=self.batch_size,
+        )
+        return conversations
+
+    def _iter_messages(
+        self: Self,
+        conversations: list[Conversation],
+        per_conversation: int,
+    ) -> Iterator[tuple[int, int, bool, str, int, int]]:
+        """Yield the user, conversation, sender, text, token count and running token total of every message."""
+        for conversation in conversations:
+            cumulative_tokens = 0
+            for index in range(per_conversation):
+                from_bot = index % 2 == 1
+                message = self.factory.bot_message() if from_bot else self.factory.user_message()
+                token_count = count_tokens(message)
+                cumulative_tokens += token_count
+                yield (
+                    conversation.user_id,  # type: ignore[attr-defined]
+                    conversation.id,  # type: ignore[attr-defined]
+                    from_bot,
+                    message,
+                    token_count,
+                    cumulative_tokens,
+                )
+
+    def _create_messages(self: Self, conversations: list[Conversation], per_conversation: int) -> int:
+        if self.use_copy:
+            return self._copy_messages(conversations, per_conversation)
+
+        created = 0
+        batch: list[UserConversations] = []
+        for user_id, conversation_id, from_bot, message, token_count, cumulative_tokens in self._iter_messages(
+            conversations,
+            per_conversation,
+        ):
+            batch.append(
+                UserConversations(
+                    user_id=user_id,
+                    conversation_id=conversation_id,
+                    from_bot=from_bot,
+                    message=message,
+                    token_count=token_count,
+                    cumulative_tokens=cumulative_tokens,
+                ),
+            )
+            if len(batch) >= self.batch_size:
+                created += len(UserConversations.objects.bulk_create(batch))
+                batch = []
+        if batch:
+            created += len(UserConversations.objects.bulk_create(batch))
+        return created
+
+    def _copy_messages(self: Self, conversations: list[Conversation], per_conversation: int) -> int:
+        """Stream messages with PostgreSQL ``COPY``, the fastest way to load large volumes.
+
+        ``auto_now_add`` does not apply to ``COPY``, messages are dated a microsecond apart in insertion order, the
+        last one now, like messages inserted one after the other. Neither do model defaults, the usage columns of
+        generated messages, which were never requested, are set to 0.
+        """
+        total = len(conversations) * per_conversation
+        last = timezone.now()
+        sql = (
+            f"COPY {UserConversations._meta.db_table} "  # noqa: SLF001
+            "(user_id, conversation_id, from_bot, message, token_count, cumulative_tokens, message_date, "
+            "prompt_tokens, completion_tokens, total_tokens, latency_ms) "
+            "FROM STDIN WITH (FORMAT csv)"
+        )
+        created = 0
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        with connection.cursor() as cursor:
+            for user_id, conversation_id, from_bot, message, token_count, cumulative_tokens in self._iter_messages(
+                conversations,
+                per_conversation,
+            ):
+                message_date = last - timedelta(microseconds=total - created - 1)
+                writer.writerow(
+                    (
+                        user_id,
+                        conversation_id,
+                        "t" if from_bot else "f",
+                        message,
+                        token_count,
+                        cumulative_tokens,
+                        message_date.isoformat(),
+                        0,
+                        0,
+                        0,
+                        0,
+                    ),
+                )
+                created += 1
+                # Flush regularly so that the buffer does not hold the whole chunk in memory
+                if created % (self.batch_size * 10) == 0:
+                    buffer.seek(0)
+                    cursor.copy_expert(sql, buffer)
+                    buffer.seek(0)
+                    buffer.truncate()
+            if buffer.tell():
+                buffer.seek(0)
+                cursor.copy_expert(sql, buffer)
+        return created
@@ -0,0 +1,71 @@
+"""Backfill per-message token counts and their running totals."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Self
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chatgpt.tokens import DEFAULT_MODEL, count_tokens
+from sqlitedb.models import UserConversations
+
+if TYPE_CHECKING:
+    from argparse import ArgumentParser
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill token_count and cumulative_tokens of existing messages. Run it while the bot is stopped, or at least "
+        "idle, since running totals of conversations receiving new messages during the backfill may be off."
+    )
+
+    def add_arguments(self: Self, parser: ArgumentParser) -> None:
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows updated per query.")
+        parser.add_argument("--model", default=None, help="Model whose tokenizer is used, defaults to GPT_MODEL.")
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Recompute every conversation instead of only those with missing counts.",
+        )
+
+    def handle(self: Self, *args: Any, **options: Any) -> None:
+        from main import env  # noqa: PLC0415
+
+        model = options["model"] or env.str("GPT_MODEL", DEFAULT_MODEL)
+        batch_size = options["batch_size"]
+
+        conversations = UserConversations.objects.all()
+        if not options["all"]:
+            conversations = conversations.filter(token_count=0).exclude(message="")
+        conversation_ids = list(conversations.values_list("conversation_id", flat=True).distinct().order_by())
+
+        self.stdout.write(f"Backfilling {len(conversation_ids)} conversations with the {model} tokenizer...")
+        updated = 0
+        for index, conversation_id in enumerate(conversation_ids, start=1):
+            updated += self._backfill_conversation(conversation_id, model, batch_size)
+            if index % 100 == 0:
+                self.stdout.write(f"{index}/{len(conversation_ids)} conversations, {updated} messages")
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} messages in {len(conversation_ids)} conversations."))
+
+    @staticmethod
+    def _backfill_conversation(conversation_id: int, model: str, batch_size: int) -> int:
+        """Recompute the counts and running totals of a conversation in insertion order."""
+        running_total = 0
+        batch: list[UserConversations] = []
+        updated = 0
+        messages = (
+            UserConversations.objects.filter(conversation_id=conversation_id).only("id", "message").order_by("id")
+        )
+        with transaction.atomic():
+            for message in messages.iterator(chunk_size=batch_size):
+                message.token_count = count_tokens(message.message, model)
+                running_total += message.token_count
+                message.cumulative_tokens = running_total
+                batch.append(message)
+                if len(batch) >= batch_size:
+                    updated += UserConversations.objects.bulk_update(batch, ["token_count", "cumulative_tokens"])
+                    batch = []
+            if batch:
+                updated += UserConversations.objects.bulk_update(batch, ["token_count", "cumulative_tokens"])
+        return updated
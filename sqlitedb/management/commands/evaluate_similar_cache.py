@@ -0,0 +1,163 @@
+"""Evaluate the near-duplicate prompt cache on recorded traffic."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Self
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from chatgpt.similarity import SimilarPromptCache, features, namespace, simhash, similarity
+
+if TYPE_CHECKING:
+    from argparse import ArgumentParser
+
+# Prompt, messages sent and answer of a single-turn request
+Sample = tuple[str, list[dict[str, str]], str]
+
+
+def answer_similarity(first: str, second: str) -> float:
+    """Jaccard similarity of the words of two answers."""
+    first_words = {feature for feature in features(first) if " " not in feature}
+    second_words = {feature for feature in features(second) if " " not in feature}
+    if not first_words and not second_words:
+        return 1.0
+    return len(first_words & second_words) / len(first_words | second_words)
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay recorded single-turn prompts through the near-duplicate cache and report its hit rate and false "
+        "positive rate per similarity threshold. A hit on a different prompt is counted as a false positive when "
+        "the recorded answers of both prompts share fewer words than --answer-similarity, compare it with the "
+        "similarity of answers to identical prompts printed first. Only the prompts the cache would index are "
+        "replayed, see GPT_SIMILAR_CACHE_MAX_PROMPT_TOKENS."
+    )
+
+    def add_arguments(self: Self, parser: ArgumentParser) -> None:
+        source = parser.add_mutually_exclusive_group()
+        source.add_argument("--cassette", help="Cassette recorded with GPT_CASSETTE_MODE=record.")
+        source.add_argument("--from-db", type=int, default=1000, help="Conversations whose opener is replayed.")
+        parser.add_argument("--thresholds", default="0.8,0.85,0.9,0.95", help="Comma separated thresholds.")
+        parser.add_argument("--answer-similarity", type=float, default=0.3, help="Answers closer are equivalent.")
+        parser.add_argument("--examples", type=int, default=5, help="Near-duplicate hits printed for review.")
+
+    def handle(self: Self, *args: Any, **options: Any) -> None:
+        from main import gpt  # noqa: PLC0415
+
+        try:
+            thresholds = sorted(float(threshold) for threshold in options["thresholds"].split(","))
+        except ValueError as e:
+            msg = f"Invalid thresholds {options['thresholds']}"
+            raise CommandError(msg) from e
+        samples = self._load_samples(options)
+        if not samples:
+            msg = "No single-turn prompts to evaluate."
+            raise CommandError(msg)
+        best_scores, best_matches = self._best_matches(gpt.model, samples)
+
+        exact: list[float] = []
+        near: list[tuple[int, int, float]] = []
+        for index, match in enumerate(best_matches):
+            if match < 0:
+                continue
+            prompt, _, answer = samples[index]
+            agreement = answer_similarity(answer, samples[match][2])
+            if " ".join(features(prompt)) == " ".join(features(samples[match][0])):
+                exact.append(agreement)
+            else:
+                near.append((index, int(match), agreement))
+
+        self.stdout.write(f"{len(samples)} single-turn prompts, {len(exact)} repeated exactly.")
+        if exact:
+            self.stdout.write(f"Answers to identical prompts share {np.mean(exact):.0%} of their words on average.")
+        self.stdout.write(f"{'threshold':>9}  {'hit rate':>8}  {'near hits':>9}  {'false pos.':>10}  {'FP rate':>7}")
+        for threshold in thresholds:
+            near_hits = [entry for entry in near if best_scores[entry[0]] >= threshold]
+            false_positives = sum(agreement < options["answer_similarity"] for _, _, agreement in near_hits)
+            hits = len(exact) + len(near_hits)
+            self.stdout.write(
+                f"{threshold:>9.2f}  {hits / len(samples):>8.1%}  {len(near_hits):>9}  {false_positives:>10}  "
+                f"{false_positives / hits if hits else 0:>7.1%}",
+            )
+
+        lowest = thresholds[0]
+        examples = sorted(
+            (entry for entry in near if best_scores[entry[0]] >= lowest),
+            key=lambda entry: best_scores[entry[0]],
+        )
+        for index, match, agreement in examples[: options["examples"]]:
+            self.stdout.write(
+                f"\n{best_scores[index]:.3f} (answers {agreement:.0%} alike)\n  {samples[index][0]!r}\n"
+                f"  {samples[match][0]!r}",
+            )
+
+    @staticmethod
+    def _best_matches(model: str, samples: list[Sample]) -> tuple[np.ndarray, np.ndarray]:
+        """Score and index of the most similar prompt of every prompt among the prompts answered before it."""
+        signatures = np.stack([simhash(prompt) for prompt, _, _ in samples])
+        spaces = np.array([namespace(model, messages, prompt) for prompt, messages, _ in samples], dtype=np.int64)
+        best_scores = np.full(len(samples), -1.0)
+        best_matches = np.full(len(samples), -1)
+        for index in range(1, len(samples)):
+            scores = similarity(signatures[:index], signatures[index])
+            scores[spaces[:index] != spaces[index]] = -1
+            best = int(np.argmax(scores))
+            best_scores[index], best_matches[index] = scores[best], best
+        return best_scores, best_matches
+
+    def _load_samples(self: Self, options: dict[str, Any]) -> list[Sample]:
+        """Single-turn requests of the cassette or the database whose prompt the cache would index."""
+        from main import gpt  # noqa: PLC0415
+
+        cache = gpt.similar
+        if not cache.enabled:
+            # Same prompt filter as the configured cache, which refuses every prompt while it is disabled
+            cache = SimilarPromptCache(1, max_prompt_tokens=gpt.similar.max_prompt_tokens)
+        if options["cassette"]:
+            return self._load_cassette(options["cassette"], cache)
+        return self._load_db(options["from_db"], cache)
+
+    @staticmethod
+    def _load_cassette(path: str, cache: SimilarPromptCache) -> list[Sample]:
+        from chatgpt.cassette import REPLAY, Cassette  # noqa: PLC0415
+
+        try:
+            entries = Cassette(path, REPLAY, 0).entries()
+        except FileNotFoundError as e:
+            msg = f"Cassette {path} not found"
+            raise CommandError(msg) from e
+        samples = []
+        for entry in sorted(entries, key=lambda entry: entry["recorded_at"]):
+            prompt = cache.prompt(entry["model"], entry["messages"])
+            if prompt is not None:
+                answer = entry["response"]["choices"][0]["message"]["content"] or ""
+                samples.append((prompt, entry["messages"], answer))
+        return samples
+
+    @staticmethod
+    def _load_db(conversations: int, cache: SimilarPromptCache) -> list[Sample]:
+        from main import gpt  # noqa: PLC0415
+        from sqlitedb.models import Conversation, UserConversations  # noqa: PLC0415
+
+        conversation_ids = list(Conversation.objects.order_by("-id").values_list("id", flat=True)[:conversations])
+        openers: dict[int, list[tuple[bool, str]]] = {}
+        messages = (
+            UserConversations.objects.filter(conversation_id__in=conversation_ids)
+            .order_by("conversation_id", "id")
+            .values_list("conversation_id", "from_bot", "message")
+        )
+        for conversation_id, from_bot, message in messages.iterator(chunk_size=2000):
+            opener = openers.setdefault(conversation_id, [])
+            if len(opener) < 2:
+                opener.append((from_bot, message))
+        samples = []
+        for conversation_id in sorted(openers):
+            # A single-turn request is a user message answered by the bot
+            if [from_bot for from_bot, _ in openers[conversation_id]] != [False, True]:
+                continue
+            (_, prompt), (_, answer) = openers[conversation_id]
+            request = gpt.build_message([{"from_bot": False, "message": prompt}])
+            if cache.prompt(gpt.model, request) is not None:
+                samples.append((prompt, request, answer))
+        return samples
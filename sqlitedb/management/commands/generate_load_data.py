@@ -0,0 +1,56 @@
+"""Generate a synthetic dataset for scale testing."""
+
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING, Any, Self
+
+from django.core.management.base import BaseCommand
+
+from sqlitedb.loaddata import DEFAULT_TELEGRAM_ID_START, LoadDataGenerator, LoadDataSpec
+
+if TYPE_CHECKING:
+    from argparse import ArgumentParser
+
+
+class Command(BaseCommand):
+    help = "Bulk insert synthetic users, conversations and messages for benchmarking."
+
+    def add_arguments(self: Self, parser: ArgumentParser) -> None:
+        parser.add_argument("--users", type=int, default=1000, help="Number of users to create.")
+        parser.add_argument("--conversations", type=int, default=5, help="Conversations per user.")
+        parser.add_argument("--messages", type=int, default=20, help="Messages per conversation.")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Rows per bulk insert.")
+        parser.add_argument("--seed", type=int, help="Seed for reproducible datasets.")
+        parser.add_argument(
+            "--telegram-id-start",
+            type=int,
+            default=DEFAULT_TELEGRAM_ID_START,
+            help="Telegram ID of the first generated user.",
+        )
+        copy_group = parser.add_mutually_exclusive_group()
+        copy_group.add_argument("--copy", dest="use_copy", action="store_true", default=None, help="Force COPY.")
+        copy_group.add_argument("--no-copy", dest="use_copy", action="store_false", help="Force bulk_create.")
+
+    def handle(self: Self, *args: Any, **options: Any) -> None:
+        spec = LoadDataSpec(
+            users=options["users"],
+            conversations_per_user=options["conversations"],
+            messages_per_conversation=options["messages"],
+            telegram_id_start=options["telegram_id_start"],
+        )
+        generator = LoadDataGenerator(
+            batch_size=options["batch_size"],
+            seed=options["seed"],
+            use_copy=options["use_copy"],
+        )
+        self.stdout.write(f"Generating {spec.total_messages} messages for {spec.users} users...")
+        start = time.perf_counter()
+        counts = generator.generate(spec)
+        elapsed = time.perf_counter() - start
+        for table, rows in counts.items():
+            self.stdout.write(f"{table}: {rows} rows")
+        total = sum(counts.values())
+        self.stdout.write(
+            self.style.SUCCESS(f"Inserted {total} rows in {elapsed:.1f}s ({total / elapsed:.0f} rows/s)."),
+        )
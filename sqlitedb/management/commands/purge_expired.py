@@ -0,0 +1,43 @@
+"""Purge expired messages and images."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Self
+
+from django.core.management.base import BaseCommand
+
+from sqlitedb.retention import DEFAULT_BATCH_SIZE, RetentionPolicy, purge_expired
+
+if TYPE_CHECKING:
+    from argparse import ArgumentParser
+
+
+class Command(BaseCommand):
+    help = "Delete messages and images older than the global and per-user retention policies."
+
+    def add_arguments(self: Self, parser: ArgumentParser) -> None:
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows deleted per transaction.")
+        parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches.")
+        parser.add_argument("--messages-days", type=int, help="Override RETENTION_MESSAGES_DAYS.")
+        parser.add_argument("--images-days", type=int, help="Override RETENTION_IMAGES_DAYS.")
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be deleted.")
+
+    def handle(self: Self, *args: Any, **options: Any) -> None:
+        policy = RetentionPolicy.from_env()
+        if options["messages_days"] is not None:
+            policy.messages_days = max(options["messages_days"], 0)
+        if options["images_days"] is not None:
+            policy.images_days = max(options["images_days"], 0)
+
+        result = purge_expired(
+            policy=policy,
+            batch_size=options["batch_size"],
+            pause=options["pause"],
+            dry_run=options["dry_run"],
+        )
+        prefix = "Would purge" if options["dry_run"] else "Purged"
+        for table, rows in result.rows.items():
+            self.stdout.write(f"{prefix} {rows} rows from {table}, ~{result.bytes[table]} bytes reclaimed.")
+        self.stdout.write(
+            self.style.SUCCESS(f"{prefix} {sum(result.rows.values())} rows, ~{sum(result.bytes.values())} bytes."),
+        )
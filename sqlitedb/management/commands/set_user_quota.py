@@ -0,0 +1,38 @@
+"""Set the daily token quota of a user."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Self
+
+from django.core.management.base import BaseCommand, CommandError
+
+if TYPE_CHECKING:
+    from argparse import ArgumentParser
+
+
+class Command(BaseCommand):
+    help = "Override DAILY_TOKEN_QUOTA for a user and show their usage of the day."
+
+    def add_arguments(self: Self, parser: ArgumentParser) -> None:
+        parser.add_argument("telegram_id", type=int, help="Telegram ID of the user.")
+        parser.add_argument(
+            "quota",
+            nargs="?",
+            help="Tokens allowed per day, 0 for no limit, 'default' to use DAILY_TOKEN_QUOTA. Omit to only show it.",
+        )
+
+    def handle(self: Self, *args: Any, **options: Any) -> None:
+        from main import db  # noqa: PLC0415
+
+        telegram_id = options["telegram_id"]
+        quota = options["quota"]
+        if quota is not None:
+            if quota == "default":
+                db.set_daily_token_quota(telegram_id, None)
+            elif quota.isdigit():
+                db.set_daily_token_quota(telegram_id, int(quota))
+            else:
+                msg = f"Invalid quota {quota}, expected a non-negative integer or 'default'."
+                raise CommandError(msg)
+        used, limit = db.get_daily_token_usage(telegram_id)
+        self.stdout.write(f"User {telegram_id} used {used} tokens today, quota {limit or 'unlimited'}.")
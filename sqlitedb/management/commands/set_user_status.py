@@ -0,0 +1,36 @@
+"""Set the status of a user."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Self
+
+from django.core.management.base import BaseCommand
+
+from sqlitedb.utils import UserStatus
+
+if TYPE_CHECKING:
+    from argparse import ArgumentParser
+
+
+class Command(BaseCommand):
+    help = (
+        "Suspend, temporarily ban or reactivate a user. The updates of users who are not active are dropped before "
+        "any handler runs, within USER_STATUS_TTL seconds in a running bot."
+    )
+
+    def add_arguments(self: Self, parser: ArgumentParser) -> None:
+        parser.add_argument("telegram_id", type=int, help="Telegram ID of the user.")
+        parser.add_argument(
+            "status",
+            nargs="?",
+            choices=[status.name.lower() for status in UserStatus],
+            help="New status of the user. Omit to only show it.",
+        )
+
+    def handle(self: Self, *args: Any, **options: Any) -> None:
+        from main import db  # noqa: PLC0415
+
+        telegram_id = options["telegram_id"]
+        if options["status"] is not None:
+            db.set_user_status(telegram_id, UserStatus[options["status"].upper()].value)
+        self.stdout.write(f"User {telegram_id} is {db.get_user_status(telegram_id)}.")
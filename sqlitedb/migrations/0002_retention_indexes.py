@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sqlitedb', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userconversations',
+            index=models.Index(fields=['message_date'], name='user_conv_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userconversations',
+            index=models.Index(fields=['user', 'message_date'], name='user_conv_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userimages',
+            index=models.Index(fields=['message_date'], name='user_images_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userimages',
+            index=models.Index(fields=['user', 'message_date'], name='user_images_user_date_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sqlitedb", "0002_retention_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="userconversations",
+            name="cumulative_tokens",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="userconversations",
+            name="token_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="userconversations",
+            index=models.Index(fields=["conversation", "cumulative_tokens"], name="user_conv_conv_tokens_idx"),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sqlitedb", "0003_token_counts"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="title_pending",
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sqlitedb", "0004_conversation_title_pending"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="daily_token_quota",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="userconversations",
+            name="completion_tokens",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="userconversations",
+            name="latency_ms",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="userconversations",
+            name="prompt_tokens",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="userconversations",
+            name="total_tokens",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name="UserDailyUsage",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                ("day", models.DateField()),
+                ("requests", models.PositiveIntegerField(default=0)),
+                ("prompt_tokens", models.PositiveBigIntegerField(default=0)),
+                ("completion_tokens", models.PositiveBigIntegerField(default=0)),
+                ("total_tokens", models.PositiveBigIntegerField(default=0)),
+                ("user", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to="sqlitedb.user")),
+            ],
+            options={
+                "db_table": "user_daily_usage",
+                "constraints": [models.UniqueConstraint(fields=("user", "day"), name="user_daily_usage_user_day_uniq")],
+            },
+        ),
+    ]
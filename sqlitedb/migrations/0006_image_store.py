@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sqlitedb", "0005_usage_accounting"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="userimages",
+            name="image_hash",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.AddField(
+            model_name="userimages",
+            name="image_size",
+            field=models.CharField(blank=True, default="", max_length=16),
+        ),
+        migrations.AddField(
+            model_name="userimages",
+            name="prompt_hash",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name="userimages",
+            index=models.Index(fields=["prompt_hash"], name="user_images_prompt_hash_idx"),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sqlitedb", "0006_image_store"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TelegramPhoto",
+            fields=[
+                ("image_hash", models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ("photo_id", models.BigIntegerField()),
+                ("access_hash", models.BigIntegerField()),
+                ("file_reference", models.BinaryField()),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "db_table": "telegram_photo",
+            },
+        ),
+    ]
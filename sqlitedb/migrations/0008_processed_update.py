@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sqlitedb", "0007_telegram_photo"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProcessedUpdate",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("kind", models.CharField(max_length=16)),
+                ("chat_id", models.BigIntegerField()),
+                ("update_id", models.BigIntegerField()),
+                ("processed_at", models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                "db_table": "processed_update",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("kind", "chat_id", "update_id"), name="processed_update_kind_chat_update_uniq"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -26,6 +26,7 @@ class User(models.Model):
         status (str): The current status of the user's account (active, suspended, or temporarily banned).
         joining_date (datetime): The date and time when the user was added to the database.
         last_updated (datetime): The date and time when the user's details were last updated.
+        daily_token_quota (int or None): Tokens the user may use per day, None for the default, 0 for no limit.
 
     Managers:
         objects (UserManager): The custom manager for this model.
@@ -63,6 +64,9 @@ class User(models.Model):
     # Conversation settings, stored as a JSON object
     settings = models.JSONField(default=dict)
 
+    # Admin override of DAILY_TOKEN_QUOTA, not a user setting so that users cannot change it
+    daily_token_quota = models.PositiveIntegerField(null=True, blank=True)
+
     # Use custom manager for this model
     objects = UserManager()
 
@@ -88,6 +92,7 @@ class Conversation(models.Model):
         id (int): The unique ID of the conversation.
         user (ForeignKey): The user associated with the conversation.
         title (str or None): The title of the conversation, or None if no title was provided.
+        title_pending (bool): True while the title is a placeholder waiting to be generated.
         start_time (datetime): The time when the conversation was started.
 
     Meta:
@@ -103,6 +108,9 @@ class Conversation(models.Model):
     # Conversation title, max length of 255, can be null
     title = models.CharField(max_length=255)
 
+    # Whether the title is a placeholder still waiting for the background title generation
+    title_pending = models.BooleanField(default=False, db_index=True)
+
     # Start time of the conversation
     start_time = models.DateTimeField(auto_now_add=True, editable=False)
 
@@ -133,6 +141,12 @@ class UserConversations(models.Model):
         from_bot (bool): True if the message was sent by the bot, False if it was sent by the user.
         conversation (ForeignKey): The conversation the message belongs to.
         message_date (datetime): The date and time the message was sent, auto-generated on creation.
+        token_count (int): The number of tokens of the message.
+        cumulative_tokens (int): The running total of tokens in the conversation, including this message.
+        prompt_tokens (int): Prompt tokens billed for the completion of a bot message.
+        completion_tokens (int): Completion tokens billed for the completion of a bot message.
+        total_tokens (int): Total tokens billed for the completion of a bot message.
+        latency_ms (int): Time taken by the completion of a bot message, in milliseconds.
 
     Meta:
         db_table (str): The name of the database table used to store this model's data.
@@ -156,12 +170,31 @@ class UserConversations(models.Model):
     # Date and time message was sent, auto-generated on creation
     message_date = models.DateTimeField(auto_now_add=True)
 
+    # Number of tokens of the message, computed with a local tokenizer on insert
+    token_count = models.PositiveIntegerField(default=0)
+
+    # Prefix sum of token_count over the conversation, used to select the newest messages within a token budget
+    cumulative_tokens = models.PositiveBigIntegerField(default=0)
+
+    # Usage reported by the API for the completion that produced a bot message, 0 for user messages
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    total_tokens = models.PositiveIntegerField(default=0)
+
+    # Time taken by the completion that produced a bot message, in milliseconds
+    latency_ms = models.PositiveIntegerField(default=0)
+
     objects = UserConversationsManager()
 
     class Meta(TypedModelMeta):
-        """Database table name."""
+        """Database table name and indexes."""
 
         db_table = "user_conversations"
+        indexes = [
+            models.Index(fields=["message_date"], name="user_conv_date_idx"),
+            models.Index(fields=["user", "message_date"], name="user_conv_user_date_idx"),
+            models.Index(fields=["conversation", "cumulative_tokens"], name="user_conv_conv_tokens_idx"),
+        ]
 
     def __str__(self: Self) -> str:
         """Return a string representation of the user conversation object."""
@@ -222,6 +255,9 @@ class UserImages(models.Model):
         user (ForeignKey): The user who sent the image.
         image_caption (str or None): The caption for the image, or None if no caption was provided.
         image_url (str): The URL where the image is stored.
+        image_hash (str): The sha256 of the image in the local image store, empty if it is not stored locally.
+        image_size (str): The dimensions the image was generated with, e.g. ``512x512``.
+        prompt_hash (str): The hash of the model, size and normalized caption the image was generated from.
         from_bot (bool): True if the image was sent by the bot, False if it was sent by the user.
         message_date (datetime): The date and time the image was sent, auto-generated on creation.
 
@@ -244,6 +280,15 @@ class UserImages(models.Model):
     # URL where the image is stored
     image_url = models.TextField()
 
+    # Hash of the image content in the local image store, empty for images not stored locally
+    image_hash = models.CharField(max_length=64, blank=True, default="")
+
+    # Dimensions the image was generated with
+    image_size = models.CharField(max_length=16, blank=True, default="")
+
+    # Hash of the request the image was generated from, to serve repeated prompts from the store
+    prompt_hash = models.CharField(max_length=64, blank=True, default="")
+
     # Flag indicating if image is from the bot or user
     from_bot = models.BooleanField()
 
@@ -254,11 +299,172 @@ class UserImages(models.Model):
     objects = ImagesManager()
 
     class Meta(TypedModelMeta):
-        """Database table name."""
+        """Database table name and indexes."""
 
         db_table = "user_images"
+        indexes = [
+            models.Index(fields=["message_date"], name="user_images_date_idx"),
+            models.Index(fields=["user", "message_date"], name="user_images_user_date_idx"),
+            models.Index(fields=["prompt_hash"], name="user_images_prompt_hash_idx"),
+        ]
 
     def __str__(self: Self) -> str:
         """Return a string representation of the user image object."""
         return f"""UserImages(id={self.id}, user={self.user}, image_caption={self.image_caption},
-        image_url={self.image_url}, from_bot={self.from_bot}, message_date={self.message_date})"""
+        image_url={self.image_url}, image_hash={self.image_hash}, from_bot={self.from_bot},
+        message_date={self.message_date})"""
+
+
+class UserDailyUsageManager(models.Manager):  # type: ignore
+    """Manager for the UserDailyUsage model."""
+
+
+class UserDailyUsage(models.Model):
+    """Model for storing the tokens used by a user each day.
+
+    Rows are incremented in place with every completion, so that checking a quota is a single primary key lookup
+    instead of a sum over the user's messages.
+
+    Attributes
+    ----------
+        id (int): The unique ID of the row.
+        user (ForeignKey): The user the usage belongs to.
+        day (date): The UTC day of the usage.
+        requests (int): The number of completions requested.
+        prompt_tokens (int): The prompt tokens used.
+        completion_tokens (int): The completion tokens used.
+        total_tokens (int): The total tokens used.
+
+    Managers:
+        objects (UserDailyUsageManager): The custom manager for this model.
+
+    Meta:
+        db_table (str): The name of the database table used to store this model's data.
+    """
+
+    # Row ID, auto-generated primary key
+    id = models.AutoField(primary_key=True)
+
+    # User the usage belongs to
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+
+    # UTC day of the usage
+    day = models.DateField()
+
+    # Counters, incremented with F() expressions
+    requests = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.PositiveBigIntegerField(default=0)
+    completion_tokens = models.PositiveBigIntegerField(default=0)
+    total_tokens = models.PositiveBigIntegerField(default=0)
+
+    # Use custom manager for this model
+    objects = UserDailyUsageManager()
+
+    class Meta(TypedModelMeta):
+        """Database table name and constraints."""
+
+        db_table = "user_daily_usage"
+        constraints = [
+            models.UniqueConstraint(fields=["user", "day"], name="user_daily_usage_user_day_uniq"),
+        ]
+
+    def __str__(self: Self) -> str:
+        """Return a string representation of the daily usage object."""
+        return f"UserDailyUsage(user={self.user}, day={self.day}, requests={self.requests}, total={self.total_tokens})"
+
+
+class TelegramPhotoManager(models.Manager):  # type: ignore
+    """Manager for the TelegramPhoto model."""
+
+
+class TelegramPhoto(models.Model):
+    """Model for storing the Telegram photo an image of the image store was uploaded as.
+
+    Sending the photo again by reference avoids uploading the image bytes for every send. File references expire,
+    a stale reference is replaced by a fresh upload.
+
+    Attributes
+    ----------
+        image_hash (str): The sha256 of the image in the local image store, primary key.
+        photo_id (int): The Telegram ID of the uploaded photo.
+        access_hash (int): The access hash of the uploaded photo.
+        file_reference (bytes): The file reference of the uploaded photo.
+        updated_at (datetime): The date and time the image was last uploaded.
+
+    Managers:
+        objects (TelegramPhotoManager): The custom manager for this model.
+
+    Meta:
+        db_table (str): The name of the database table used to store this model's data.
+    """
+
+    # Hash of the image in the local image store
+    image_hash = models.CharField(max_length=64, primary_key=True)
+
+    # Fields of the InputPhoto the image is sent as
+    photo_id = models.BigIntegerField()
+    access_hash = models.BigIntegerField()
+    file_reference = models.BinaryField()
+
+    # Date and time of the last upload
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # Use custom manager for this model
+    objects = TelegramPhotoManager()
+
+    class Meta(TypedModelMeta):
+        """Database table name."""
+
+        db_table = "telegram_photo"
+
+    def __str__(self: Self) -> str:
+        """Return a string representation of the Telegram photo object."""
+        return f"TelegramPhoto(image_hash={self.image_hash}, photo_id={self.photo_id}, updated_at={self.updated_at})"
+
+
+class ProcessedUpdateManager(models.Manager):  # type: ignore
+    """Manager for the ProcessedUpdate model."""
+
+
+class ProcessedUpdate(models.Model):
+    """Model for storing the Telegram updates already handled, so that updates redelivered after a restart are not.
+
+    Attributes
+    ----------
+        kind (str): The kind of update, message or callback.
+        chat_id (int): The Telegram ID of the chat the update belongs to.
+        update_id (int): The ID of the message, or of the callback query, unique within the chat.
+        processed_at (datetime): The date and time the update was handled.
+
+    Managers:
+        objects (ProcessedUpdateManager): The custom manager for this model.
+
+    Meta:
+        db_table (str): The name of the database table used to store this model's data.
+        constraints (list): One row per update.
+    """
+
+    kind = models.CharField(max_length=16)
+    chat_id = models.BigIntegerField()
+    update_id = models.BigIntegerField()
+
+    # Rows are purged once Telegram no longer redelivers their update
+    processed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    # Use custom manager for this model
+    objects = ProcessedUpdateManager()
+
+    class Meta(TypedModelMeta):
+        """Database table name and constraints."""
+
+        db_table = "processed_update"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["kind", "chat_id", "update_id"],
+                name="processed_update_kind_chat_update_uniq",
+            ),
+        ]
+
+    def __str__(self: Self) -> str:
+        """Return a string representation of the processed update object."""
+        return f"ProcessedUpdate(kind={self.kind}, chat_id={self.chat_id}, update_id={self.update_id})"
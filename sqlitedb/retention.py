@@ -0,0 +1,224 @@
+"""Retention policy engine."""
+
+from __future__ import annotations
+
+import time
+from datetime import timedelta
+from typing import TYPE_CHECKING, Any, Self
+
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.db.models.functions import Length
+from django.utils import timezone
+from loguru import logger
+
+from chatgpt.imagestore import ImageStore
+from sqlitedb.models import ProcessedUpdate, TelegramPhoto, User, UserConversations, UserImages
+from telegram.commands.utils import UserSettings
+
+if TYPE_CHECKING:
+    from django.db.models import Expression, Model, QuerySet
+
+DEFAULT_BATCH_SIZE = 500
+# Telegram redelivers pending updates for a day at most, processed updates are kept a little longer
+PROCESSED_UPDATES_DAYS = 2
+# Images are stored before the message referencing them, unreferenced images younger than this are kept
+IMAGE_STORE_GRACE_SECONDS = 3600
+
+
+class RetentionPolicy(object):
+    """Number of days messages and images are kept. A value of 0 keeps data forever."""
+
+    def __init__(self: Self, messages_days: int = 0, images_days: int = 0) -> None:
+        self.messages_days = max(messages_days, 0)
+        self.images_days = max(images_days, 0)
+
+    @classmethod
+    def from_env(cls: type[Self]) -> Self:
+        """Build the global retention policy from the environment."""
+        from main import env  # noqa: PLC0415
+
+        return cls(
+            messages_days=env.int("RETENTION_MESSAGES_DAYS", 0),
+            images_days=env.int("RETENTION_IMAGES_DAYS", 0),
+        )
+
+    @staticmethod
+    def _merge(global_days: int, user_days: int) -> int:
+        """Merge a global and a per-user value, users can only tighten the global retention."""
+        if user_days <= 0:
+            return global_days
+        if global_days <= 0:
+            return user_days
+        return min(global_days, user_days)
+
+    def for_user(self: Self, user_settings: dict[str, Any]) -> RetentionPolicy:
+        """Return the effective policy for a user given its settings."""
+        return RetentionPolicy(
+            messages_days=self._merge(
+                self.messages_days,
+                int(user_settings.get(UserSettings.MESSAGE_RETENTION.value, 0)),
+            ),
+            images_days=self._merge(
+                self.images_days,
+                int(user_settings.get(UserSettings.IMAGE_RETENTION.value, 0)),
+            ),
+        )
+
+
+class PurgeResult(object):
+    """Rows and bytes reclaimed by a purge.
+
+    Bytes are approximated from the text columns for database tables and exact for the ``image_store`` entry,
+    whose rows are the deleted image files.
+    """
+
+    def __init__(self: Self) -> None:
+        self.rows: dict[str, int] = {}
+        self.bytes: dict[str, int] = {}
+
+    def add(self: Self, table: str, rows: int, size: int) -> None:
+        """Account for a purged batch."""
+        self.rows[table] = self.rows.get(table, 0) + rows
+        self.bytes[table] = self.bytes.get(table, 0) + size
+
+    def merge(self: Self, other: PurgeResult) -> None:
+        """Merge another result into this one."""
+        for table, rows in other.rows.items():
+            self.add(table, rows, other.bytes.get(table, 0))
+
+    def __str__(self: Self) -> str:
+        """Return a human-readable summary."""
+        if not self.rows:
+            return "Nothing to purge."
+        return ", ".join(f"{table}: {rows} rows (~{self.bytes[table]} bytes)" for table, rows in self.rows.items())
+
+
+class _Purger(object):
+    """Delete expired rows in small batches and account for what was reclaimed."""
+
+    def __init__(self: Self, batch_size: int, pause: float, dry_run: bool) -> None:
+        self.batch_size = batch_size
+        self.pause = pause
+        self.dry_run = dry_run
+        self.result = PurgeResult()
+
+    def purge_queryset(
+        self: Self,
+        table: str,
+        queryset: QuerySet[Any],
+        size_expression: Expression,
+        date_field: str = "message_date",
+    ) -> PurgeResult:
+        """Delete the rows of a queryset in batches ordered by the indexed ``date_field`` column.
+
+        Each batch is deleted by primary key in its own short transaction, so hot tables are never locked for long.
+        """
+        result = PurgeResult()
+        if self.dry_run:
+            totals = queryset.aggregate(size=Sum(size_expression))
+            result.add(table, queryset.count(), int(totals["size"] or 0))
+            return result
+
+        model: type[Model] = queryset.model
+        while True:
+            ids = list(queryset.order_by(date_field).values_list("id", flat=True)[: self.batch_size])
+            if not ids:
+                break
+            with transaction.atomic():
+                batch = model.objects.filter(id__in=ids)
+                size = int(batch.aggregate(size=Sum(size_expression))["size"] or 0)
+                result.add(table, batch.delete()[0], size)
+            if self.pause:
+                time.sleep(self.pause)
+        return result
+
+    def purge_scope(self: Self, scope: Q, policy: RetentionPolicy) -> PurgeResult:
+        """Purge expired messages and images of the users matching the given scope."""
+        result = PurgeResult()
+        now = timezone.now()
+        if policy.messages_days:
+            cutoff = now - timedelta(days=policy.messages_days)
+            result.merge(
+                self.purge_queryset(
+                    "user_conversations",
+                    UserConversations.objects.filter(scope, message_date__lt=cutoff),
+                    Length("message"),
+                ),
+            )
+        if policy.images_days:
+            cutoff = now - timedelta(days=policy.images_days)
+            result.merge(
+                self.purge_queryset(
+                    "user_images",
+                    UserImages.objects.filter(scope, message_date__lt=cutoff),
+                    Length("image_caption") + Length("image_url"),
+                ),
+            )
+        self.result.merge(result)
+        return result
+
+    def purge_store(self: Self, store: ImageStore) -> PurgeResult:
+        """Delete the images of the store no image message references any more, and their Telegram uploads."""
+        result = PurgeResult()
+        referenced = set(UserImages.objects.exclude(image_hash="").values_list("image_hash", flat=True).distinct())
+        files, size = store.purge_unreferenced(referenced, IMAGE_STORE_GRACE_SECONDS, dry_run=self.dry_run)
+        result.add("image_store", files, size)
+        if not self.dry_run:
+            # Uploads of images that are no longer stored can not be sent again
+            TelegramPhoto.objects.exclude(image_hash__in=UserImages.objects.values("image_hash")).filter(
+                updated_at__lt=timezone.now() - timedelta(seconds=IMAGE_STORE_GRACE_SECONDS),
+            ).delete()
+        self.result.merge(result)
+        return result
+
+
+def purge_expired(
+    policy: RetentionPolicy | None = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    pause: float = 0.0,
+    *,
+    dry_run: bool = False,
+    store: ImageStore | None = None,
+) -> PurgeResult:
+    """Delete messages and images older than the retention policies, and updates Telegram no longer redelivers.
+
+    Files of the image store no image message references any more are deleted as well.
+
+    Args:
+        policy (RetentionPolicy | None): The global policy, read from the environment when not given.
+        batch_size (int): The number of rows deleted per transaction.
+        pause (float): Seconds to sleep between batches to leave room for other writers.
+        dry_run (bool): Only count what would be deleted.
+        store (ImageStore | None): The image store, configured from the environment when not given.
+
+    Returns
+    -------
+        PurgeResult: The rows and bytes reclaimed per table and the files and bytes reclaimed from the image store.
+    """
+    policy = policy or RetentionPolicy.from_env()
+    purger = _Purger(batch_size, pause, dry_run)
+    retention_keys = [UserSettings.MESSAGE_RETENTION.value, UserSettings.IMAGE_RETENTION.value]
+    custom_users = User.objects.filter(
+        Q(settings__has_key=retention_keys[0]) | Q(settings__has_key=retention_keys[1]),
+    ).only("id", "settings")
+
+    custom_ids = []
+    for user in custom_users:
+        custom_ids.append(user.id)
+        user_result = purger.purge_scope(Q(user_id=user.id), policy.for_user(user.settings))
+        if user_result.rows:
+            logger.debug(f"Purged for user {user.id}: {user_result}")
+
+    purger.purge_scope(~Q(user_id__in=custom_ids), policy)
+    purger.result.merge(
+        purger.purge_queryset(
+            "processed_update",
+            ProcessedUpdate.objects.filter(processed_at__lt=timezone.now() - timedelta(days=PROCESSED_UPDATES_DAYS)),
+            Length("kind"),
+            "processed_at",
+        ),
+    )
+    purger.purge_store(store or ImageStore.from_env())
+    logger.info(f"Retention purge finished. {purger.result}")
+    return purger.result
@@ -6,16 +6,25 @@ from typing import Any, Self, TypeVar
 
 from django.core.exceptions import ValidationError
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
-from django.db.models import Model, QuerySet
+from django.db import IntegrityError, transaction
+from django.db.models import F, Model, OuterRef, Q, QuerySet, Subquery
+from django.utils import timezone
 from loguru import logger
 
+from chatgpt.titles import get_title_strategy, title_worker
+from chatgpt.tokens import DEFAULT_MODEL, count_tokens
 from sqlitedb.models import (
     Conversation,
     CurrentConversation,
+    ProcessedUpdate,
+    TelegramPhoto,
     User,
     UserConversations,
+    UserDailyUsage,
     UserImages,
 )
+from sqlitedb.retention import PurgeResult, purge_expired
+from sqlitedb.utils import UserStatus
 
 T = TypeVar("T", bound=Model)
 
@@ -81,6 +90,44 @@ class SQLiteDatabase(object):
         )
         return messages.order_by("message_date")
 
+    def get_messages_within_token_budget(self: Self, telegram_id: int, max_tokens: int) -> Any:
+        """Retrieve the newest messages of the user's current conversation that fit in a token budget.
+
+        The window is selected with a single query on the ``cumulative_tokens`` prefix sums, the latest message is
+        always included even if it alone exceeds the budget.
+
+        Args:
+            telegram_id (int): The ID of the user for which to retrieve messages.
+            max_tokens (int): The maximum number of tokens of the returned messages.
+
+        Returns
+        -------
+            Any: The messages as dicts with ``from_bot`` and ``message`` keys, oldest first.
+        """
+        logger.debug(f"Getting user messages within {max_tokens} tokens")
+        user = self.get_user(telegram_id)
+
+        try:
+            current_conversation: CurrentConversation = CurrentConversation.objects.get(
+                user=user,
+            )
+        except CurrentConversation.DoesNotExist:
+            logger.exception(f"No current conversation found for user with ID {user}.")
+            return []
+
+        conversation_messages = UserConversations.objects.filter(conversation=current_conversation.conversation)
+        total = Subquery(conversation_messages.order_by("-cumulative_tokens").values("cumulative_tokens")[:1])
+        messages = (
+            conversation_messages.filter(user=user)
+            .annotate(start_tokens=F("cumulative_tokens") - F("token_count"))
+            .filter(
+                Q(cumulative_tokens__gt=total - max_tokens, start_tokens__gte=total - max_tokens)
+                | Q(cumulative_tokens=total),
+            )
+            .values("from_bot", "message")
+        )
+        return messages.order_by("cumulative_tokens", "id")
+
     def _get_current_conversation(
         self: Self,
         user: User,
@@ -102,11 +149,13 @@ class SQLiteDatabase(object):
         except CurrentConversation.DoesNotExist:
             logger.info(f"No current conversation exists for user {user}")
             try:
-                from main import gpt  # noqa: PLC0415
-
-                openai_response = gpt.send_text_completion_request(message)
-                chat_title = openai_response.choices[0].message.content
-                conversation = Conversation(user=user, title=chat_title)
+                # Slow titles are generated in the background so that the first message is not delayed by them
+                strategy = get_title_strategy()
+                conversation = Conversation(
+                    user=user,
+                    title=strategy.initial_title(message),
+                    title_pending=strategy.deferred,
+                )
                 conversation.save()
                 current_conversation = CurrentConversation(
                     user=user,
@@ -117,6 +166,8 @@ class SQLiteDatabase(object):
             except Exception as e:
                 logger.exception(f"Unable to create new conversation {e}")
                 raise
+            if strategy.deferred:
+                title_worker.notify()
         return conversation_id
 
     def _create_conversation(
@@ -124,6 +175,7 @@ class SQLiteDatabase(object):
         user_id: int,
         message: str,
         from_bot: bool,
+        usage: dict[str, int] | None = None,
     ) -> None:
         """Create a new Conversations object and save it to the database.
 
@@ -131,21 +183,41 @@ class SQLiteDatabase(object):
             user_id (int): The ID of the user who sent the message.
             message (str): The message text to be saved in the Conversations object.
             from_bot (bool): Whether the message is from the bot.
+            usage (dict[str, int] | None): Usage and latency of the completion that produced a bot message.
 
         Returns
         -------
             int: 0 if the conversation is successfully created and saved, or -1 if an error occurs.
         """
+        from main import env  # noqa: PLC0415
+
+        token_count = count_tokens(message, env.str("GPT_MODEL", DEFAULT_MODEL))
         try:
             user = self.get_user(user_id)
             conversation_id = self._get_current_conversation(user, message)
-            conversation = UserConversations(
-                user=user,
-                message=message,
-                from_bot=from_bot,
-                conversation_id=conversation_id,
-            )
-            conversation.save()
+            with transaction.atomic():
+                # Serializes the inserts into a conversation, which would otherwise compute the same prefix sum.
+                # The conversation row is locked rather than its latest message, which a first message lacks.
+                # SQLite ignores it but allows a single writer, a transaction whose total went stale fails to write.
+                Conversation.objects.select_for_update().filter(id=conversation_id).values_list("id").first()
+                previous_total = (
+                    UserConversations.objects.filter(conversation_id=conversation_id)
+                    .order_by("-cumulative_tokens")
+                    .values_list("cumulative_tokens", flat=True)
+                    .first()
+                )
+                conversation = UserConversations(
+                    user=user,
+                    message=message,
+                    from_bot=from_bot,
+                    conversation_id=conversation_id,
+                    token_count=token_count,
+                    cumulative_tokens=(previous_total or 0) + token_count,
+                    **(usage or {}),
+                )
+                conversation.save()
+                if usage:
+                    self._record_daily_usage(user, usage)
         except Exception as e:
             logger.exception(f"Unable to save conversation {e}")
             raise
@@ -172,49 +244,127 @@ class SQLiteDatabase(object):
         self: Self,
         message: str,
         user_id: int,
+        usage: dict[str, int] | None = None,
     ) -> None:
         """Insert a new conversation message into the database from the GPT model.
 
         Args:
             message (str): The message text to be saved in the Conversations object.
             user_id (int): The ID of the user who received the message from the GPT model.
+            usage (dict[str, int] | None): ``prompt_tokens``, ``completion_tokens``, ``total_tokens`` and
+                ``latency_ms`` of the completion, also added to the user's daily usage.
 
         Returns
         -------
             int: 0 if the conversation is successfully created and saved, or -1 if an error occurs.
         """
-        return self._create_conversation(user_id, message, True)
+        return self._create_conversation(user_id, message, True, usage)
 
     def insert_images_from_gpt(
         self: Self,
         image_caption: str,
-        image_url: str,
+        images: list[tuple[str, str]],
         telegram_id: int,
+        image_size: str = "",
+        prompt_hash: str = "",
     ) -> None:
-        """Insert a new image record into the database for a user.
+        """Insert the images generated for a request into the database with a single bulk insert.
 
         Args:
-            image_caption (str): The caption text for the image (optional).
-            image_url (str): The URL of the image file.
-            telegram_id (int): The ID of the user who uploaded the image.
-
-        Returns
-        -------
-            int: 0 if the image is successfully created and saved, or -1 if an error occurs.
+            image_caption (str): The caption text for the images.
+            images (list[tuple[str, str]]): The URL, empty if the image was returned inline, and the sha256 in the
+                local image store of every image.
+            telegram_id (int): The ID of the user who requested the images.
+            image_size (str): The dimensions the images were generated with.
+            prompt_hash (str): The hash of the request the images were generated from.
         """
         try:
             user = self.get_user(telegram_id)
-            image = UserImages(
-                user=user,
-                image_caption=image_caption,
-                image_url=image_url,
-                from_bot=True,
+            UserImages.objects.bulk_create(
+                [
+                    UserImages(
+                        user=user,
+                        image_caption=image_caption,
+                        image_url=image_url,
+                        image_hash=image_hash,
+                        image_size=image_size,
+                        prompt_hash=prompt_hash,
+                        from_bot=True,
+                    )
+                    for image_url, image_hash in images
+                ],
             )
-            image.save()
         except Exception as e:
-            logger.exception(f"Unable to save image {e}")
+            logger.exception(f"Unable to save images {e}")
             raise
 
+    def get_stored_image_hashes(self: Self, prompt_hash: str) -> list[str]:
+        """Return the hashes of the stored images generated from a request, newest first.
+
+        Args:
+            prompt_hash (str): The hash of the model, size and normalized caption of the request.
+
+        Returns
+        -------
+            list[str]: The distinct image hashes, the images may since have been evicted from the store.
+        """
+        hashes = (
+            UserImages.objects.filter(prompt_hash=prompt_hash)
+            .exclude(image_hash="")
+            .order_by("-id")
+            .values_list("image_hash", flat=True)[:10]
+        )
+        return list(dict.fromkeys(hashes))
+
+    def get_telegram_photos(self: Self, image_hashes: list[str]) -> dict[str, TelegramPhoto]:
+        """Return the Telegram photos stored images were uploaded as, by image hash.
+
+        Args:
+            image_hashes (list[str]): The sha256 of the images in the local image store.
+
+        Returns
+        -------
+            dict[str, TelegramPhoto]: The photos of the images already uploaded.
+        """
+        return {photo.image_hash: photo for photo in TelegramPhoto.objects.filter(image_hash__in=image_hashes)}
+
+    def set_telegram_photo(self: Self, image_hash: str, photo_id: int, access_hash: int, file_reference: bytes) -> None:
+        """Remember the Telegram photo a stored image was uploaded as.
+
+        Args:
+            image_hash (str): The sha256 of the image in the local image store.
+            photo_id (int): The Telegram ID of the uploaded photo.
+            access_hash (int): The access hash of the uploaded photo.
+            file_reference (bytes): The file reference of the uploaded photo.
+        """
+        TelegramPhoto.objects.update_or_create(
+            image_hash=image_hash,
+            defaults={"photo_id": photo_id, "access_hash": access_hash, "file_reference": file_reference},
+        )
+
+    def delete_telegram_photos(self: Self, image_hashes: list[str]) -> None:
+        """Forget the Telegram photos of stored images, e.g. once their file references are no longer valid.
+
+        Args:
+            image_hashes (list[str]): The sha256 of the images in the local image store.
+        """
+        TelegramPhoto.objects.filter(image_hash__in=image_hashes).delete()
+
+    def mark_update_processed(self: Self, kind: str, chat_id: int, update_id: int) -> bool:
+        """Record that an update is being handled.
+
+        Args:
+            kind (str): The kind of update, message or callback.
+            chat_id (int): The Telegram ID of the chat the update belongs to.
+            update_id (int): The ID of the message, or of the callback query.
+
+        Returns
+        -------
+            bool: False if the update was already recorded, i.e. it is a redelivery.
+        """
+        _, created = ProcessedUpdate.objects.get_or_create(kind=kind, chat_id=chat_id, update_id=update_id)
+        return bool(created)
+
     def delete_all_user_messages(self: Self, telegram_id: int) -> int:
         """Delete all conversations for a user from the database.
 
@@ -270,6 +420,155 @@ class SQLiteDatabase(object):
         ), self.delete_all_user_images(telegram_id)
         return num_conv_deleted, num_img_deleted
 
+    def record_usage(self: Self, telegram_id: int, usage: dict[str, int]) -> None:
+        """Add the usage of a completion whose reply was not stored, e.g. because it was cancelled, to a user's day.
+
+        Args:
+            telegram_id (int): The ID of the user.
+            usage (dict[str, int]): The ``prompt_tokens``, ``completion_tokens`` and ``total_tokens`` of the completion.
+        """
+        self._record_daily_usage(self.get_user(telegram_id), usage)
+
+    @staticmethod
+    def _record_daily_usage(user: User, usage: dict[str, int]) -> None:
+        """Add the usage of a completion to the user's counters of the day."""
+        day = timezone.now().date()
+        increments = {
+            field: F(field) + usage.get(field, 0) for field in ("prompt_tokens", "completion_tokens", "total_tokens")
+        }
+        if UserDailyUsage.objects.filter(user=user, day=day).update(requests=F("requests") + 1, **increments):
+            return
+        try:
+            with transaction.atomic():
+                UserDailyUsage.objects.create(
+                    user=user,
+                    day=day,
+                    requests=1,
+                    **{field: usage.get(field, 0) for field in increments},
+                )
+        except IntegrityError:
+            # Created concurrently by another completion of the user
+            UserDailyUsage.objects.filter(user=user, day=day).update(requests=F("requests") + 1, **increments)
+
+    def get_daily_token_usage(self: Self, telegram_id: int) -> tuple[int, int]:
+        """Retrieve the tokens used today by a user and their daily quota.
+
+        Args:
+            telegram_id (int): The ID of the user.
+
+        Returns
+        -------
+            tuple[int, int]: The tokens used today and the daily quota, 0 meaning unlimited.
+        """
+        from main import env  # noqa: PLC0415
+
+        user = self.get_user(telegram_id)
+        quota = user.daily_token_quota
+        if quota is None:
+            quota = env.int("DAILY_TOKEN_QUOTA", 0)
+        used = (
+            UserDailyUsage.objects.filter(user=user, day=timezone.now().date())
+            .values_list("total_tokens", flat=True)
+            .first()
+        )
+        return used or 0, quota
+
+    def set_daily_token_quota(self: Self, telegram_id: int, quota: int | None) -> None:
+        """Override the daily token quota of a user.
+
+        Args:
+            telegram_id (int): The ID of the user.
+            quota (int | None): Tokens allowed per day, 0 for no limit, None to use DAILY_TOKEN_QUOTA.
+        """
+        user = self.get_user(telegram_id)
+        user.daily_token_quota = quota
+        user.save(update_fields=["daily_token_quota"])
+
+    def get_user_status(self: Self, telegram_id: int) -> str:
+        """Return the status of a user, active for users not stored yet.
+
+        Args:
+            telegram_id (int): The ID of the user.
+
+        Returns
+        -------
+            str: The value of the user's UserStatus.
+        """
+        status = User.objects.filter(telegram_id=telegram_id).values_list("status", flat=True).first()
+        return status or UserStatus.ACTIVE.value
+
+    def set_user_status(self: Self, telegram_id: int, status: str) -> None:
+        """Set the status of a user.
+
+        Args:
+            telegram_id (int): The ID of the user.
+            status (str): The value of the new UserStatus.
+        """
+        user = self.get_user(telegram_id)
+        user.status = status
+        user.save(update_fields=["status"])
+
+    def get_conversations_pending_title(self: Self, limit: int) -> list[tuple[int, str]]:
+        """Retrieve the oldest conversations waiting for a title along with their first user message.
+
+        Args:
+            limit (int): The maximum number of conversations to return.
+
+        Returns
+        -------
+            list[tuple[int, str]]: The conversation IDs and their first user message.
+        """
+        first_message = (
+            UserConversations.objects.filter(conversation=OuterRef("pk"), from_bot=False)
+            .order_by("id")
+            .values("message")[:1]
+        )
+        pending = (
+            Conversation.objects.filter(title_pending=True)
+            .annotate(first_message=Subquery(first_message))
+            .exclude(first_message=None)
+            .order_by("id")
+            .values_list("id", "first_message")[:limit]
+        )
+        return list(pending)
+
+    def set_conversation_titles(self: Self, titles: dict[int, str]) -> int:
+        """Replace the placeholder titles of conversations.
+
+        Args:
+            titles (dict[int, str]): The new titles keyed by conversation ID.
+
+        Returns
+        -------
+            int: The number of conversations updated.
+        """
+        conversations = [
+            Conversation(id=conversation_id, title=title[:255], title_pending=False)
+            for conversation_id, title in titles.items()
+        ]
+        try:
+            return int(Conversation.objects.bulk_update(conversations, ["title", "title_pending"]))
+        except Exception as e:
+            logger.exception(f"Unable to update conversation titles {e}")
+            raise
+
+    def purge_expired_data(self: Self, batch_size: int, pause: float = 0.0) -> PurgeResult:
+        """Delete messages and images older than the configured retention.
+
+        Args:
+            batch_size (int): The number of rows deleted per transaction.
+            pause (float): Seconds to sleep between batches.
+
+        Returns
+        -------
+            PurgeResult: The rows and approximate bytes reclaimed per table.
+        """
+        try:
+            return purge_expired(batch_size=batch_size, pause=pause)
+        except Exception as e:
+            logger.exception(f"Unable to purge expired data {e}")
+            raise
+
     def initiate_new_conversation(
         self: Self,
         telegram_id: int,
@@ -6,6 +6,9 @@ test_message = "Test message"
 test_conversation = "Test Conversation"
 test_title = "Test Title"
 
+# Title of conversations whose title has not been generated yet
+PENDING_TITLE = "New conversation"
+
 
 class ErrorCodes(Enum):
     """List of error codes."""
@@ -0,0 +1,236 @@
+"""Admission of updates before any handler runs: user status and per-user rate limit."""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import time
+from collections import OrderedDict
+from typing import Any, Self
+
+from asgiref.sync import sync_to_async
+from loguru import logger
+from telethon import TelegramClient, events
+
+from chatgpt.ratelimit import TokenBucket
+from monitoring.metrics import REGISTRY, hit_ratio
+from sqlitedb.utils import UserStatus
+from telegram.catchup import catch_up
+from telegram.commands.strings import (
+    account_not_active,
+    account_suspended,
+    account_temporarily_banned,
+    rate_limited,
+)
+from telegram.dedup import UpdateKey, update_key
+
+# Updates over the rate limit are dropped
+REJECT = "reject"
+# Updates over the rate limit are handled once the user's bucket allows them, if that is soon enough
+QUEUE = "queue"
+
+_STATUS_MESSAGES = {
+    UserStatus.SUSPENDED.value: account_suspended,
+    UserStatus.TEMP_BANNED.value: account_temporarily_banned,
+}
+
+admission_total = REGISTRY.counter(
+    "telegram_admission_total",
+    "Updates by admission result (admitted, queued, rate_limited, suspended or temporarily_banned).",
+    ("result",),
+)
+admission_queued = REGISTRY.gauge("telegram_admission_queued", "Updates delayed by the per-user rate limit.")
+user_status_lookups_total = REGISTRY.counter(
+    "telegram_user_status_lookups_total",
+    "User status lookups of the admission filter by result (hit or miss of its cache).",
+    ("result",),
+)
+REGISTRY.gauge(
+    "telegram_user_status_cache_hit_ratio",
+    "Share of the user status lookups of the admission filter answered from its cache.",
+    callback=hit_ratio(user_status_lookups_total),
+)
+
+
+class UserAdmission(object):
+    """Rate limit and cached status of a user."""
+
+    def __init__(self: Self, bucket: TokenBucket | None) -> None:
+        self.bucket = bucket
+        self.status = UserStatus.ACTIVE.value
+        self.status_expires = 0.0
+        # The user is told once why their updates are ignored, not for every update
+        self.notified_until = 0.0
+
+
+class AdmissionFilter(object):
+    """Decide whether an update is handled, before any handler touches the database or OpenAI.
+
+    Every user gets a token bucket of ``rate_per_minute`` requests a minute, refilled continuously. Updates of
+    suspended or temporarily banned users, and updates over the rate limit, are dropped with a single notice.
+    With the ``queue`` policy, updates over the rate limit are handled once the bucket allows them instead, if
+    that is within ``max_delay`` seconds, without holding up the updates of other users. The status of a user is
+    read from the database at most once every ``status_ttl`` seconds.
+    """
+
+    def __init__(
+        self: Self,
+        rate_per_minute: float = 0,
+        policy: str = REJECT,
+        status_ttl: float = 60.0,
+        max_delay: float = 30.0,
+        max_users: int = 100000,
+    ) -> None:
+        self.rate_per_minute = rate_per_minute
+        self.policy = policy
+        self.status_ttl = status_ttl
+        self.max_delay = max_delay
+        self.max_users = max_users
+        self._users: OrderedDict[int, UserAdmission] = OrderedDict()
+        self._deferred: set[UpdateKey] = set()
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._configured = False
+
+    def configure(self: Self) -> None:
+        """Read ``USER_RATE_LIMIT``, ``USER_RATE_POLICY``, ``USER_RATE_MAX_DELAY`` and ``USER_STATUS_TTL`` once."""
+        if self._configured:
+            return
+        from main import env  # noqa: PLC0415
+
+        self.rate_per_minute = env.float("USER_RATE_LIMIT", self.rate_per_minute)
+        policy = env.str("USER_RATE_POLICY", self.policy)
+        if policy not in {REJECT, QUEUE}:
+            logger.warning(f"Unknown USER_RATE_POLICY {policy}, using {self.policy}")
+        elif policy == QUEUE and not callable(getattr(TelegramClient, "_dispatch_update", None)):
+            # Delayed updates are dispatched again with this private method, see the pin of telethon
+            logger.warning("This Telethon version cannot dispatch updates again, using USER_RATE_POLICY=reject")
+            self.policy = REJECT
+        else:
+            self.policy = policy
+        self.max_delay = env.float("USER_RATE_MAX_DELAY", self.max_delay)
+        self.status_ttl = env.float("USER_STATUS_TTL", self.status_ttl)
+        self._configured = True
+
+    def _user(self: Self, user_id: int) -> UserAdmission:
+        user = self._users.get(user_id)
+        if user is None:
+            user = UserAdmission(TokenBucket(self.rate_per_minute) if self.rate_per_minute > 0 else None)
+            self._users[user_id] = user
+            # The least recently seen users have full buckets, forgetting them changes nothing
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return user
+
+    async def _status(self: Self, user_id: int, user: UserAdmission) -> str:
+        now = time.monotonic()
+        if user.status_expires > now:
+            user_status_lookups_total.inc(result="hit")
+            return user.status
+        user_status_lookups_total.inc(result="miss")
+        from main import db  # noqa: PLC0415
+
+        user.status = await sync_to_async(db.get_user_status)(user_id)
+        user.status_expires = now + self.status_ttl
+        return user.status
+
+    def invalidate(self: Self, user_id: int) -> None:
+        """Forget the cached status of a user, e.g. after changing it."""
+        user = self._users.get(user_id)
+        if user is not None:
+            user.status_expires = 0.0
+
+    async def admit(self: Self, event: Any) -> bool:
+        """Whether an update is handled now.
+
+        Returns
+        -------
+            bool: False if the update is dropped, or delayed to be dispatched again later.
+        """
+        self.configure()
+        user_id = getattr(event, "sender_id", None)
+        if user_id is None:
+            return True
+        key = update_key(event)
+        user = self._user(user_id)
+        status = await self._status(user_id, user)
+        if status != UserStatus.ACTIVE.value:
+            admission_total.inc(result=status.replace(" ", "_"))
+            await self._notify(event, user, _STATUS_MESSAGES.get(status, account_not_active), self.status_ttl)
+            return False
+        if key in self._deferred:
+            # Dispatched again once its token was available
+            self._deferred.discard(key)
+            admission_queued.set(len(self._deferred))
+            admission_total.inc(result="admitted")
+            return True
+        message = getattr(event, "message", None)
+        if user.bucket is None or catch_up.is_missed(getattr(message, "date", None)):
+            # Messages sent while the bot was down are coalesced by the catch-up rather than rate limited
+            admission_total.inc(result="admitted")
+            return True
+
+        wait = user.bucket.wait_time(1, time.monotonic())
+        if wait <= 0:
+            user.bucket.adjust(-1)
+            admission_total.inc(result="admitted")
+            return True
+        if self.policy == QUEUE and wait <= self.max_delay and key is not None:
+            # The token is taken now, so that the next updates of the user wait behind this one
+            user.bucket.adjust(-1)
+            self._defer(event, key, wait)
+            admission_total.inc(result="queued")
+            return False
+        admission_total.inc(result="rate_limited")
+        await self._notify(event, user, rate_limited.format(seconds=max(round(wait), 1)), wait)
+        return False
+
+    def _defer(self: Self, event: Any, key: UpdateKey, delay: float) -> None:
+        self._deferred.add(key)
+        admission_queued.set(len(self._deferred))
+
+        async def dispatch_later() -> None:
+            await asyncio.sleep(delay)
+            try:
+                await event.client._dispatch_update(event.original_update)  # noqa: SLF001
+            except Exception as e:
+                self._deferred.discard(key)
+                admission_queued.set(len(self._deferred))
+                logger.exception(f"Unable to dispatch delayed update {key} {e}")
+
+        task = asyncio.get_running_loop().create_task(dispatch_later())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _notify(event: Any, user: UserAdmission, text: str, quiet_for: float) -> None:
+        now = time.monotonic()
+        if user.notified_until > now:
+            return
+        user.notified_until = now + quiet_for
+        with contextlib.suppress(Exception):
+            if getattr(event, "query", None) is not None:
+                await event.answer(text)
+            else:
+                await event.respond(text)
+
+
+admission = AdmissionFilter()
+
+
+def add_admission_handlers(client: TelegramClient) -> None:
+    """Add the admission filter, to be registered before any other handler."""
+    client.add_event_handler(admission_filter)
+
+
+@events.register(events.NewMessage(incoming=True))  # type: ignore
+@events.register(events.CallbackQuery())  # type: ignore
+async def admission_filter(event: events.NewMessage.Event | events.CallbackQuery.Event) -> None:
+    """Stop the handling of the updates the admission filter does not admit.
+
+    Args:
+        event (events.NewMessage.Event | events.CallbackQuery.Event): A new message or callback query event.
+    """
+    if not await admission.admit(event):
+        raise events.StopPropagation
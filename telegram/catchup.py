@@ -0,0 +1,179 @@
+"""Coalesced answers to the messages received while the bot was down."""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+from datetime import UTC, datetime
+from typing import TYPE_CHECKING, Self
+
+from asgiref.sync import sync_to_async
+from loguru import logger
+
+from monitoring.metrics import REGISTRY
+from telegram.completions import completions
+
+if TYPE_CHECKING:
+    import threading
+    from collections.abc import Awaitable, Callable
+
+    # Answers the latest missed message of a user, called with the earlier ones and the cancellation event
+    Answer = Callable[[list[str], threading.Event], Awaitable[None]]
+
+catch_up_messages_total = REGISTRY.counter(
+    "telegram_catch_up_messages_total",
+    "Messages received while the bot was down, by outcome (answered, or history when a later message was answered).",
+    ("outcome",),
+)
+# Seconds between two checks of the cancellation of an answer waiting for a slot, a thread event can not be awaited
+CANCEL_POLL_SECONDS = 0.1
+
+catch_up_pending_users = REGISTRY.gauge(
+    "telegram_catch_up_pending_users",
+    "Users whose missed messages wait to be answered at the end of the catch-up.",
+)
+
+
+class PendingMessages(object):
+    """Messages a user sent while the bot was down, and the answer to the latest one."""
+
+    def __init__(self: Self) -> None:
+        self.texts: list[str] = []
+        self.answer: Answer | None = None
+
+
+class CatchUp(object):
+    """Answer the messages received while the bot was down once per user, with a bounded number of completions.
+
+    Telethon fetches the missed updates on startup and dispatches them like any other. Messages sent before the bot
+    started are handed to the catch-up instead of being answered one by one. Once no missed message arrived for
+    ``delay`` seconds, the messages of every user are stored as history and only the latest one is answered, at
+    most ``concurrency`` at a time. A user sending a new message in the meantime gets it answered instead, the
+    missed messages becoming its history, and an answer cancelled while waiting for a slot stores the missed
+    messages and gives way to the next completion of the user at once.
+    """
+
+    def __init__(self: Self, concurrency: int = 4, delay: float = 2.0) -> None:
+        self.concurrency = concurrency
+        self.delay = delay
+        self.enabled = False
+        self.started_at = datetime.now(UTC)
+        self._pending: dict[int, PendingMessages] = {}
+        self._missed: asyncio.Event | None = None
+        self._flusher: asyncio.Task[None] | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+
+    def start(self: Self) -> None:
+        """Read ``CATCH_UP``, ``CATCH_UP_CONCURRENCY`` and ``CATCH_UP_DELAY``, messages sent from now on are live."""
+        from main import env  # noqa: PLC0415
+
+        self.enabled = env.bool("CATCH_UP", False)
+        self.concurrency = max(env.int("CATCH_UP_CONCURRENCY", self.concurrency), 1)
+        self.delay = env.float("CATCH_UP_DELAY", self.delay)
+        self.started_at = datetime.now(UTC)
+
+    def is_missed(self: Self, sent_at: datetime | None) -> bool:
+        """Whether a message was sent before the bot started."""
+        return self.enabled and sent_at is not None and sent_at < self.started_at
+
+    def add(self: Self, user_id: int, text: str, answer: Answer) -> None:
+        """Hand over a missed message, answered with the other missed messages of the user at the end of the catch-up.
+
+        Args:
+            user_id (int): The user who sent the message.
+            text (str): The text of the message.
+            answer (Answer): Answers the message, if it is the latest missed message of the user.
+        """
+        pending = self._pending.setdefault(user_id, PendingMessages())
+        pending.texts.append(text)
+        pending.answer = answer
+        catch_up_pending_users.set(len(self._pending))
+        if self._missed is None:
+            self._missed = asyncio.Event()
+        self._missed.set()
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_when_quiet(self._missed))
+
+    def take(self: Self, user_id: int) -> list[str]:
+        """Remove the missed messages of a user, to be stored as the history of a new message."""
+        pending = self._pending.pop(user_id, None)
+        catch_up_pending_users.set(len(self._pending))
+        if pending is None:
+            return []
+        catch_up_messages_total.inc(len(pending.texts), outcome="history")
+        return pending.texts
+
+    async def _flush_when_quiet(self: Self, missed: asyncio.Event) -> None:
+        while missed.is_set():
+            missed.clear()
+            with contextlib.suppress(TimeoutError):
+                await asyncio.wait_for(missed.wait(), timeout=self.delay)
+        self.flush()
+
+    def flush(self: Self) -> None:
+        """Answer the latest missed message of every user."""
+        pending, self._pending = self._pending, {}
+        catch_up_pending_users.set(0)
+        if pending:
+            logger.info(f"Answering the messages {len(pending)} users sent while the bot was down")
+        for user_id, messages in pending.items():
+            if messages.answer is None:
+                continue
+            completions.start(user_id, self._bounded(user_id, messages.answer, messages.texts))
+
+    @staticmethod
+    async def _acquire(semaphore: asyncio.Semaphore, cancel: threading.Event) -> bool:
+        """Wait for a slot, return False without one if the answer is cancelled meanwhile."""
+        acquiring = asyncio.ensure_future(semaphore.acquire())
+        try:
+            while not cancel.is_set():
+                done, _ = await asyncio.wait([acquiring], timeout=CANCEL_POLL_SECONDS)
+                if done:
+                    return True
+        except asyncio.CancelledError:
+            CatchUp._abandon(semaphore, acquiring)
+            raise
+        CatchUp._abandon(semaphore, acquiring)
+        return False
+
+    @staticmethod
+    def _abandon(semaphore: asyncio.Semaphore, acquiring: asyncio.Future[bool]) -> None:
+        if acquiring.done() and not acquiring.cancelled():
+            semaphore.release()
+        else:
+            acquiring.cancel()
+
+    @staticmethod
+    def _store_history(user_id: int, texts: list[str]) -> None:
+        from main import db  # noqa: PLC0415
+
+        for text in texts:
+            db.insert_message_from_user(text, user_id)
+
+    def _bounded(
+        self: Self,
+        user_id: int,
+        answer: Answer,
+        texts: list[str],
+    ) -> Callable[[threading.Event], Awaitable[None]]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        semaphore = self._semaphore
+
+        async def run(cancel: threading.Event) -> None:
+            if not await self._acquire(semaphore, cancel):
+                # Superseded by a later message, which waits for this task: kept as its history instead
+                catch_up_messages_total.inc(len(texts), outcome="history")
+                await sync_to_async(self._store_history)(user_id, texts)
+                return
+            try:
+                catch_up_messages_total.inc(len(texts) - 1, outcome="history")
+                catch_up_messages_total.inc(outcome="answered")
+                await answer(texts[:-1], cancel)
+            finally:
+                semaphore.release()
+
+        return run
+
+
+catch_up = CatchUp()
@@ -4,7 +4,7 @@ from loguru import logger
 from telethon import TelegramClient, events
 
 from telegram.commands.general import handle_any_message
-from telegram.commands.utils import SupportedCommands
+from telegram.commands.utils import SupportedCommands, instrument_handler
 
 
 def add_chat_handler(client: TelegramClient) -> None:
@@ -14,6 +14,7 @@ def add_chat_handler(client: TelegramClient) -> None:
 
 # Register the function to handle the /switch command
 @events.register(events.NewMessage(pattern=f"^{SupportedCommands.CHAT.value}"))  # type: ignore
+@instrument_handler
 async def handle_chat_command(event: events.NewMessage.Event) -> None:
     """Event handler for the /chat command.
 
@@ -1,22 +1,34 @@
 """Handle any other commands."""
 
 # Import necessary libraries and modules
+from __future__ import annotations
+
+import functools
 from typing import TYPE_CHECKING
 
 from asgiref.sync import sync_to_async
 from loguru import logger
 from telethon import events
 
+from chatgpt.exceptions import CancelledCompletionError, CircuitOpenError, QuotaExceededError
+from telegram.catchup import catch_up
+
 # Import some helper functions
-from telegram.commands.strings import no_input
-from telegram.commands.utils import SupportedCommands, get_regex
+from telegram.commands.strings import no_input, quota_exceeded, service_unavailable
+from telegram.commands.utils import SupportedCommands, get_regex, instrument_handler
+from telegram.completions import completions
+from telegram.dedup import deduplicated
 
 if TYPE_CHECKING:
+    import threading
+
     from telethon.tl.types import User
 
 
 # Register the function to handle any new message that matches the specified pattern
 @events.register(events.NewMessage(pattern=get_regex()))  # type: ignore
+@instrument_handler
+@deduplicated
 async def handle_any_message(event: events.NewMessage.Event) -> None:
     """Handle any new message.
 
@@ -37,9 +49,32 @@ async def handle_any_message(event: events.NewMessage.Event) -> None:
     if user and not user.bot:
         # Check if the message contains text
         if event.message.text.strip() and event.message.text.strip() != SupportedCommands.CHAT.value:
-            # Generate a response based on the user and the message text
-            message = await sync_to_async(gpt.chat)(user, event.message.text)
-            await event.respond(message)
+            text = event.message.text
+
+            async def reply(earlier: list[str], cancel: threading.Event) -> None:
+                # Generate a response based on the user and the message text
+                try:
+                    # Not thread sensitive, so that a request waiting for the rate limiter does not block other handlers
+                    message = await sync_to_async(gpt.chat, thread_sensitive=False)(user, text, cancel, earlier)
+                except CancelledCompletionError:
+                    return
+                except CircuitOpenError as e:
+                    logger.info(f"Not answering {user.id}, {e}")
+                    message = service_unavailable
+                except QuotaExceededError as e:
+                    logger.info(f"Not answering {user.id}, {e}")
+                    message = quota_exceeded
+                if cancel.is_set():
+                    return
+                await event.respond(message)
+
+            if catch_up.is_missed(event.message.date):
+                # Sent while the bot was down, answered with the other missed messages of the user
+                catch_up.add(user.id, text, reply)
+                return
+            earlier = catch_up.take(user.id)
+            # Replied in a task, so that the next updates are handled meanwhile and may cancel it
+            completions.start(user.id, functools.partial(reply, earlier))
         # If the message doesn't contain text, send a cleanup message
         else:
             logger.debug("No text received in event.")
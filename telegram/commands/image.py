@@ -1,46 +1,182 @@
 """Handle Image Command."""
 
+from __future__ import annotations
+
 # Import necessary libraries and modules
-import requests
+import re
+from typing import TYPE_CHECKING, Self
+
 from asgiref.sync import sync_to_async
 from loguru import logger
-from telethon import events
-from telethon.tl.types import User
+from telethon import TelegramClient, events
+from telethon.errors import (
+    FileIdInvalidError,
+    FileReferenceEmptyError,
+    FileReferenceExpiredError,
+    FileReferenceInvalidError,
+    MediaEmptyError,
+)
+from telethon.tl.types import InputPhoto, User
+
+from chatgpt.exceptions import CircuitOpenError
+from monitoring.metrics import REGISTRY
 
 # Import some helper functions
-from telegram.commands.strings import no_input
-from telegram.commands.utils import SupportedCommands, get_user
+from telegram.commands.strings import (
+    image_job_cancelled,
+    image_job_not_found,
+    image_job_running,
+    image_queue_full,
+    invalid_image_request,
+    no_input,
+    service_unavailable,
+)
+from telegram.commands.utils import SupportedCommands, get_user, instrument_handler
+from telegram.dedup import deduplicated
+from telegram.jobs import CANCEL_IMAGE_DATA, DuplicateJobError, QueueFullError, image_jobs
+
+if TYPE_CHECKING:
+    import threading
+    from pathlib import Path
+
+    from sqlitedb.models import TelegramPhoto
+
+# Errors of sends by reference whose reference is no longer usable, the image is uploaded again
+STALE_REFERENCE_ERRORS = (
+    FileIdInvalidError,
+    FileReferenceEmptyError,
+    FileReferenceExpiredError,
+    FileReferenceInvalidError,
+    MediaEmptyError,
+)
+
+DEFAULT_IMAGE_SIZE = "512x512"
+# Sizes supported by at least one of the image models
+IMAGE_SIZES = ("256x256", "512x512", "1024x1024", "1024x1536", "1536x1024", "1024x1792", "1792x1024")
+OPTION_PATTERN = re.compile(r"^(n|size)=\S+$", re.IGNORECASE)
+
+image_sends_total = REGISTRY.counter(
+    "telegram_image_sends_total",
+    "Images sent to users, by method (reference, upload or stale_reference followed by an upload).",
+    ("method",),
+)
+
+
+class ImageRequest(object):
+    """Prompt and options of an /image command."""
+
+    def __init__(self: Self, prompt: str, n: int = 1, size: str = DEFAULT_IMAGE_SIZE) -> None:
+        self.prompt = prompt
+        self.n = n
+        self.size = size
+
+
+def parse_image_request(text: str, max_variants: int) -> ImageRequest:
+    """Parse ``/image [n=<variants>] [size=<width>x<height>] <prompt>``.
+
+    Raises
+    ------
+        ValueError: If an option is invalid or the prompt is empty.
+    """
+    words = text.split()[1:]
+    options: dict[str, str] = {}
+    while words and OPTION_PATTERN.match(words[0]):
+        name, value = words.pop(0).split("=", 1)
+        options[name.lower()] = value.lower()
+    request = ImageRequest(" ".join(words))
+    if "n" in options:
+        if not options["n"].isdigit() or not 1 <= int(options["n"]) <= max_variants:
+            msg = f"n must be between 1 and {max_variants}"
+            raise ValueError(msg)
+        request.n = int(options["n"])
+    if "size" in options:
+        if options["size"] not in IMAGE_SIZES:
+            msg = f"size must be one of {', '.join(IMAGE_SIZES)}"
+            raise ValueError(msg)
+        request.size = options["size"]
+    if not request.prompt:
+        msg = "the prompt is empty"
+        raise ValueError(msg)
+    return request
+
+
+def add_image_handlers(client: TelegramClient) -> None:
+    """Add /image command Event Handlers."""
+    client.add_event_handler(handle_image_command)
+    client.add_event_handler(handle_cancel_image)
+
 
+def _input_photo(photo: TelegramPhoto) -> InputPhoto:
+    return InputPhoto(photo.photo_id, photo.access_hash, bytes(photo.file_reference))
 
-# Define a function to download an image from a URL and send it to the user
-async def send_image_from_url(
+
+# Define a function to send stored images to the user
+async def send_stored_images(
     event: events.NewMessage.Event,
     user: User,
-    url: str,
+    paths: list[Path],
     caption: str,
 ) -> None:
-    """Downloads an image from a URL and sends it to the user in Telegram.
+    """Sends images of the image store to the user in Telegram, as an album when there are several.
+
+    Photos are sent by reference when the images were already uploaded, and uploaded otherwise.
 
     Args:
         event (events.NewMessage.Event): A new message event.
         user (User): A user entity.
-        url (str): The URL of the image to download.
-        caption (str): The caption for the image.
+        paths (list[Path]): The paths of the images in the image store.
+        caption (str): The caption for the images.
 
     Returns
     -------
         None: This function doesn't return anything.
     """
-    response = requests.get(url, timeout=20)
-    file_bytes = response.content
-    await event.send_file(entity=user, file=file_bytes, caption=caption)
+    from main import db  # noqa: PLC0415
+
+    image_hashes = [path.stem for path in paths]
+    photos = await sync_to_async(db.get_telegram_photos)(image_hashes)
+    files: list[InputPhoto | str] = [
+        _input_photo(photos[image_hash]) if image_hash in photos else str(path)
+        for image_hash, path in zip(image_hashes, paths, strict=True)
+    ]
+    try:
+        sent = await event.client.send_file(entity=user, file=files if len(files) > 1 else files[0], caption=caption)
+    except STALE_REFERENCE_ERRORS as e:
+        if not photos:
+            raise
+        logger.info(f"Uploading images {image_hashes} again, a Telegram reference is stale: {e}")
+        image_sends_total.inc(len(photos), method="stale_reference")
+        await sync_to_async(db.delete_telegram_photos)(list(photos))
+        photos = {}
+        files = [str(path) for path in paths]
+        sent = await event.client.send_file(entity=user, file=files if len(files) > 1 else files[0], caption=caption)
+
+    messages = sent if isinstance(sent, list) else [sent]
+    for image_hash, message in zip(image_hashes, messages, strict=False):
+        if image_hash in photos:
+            image_sends_total.inc(method="reference")
+            continue
+        image_sends_total.inc(method="upload")
+        uploaded = getattr(message, "photo", None)
+        if uploaded is not None:
+            await sync_to_async(db.set_telegram_photo)(
+                image_hash,
+                uploaded.id,
+                uploaded.access_hash,
+                uploaded.file_reference,
+            )
 
 
 # Register the function to handle the /image command
-@events.register(events.NewMessage(pattern=f"^{SupportedCommands.IMAGE.value}$"))  # type: ignore
+@events.register(events.NewMessage(pattern=rf"^{SupportedCommands.IMAGE.value}(\s|$)"))  # type: ignore
+@instrument_handler
+@deduplicated
 async def handle_image_command(event: events.NewMessage.Event) -> None:
     """Handle /image command.
 
+    ``/image [n=<variants>] [size=<width>x<height>] <prompt>`` generates up to ``IMAGE_MAX_VARIANTS`` variants of
+    an image, sent back as a single album.
+
     Args:
         event (events.NewMessage.Event): A new message event.
 
@@ -48,29 +184,68 @@ async def handle_image_command(event: events.NewMessage.Event) -> None:
     -------
         None: This function doesn't return anything.
     """
-    # Import the main function for generating image URLs
-    from main import gpt  # noqa: PLC0415
+    # Import the main function for generating images
+    from main import env, gpt  # noqa: PLC0415
 
     # Log that an image request has been received
     logger.debug("Received image request")
 
-    # Define a prefix for the image URL
-    prefix = f"{SupportedCommands.IMAGE.value}"
-    # Pad by 1 to consider the space after command
-    prefix = prefix.ljust(len(prefix) + 1)
-
     # Get the user associated with the message
     telegram_user: User = await get_user(event)
 
-    # Extract the image query from the message text
-    prefix_len = len(prefix)
-    result = event.message.text[prefix_len:]
-
-    # Generate an image URL based on the query
-    if result:
-        url = await sync_to_async(gpt.image_gen)(telegram_user, result)
-        # Send the image to the user
-        await send_image_from_url(event, telegram_user, url, result)
-    else:
-        # Send an error message if no input was provided
-        await event.respond(no_input)
+    # Extract the image query and its options from the message text
+    try:
+        request = parse_image_request(event.message.text, env.int("IMAGE_MAX_VARIANTS", 4))
+    except ValueError as e:
+        # Send an error message if no valid input was provided
+        await event.respond(f"{no_input} {invalid_image_request.format(error=e)}")
+        return
+
+    async def generate(cancel: threading.Event) -> None:
+        # Generate images based on the query
+        try:
+            paths = await sync_to_async(gpt.image_gen, thread_sensitive=False)(
+                telegram_user,
+                request.prompt,
+                request.size,
+                request.n,
+            )
+        except CircuitOpenError as e:
+            logger.info(f"Not generating image, {e}")
+            if not cancel.is_set():
+                await event.respond(service_unavailable)
+            return
+        if cancel.is_set():
+            # Cancelled while they were generated, they stay in the store for the same prompt
+            return
+        # Send the images to the user
+        await send_stored_images(event, telegram_user, paths, request.prompt)
+
+    # Queue the generation, the handler returns while it waits for a free slot and runs
+    try:
+        await image_jobs.submit(
+            telegram_user.id,
+            generate,
+            lambda text, buttons: event.respond(text, buttons=buttons),
+        )
+    except DuplicateJobError:
+        await event.respond(image_job_running)
+    except QueueFullError:
+        await event.respond(image_queue_full)
+
+
+# Register the function to handle the cancel button of image jobs
+@events.register(events.CallbackQuery(pattern=rf"^{CANCEL_IMAGE_DATA}(\d+)$"))  # type: ignore
+@instrument_handler
+async def handle_cancel_image(event: events.callbackquery.CallbackQuery.Event) -> None:
+    """Cancel a queued or running image job of the user who pressed its cancel button.
+
+    Args:
+        event (events.callbackquery.CallbackQuery.Event): The callback query event.
+
+    Returns
+    -------
+        None: This function doesn't return anything.
+    """
+    cancelled = await image_jobs.cancel(int(event.pattern_match.group(1)), event.query.user_id)
+    await event.answer(image_job_cancelled if cancelled else image_job_not_found)
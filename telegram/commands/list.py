@@ -6,7 +6,8 @@ from asgiref.sync import sync_to_async
 from loguru import logger
 from telethon import Button, TelegramClient, events
 
-from telegram.commands.utils import PAGE_SIZE, SupportedCommands
+from telegram.commands.utils import PAGE_SIZE, SupportedCommands, instrument_handler
+from telegram.dedup import deduplicated
 
 
 def add_list_handlers(client: TelegramClient) -> None:
@@ -16,6 +17,8 @@ def add_list_handlers(client: TelegramClient) -> None:
 
 
 @events.register(events.CallbackQuery(pattern=r"(next|prev)_page:(\d+)"))  # type: ignore
+@instrument_handler
+@deduplicated
 async def navigate_pages(event: events.callbackquery.CallbackQuery.Event) -> None:
     """Event handler to navigate between pages of conversations.
 
@@ -79,6 +82,7 @@ async def send_paginated_conversations(
 
 # Register the function to handle the /list command
 @events.register(events.NewMessage(pattern=f"^{SupportedCommands.LIST.value}$"))  # type: ignore
+@instrument_handler
 async def handle_list_command(event: events.NewMessage.Event) -> None:
     """Event handler for the /list command.
 
@@ -8,7 +8,8 @@ from loguru import logger
 from telethon import events
 
 # Import some helper functions
-from telegram.commands.utils import SupportedCommands, get_user
+from telegram.commands.utils import SupportedCommands, get_user, instrument_handler
+from telegram.completions import completions
 
 if TYPE_CHECKING:
     from telethon.tl.types import User
@@ -16,6 +17,7 @@ if TYPE_CHECKING:
 
 # Register the function to handle the /new command
 @events.register(events.NewMessage(pattern=f"^{SupportedCommands.NEW.value}"))  # type: ignore
+@instrument_handler
 async def handle_new_command(event: events.NewMessage.Event) -> None:
     """Handle /new command.
 
@@ -45,6 +47,10 @@ async def handle_new_command(event: events.NewMessage.Event) -> None:
     title = event.message.text[prefix_len:]
     if len(title) == 0:
         title = None
+    # The reply in flight belongs to the previous conversation
+    completions.cancel(telegram_user.id, "new")
+    # A cancelled reply is only dropped once its request thread noticed it, it must not land in the new conversation
+    await completions.wait(telegram_user.id)
     # Call the function to initiate a new conversation
     await sync_to_async(gpt.initiate_new_conversation)(telegram_user, title)
 
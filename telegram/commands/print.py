@@ -7,7 +7,8 @@ from loguru import logger
 from telethon import Button, TelegramClient, events
 
 from telegram.commands.strings import conversation_nf
-from telegram.commands.utils import PAGE_SIZE, SupportedCommands
+from telegram.commands.utils import PAGE_SIZE, SupportedCommands, instrument_handler
+from telegram.dedup import deduplicated
 
 
 def add_print_handlers(client: TelegramClient) -> None:
@@ -17,6 +18,8 @@ def add_print_handlers(client: TelegramClient) -> None:
 
 
 @events.register(events.CallbackQuery(pattern=r"(next|prev)_page:(\d+):(\d+)"))  # type: ignore
+@instrument_handler
+@deduplicated
 async def print_navigate_pages(event: events.callbackquery.CallbackQuery.Event) -> None:
     """Event handler to navigate between pages of conversation messages.
 
@@ -94,6 +97,7 @@ async def display_paginated_messages(
 
 
 @events.register(events.NewMessage(pattern=f"^{SupportedCommands.PRINT.value}\\s*(\\d*)$"))  # type: ignore
+@instrument_handler
 async def handle_print_command(event: events.NewMessage.Event) -> None:
     """Handle the /print command.
 
@@ -9,7 +9,8 @@ from telethon import Button, TelegramClient, events
 
 # Import some helper functions
 from telegram.commands.strings import cleanup_success, ignore
-from telegram.commands.utils import SupportedCommands, get_user
+from telegram.commands.utils import SupportedCommands, get_user, instrument_handler
+from telegram.completions import completions
 
 if TYPE_CHECKING:
     from telethon.tl.types import User
@@ -27,6 +28,7 @@ def add_reset_handlers(client: TelegramClient) -> None:
 
 
 @events.register(events.callbackquery.CallbackQuery(pattern="^reset_(yes|no)$"))  # type: ignore
+@instrument_handler
 async def handle_reset_confirm_response(
     event: events.callbackquery.CallbackQuery.Event,
 ) -> None:
@@ -54,6 +56,9 @@ async def handle_reset_confirm_response(
         # Get the user associated with the message
         telegram_user: User = await get_user(event)
 
+        # The reply in flight would be stored in the conversation being deleted
+        completions.cancel(telegram_user.id, "reset")
+        await completions.wait(telegram_user.id)
         await sync_to_async(gpt.clean_up_user_data)(
             SupportedCommands.RESET.value,
             telegram_user,
@@ -66,6 +71,7 @@ async def handle_reset_confirm_response(
 
 # Register the function to handle the /reset command
 @events.register(events.NewMessage(pattern=f"^{SupportedCommands.RESET.value}$"))  # type: ignore
+@instrument_handler
 async def handle_reset_command(event: events.NewMessage.Event) -> None:
     """Handle /reset command Delete all message history for a user.
 
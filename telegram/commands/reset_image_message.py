@@ -11,7 +11,8 @@ from telethon import Button, TelegramClient, events
 
 # Import some helper functions
 from telegram.commands.strings import cleanup_success, ignore, something_bad_occurred
-from telegram.commands.utils import SupportedCommands, get_user
+from telegram.commands.utils import SupportedCommands, get_user, instrument_handler
+from telegram.completions import completions
 
 if TYPE_CHECKING:
     from telethon.tl.custom import Message
@@ -43,6 +44,7 @@ def add_reset_image_message_handlers(client: TelegramClient) -> None:
 
 
 @events.register(events.callbackquery.CallbackQuery(pattern="^reset_im_(yes|no)$"))  # type: ignore
+@instrument_handler
 async def handle_reset_image_message_confirm_response(
     event: events.callbackquery.CallbackQuery.Event,
 ) -> None:
@@ -74,6 +76,10 @@ async def handle_reset_image_message_confirm_response(
         match = re.search(f"^{SupportedCommands.RESET.value}(.+)$", reply_message)
         if isinstance(match, Match):
             request = match.group(1)
+            if request == "messages":
+                # The reply in flight would be stored in a new conversation holding only the reply
+                completions.cancel(telegram_user.id, "reset")
+                await completions.wait(telegram_user.id)
 
             # Call the function to clean up user data
             result = await sync_to_async(gpt.clean_up_user_data)(
@@ -93,6 +99,7 @@ async def handle_reset_image_message_confirm_response(
 
 # Register the function to handle the /reset command
 @events.register(events.NewMessage(pattern=f"^{SupportedCommands.RESET.value}(messages|images)$"))  # type: ignore
+@instrument_handler
 async def handle_reset_messages_images_command(event: events.NewMessage.Event) -> None:
     """Handle /resetmessages and /resetimages commands.
 
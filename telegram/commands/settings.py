@@ -4,8 +4,13 @@ from asgiref.sync import sync_to_async
 from loguru import logger
 from telethon import Button, TelegramClient, events
 
-from telegram.commands.user_settings import modify_page_size
-from telegram.commands.utils import SupportedCommands, UserSettings
+from telegram.commands.user_settings import (
+    modify_image_retention,
+    modify_message_retention,
+    modify_page_size,
+    modify_similar_answers,
+)
+from telegram.commands.utils import SupportedCommands, UserSettings, instrument_handler
 
 
 def add_settings_handlers(client: TelegramClient) -> None:
@@ -16,6 +21,7 @@ def add_settings_handlers(client: TelegramClient) -> None:
 
 
 @events.register(events.CallbackQuery(pattern="list_settings"))  # type: ignore
+@instrument_handler
 async def handle_settings_list_settings(
     event: events.callbackquery.CallbackQuery.Event,
 ) -> None:
@@ -34,6 +40,7 @@ async def handle_settings_list_settings(
 
 
 @events.register(events.CallbackQuery(pattern="current_settings"))  # type: ignore
+@instrument_handler
 async def handle_settings_current_settings(
     event: events.callbackquery.CallbackQuery.Event,
 ) -> None:
@@ -58,6 +65,7 @@ async def handle_settings_current_settings(
 
 
 @events.register(events.NewMessage(pattern=f"^{SupportedCommands.SETTINGS.value}"))  # type: ignore
+@instrument_handler
 async def handle_settings_command(event: events.NewMessage.Event) -> None:
     """Event handler for the /settings command.
 
@@ -91,6 +99,9 @@ async def handle_settings_command(event: events.NewMessage.Event) -> None:
 
     settings_modification_functions = {
         UserSettings.PAGE_SIZE.value: modify_page_size,
+        UserSettings.MESSAGE_RETENTION.value: modify_message_retention,
+        UserSettings.IMAGE_RETENTION.value: modify_image_retention,
+        UserSettings.SIMILAR_ANSWERS.value: modify_similar_answers,
     }
 
     setting_modification_function = settings_modification_functions.get(
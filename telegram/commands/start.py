@@ -1,11 +1,15 @@
 """Handle start command."""
 
 # Import necessary libraries and modules
+from asgiref.sync import sync_to_async
 from loguru import logger
 from telethon import TelegramClient, events
 
+from chatgpt.exceptions import CircuitOpenError
+
 # Import some helper functions
-from telegram.commands.utils import SupportedCommands
+from telegram.commands.strings import service_unavailable
+from telegram.commands.utils import SupportedCommands, instrument_handler
 
 
 def add_start_handlers(client: TelegramClient) -> None:
@@ -15,6 +19,7 @@ def add_start_handlers(client: TelegramClient) -> None:
 
 # Register the function to handle the /start command
 @events.register(events.NewMessage(pattern=f"^{SupportedCommands.START.value}$"))  # type: ignore
+@instrument_handler
 async def handle_start_message(event: events.NewMessage.Event) -> None:
     """Handle /start command.
 
@@ -41,7 +46,13 @@ async def handle_start_message(event: events.NewMessage.Event) -> None:
     from main import gpt  # noqa: PLC0415
 
     # Generate a response based on the start message
-    reply = gpt.reply_start(start_message)
+    try:
+        # Not thread sensitive, so that a request waiting for the rate limiter or a retry does not block the loop
+        reply = await sync_to_async(gpt.reply_start, thread_sensitive=False)(start_message)
+    except CircuitOpenError as e:
+        logger.info(f"Not answering /start, {e}")
+        await event.respond(service_unavailable)
+        return
 
     prefix_len = len(prefix)
     result = reply[prefix_len:]
@@ -5,3 +5,14 @@ something_bad_occurred = "Something bad happened.☠️"
 no_input = "Please provide valid input."
 ignore = "Ignoring request. zzzzzzz."
 conversation_nf = "Conversation not found."
+service_unavailable = "OpenAI is not responding right now, please try again in a minute.⏳"
+quota_exceeded = "You have used your daily token quota, it resets at midnight UTC.🪫"
+invalid_image_request = "Usage: `/image [n=<variants>] [size=<width>x<height>] <prompt>`, {error}."
+image_job_running = "Your previous image is still being generated, wait for it or cancel it first.🎨"
+image_queue_full = "Too many images are being generated right now, please try again in a few minutes.⏳"
+image_job_cancelled = "Cancelled."
+image_job_not_found = "This image is no longer queued."
+account_suspended = "Your account is suspended."
+account_not_active = "Your account is not active."
+account_temporarily_banned = "Your account is temporarily banned, please try again later."
+rate_limited = "You are sending requests too fast, please wait {seconds}s.🐢"
@@ -5,7 +5,8 @@ from loguru import logger
 from telethon import TelegramClient, events
 
 from sqlitedb.models import Conversation, User
-from telegram.commands.utils import SupportedCommands
+from telegram.commands.utils import SupportedCommands, instrument_handler
+from telegram.completions import completions
 
 
 def add_switch_handler(client: TelegramClient) -> None:
@@ -15,6 +16,7 @@ def add_switch_handler(client: TelegramClient) -> None:
 
 # Register the function to handle the /switch command
 @events.register(events.NewMessage(pattern=f"^{SupportedCommands.SWITCH.value}\\s*(\\d*)$"))  # type: ignore
+@instrument_handler
 async def handle_switch_command(event: events.NewMessage.Event) -> None:
     """Event handler for the /switch command.
 
@@ -67,6 +69,10 @@ async def switch_conversation(
         await event.reply("The specified conversation does not exists.")
         return
 
+    # The reply in flight belongs to the previous conversation
+    completions.cancel(user.telegram_id, "switch")
+    # A cancelled reply is only dropped once its request thread noticed it, it must not land in the new conversation
+    await completions.wait(user.telegram_id)
     # If yes, switch the active conversation and send a confirmation message
     # This assumes that you have a method `set_active_conversation` in your database module
     # to set the active conversation for the user
@@ -42,3 +42,81 @@ async def modify_page_size(
         await event.reply(
             "Invalid value for page size. Please provide a positive integer.",
         )
+
+
+async def _modify_retention_days(
+    event: events.NewMessage.Event,
+    user: User,
+    user_settings: dict[str, str],
+    new_value: str,
+    setting: UserSettings,
+) -> None:
+    """Modify a retention setting for a user.
+
+    Args:
+        event (events.NewMessage.Event): The new message event.
+        user (User): The user instance to modify the settings for.
+        user_settings (dict): The user's settings dictionary.
+        new_value (str): The new number of days, 0 resets to the default retention.
+        setting (UserSettings): The retention setting to modify.
+    """
+    try:
+        days = int(new_value)
+        if days < 0:
+            raise ValueError
+
+        user_settings[setting.value] = str(days)
+        user.settings = user_settings
+        await sync_to_async(user.save)()
+
+        await event.reply(f"{setting.value} successfully updated to {days}.")
+    except ValueError:
+        await event.reply(
+            "Invalid value for retention. Please provide a non-negative integer.",
+        )
+
+
+async def modify_message_retention(
+    event: events.NewMessage.Event,
+    user: User,
+    user_settings: dict[str, str],
+    new_value: str,
+) -> None:
+    """Modify the message_retention_days setting for a user."""
+    await _modify_retention_days(event, user, user_settings, new_value, UserSettings.MESSAGE_RETENTION)
+
+
+async def modify_image_retention(
+    event: events.NewMessage.Event,
+    user: User,
+    user_settings: dict[str, str],
+    new_value: str,
+) -> None:
+    """Modify the image_retention_days setting for a user."""
+    await _modify_retention_days(event, user, user_settings, new_value, UserSettings.IMAGE_RETENTION)
+
+
+async def modify_similar_answers(
+    event: events.NewMessage.Event,
+    user: User,
+    user_settings: dict[str, str],
+    new_value: str,
+) -> None:
+    """Modify the similar_answers setting for a user.
+
+    Args:
+        event (events.NewMessage.Event): The new message event.
+        user (User): The user instance to modify the settings for.
+        user_settings (dict): The user's settings dictionary.
+        new_value (str): ``on`` to accept answers to similar questions, ``off`` otherwise.
+    """
+    value = new_value.lower()
+    if value not in {"on", "off"}:
+        await event.reply("Invalid value for similar answers. Please provide `on` or `off`.", parse_mode="markdown")
+        return
+
+    user_settings[UserSettings.SIMILAR_ANSWERS.value] = value
+    user.settings = user_settings
+    await sync_to_async(user.save)()
+
+    await event.reply(f"{UserSettings.SIMILAR_ANSWERS.value} successfully updated to {value}.")
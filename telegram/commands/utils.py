@@ -2,12 +2,19 @@
 
 from __future__ import annotations
 
+import functools
+import time
 from enum import Enum
 from typing import TYPE_CHECKING, Any
 
 from loguru import logger
+from telethon.events import StopPropagation
+
+from monitoring.metrics import REGISTRY
+from sqlitedb.instrumentation import track_queries
 
 if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
     from typing import Self
 
     from telethon import events
@@ -15,6 +22,17 @@ if TYPE_CHECKING:
 
 PAGE_SIZE = 10  # Number of conversations per page
 
+handler_requests_total = REGISTRY.counter(
+    "telegram_handler_requests_total",
+    "Updates handled by handler and result (ok or error).",
+    ("handler", "result"),
+)
+handler_seconds = REGISTRY.histogram(
+    "telegram_handler_seconds",
+    "Time spent in a handler, replies generated in the background excluded.",
+    ("handler",),
+)
+
 
 # Define a list of supported commands
 class SupportedCommands(Enum):
@@ -71,6 +89,38 @@ async def get_user(event: events.NewMessage.Event) -> User:
     return user
 
 
+def instrument_handler(
+    handler: Callable[[Any], Awaitable[None]],
+) -> Callable[[Any], Awaitable[None]]:
+    """Decorate an event handler to count its calls, measure its latency and attribute the DB queries it issues to it.
+
+    Args:
+        handler (Callable): The event handler to instrument.
+
+    Returns
+    -------
+        Callable: The instrumented event handler.
+    """
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(event: Any) -> None:
+        result = "error"
+        start = time.perf_counter()
+        try:
+            with track_queries(name):
+                await handler(event)
+            result = "ok"
+        except StopPropagation:
+            result = "ok"
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - start, handler=name)
+            handler_requests_total.inc(handler=name, result=result)
+
+    return wrapper
+
+
 def get_regex() -> str:
     """Generate a regex pattern that matches any message that is not a supported command.
 
@@ -86,6 +136,9 @@ class UserSettings(Enum):
     """User Settings."""
 
     PAGE_SIZE = "page_size", "The number of conversations displayed per page."
+    MESSAGE_RETENTION = "message_retention_days", "Days to keep chat messages before they are purged (0 for default)."
+    IMAGE_RETENTION = "image_retention_days", "Days to keep generated images before they are purged (0 for default)."
+    SIMILAR_ANSWERS = "similar_answers", "Answer single questions with the answer to a very similar question (on/off)."
 
     def __new__(cls, *args: Any, **_: Any) -> UserSettings:
         obj = object.__new__(cls)
@@ -0,0 +1,166 @@
+"""Chat completions in flight, run apart from the chat handlers and cancelled when the user moves on."""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import threading
+import time
+from typing import TYPE_CHECKING, Self
+
+from loguru import logger
+
+from monitoring.metrics import REGISTRY
+from sqlitedb.instrumentation import track_queries
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+
+# Cancel the completion in flight on a new message and on /new, /switch and /reset
+CANCEL_ALL = "all"
+# Cancel it on /new, /switch and /reset only, new messages are answered in order
+CANCEL_COMMANDS = "commands"
+# Never cancel it
+CANCEL_OFF = "off"
+CANCEL_POLICIES = (CANCEL_ALL, CANCEL_COMMANDS, CANCEL_OFF)
+
+# Reasons of cancellations
+NEW_MESSAGE = "new_message"
+
+chat_completions_in_flight = REGISTRY.gauge(
+    "chat_completions_in_flight",
+    "Chat completions requested or waiting for the previous completion of their user.",
+)
+chat_completion_seconds = REGISTRY.histogram(
+    "chat_completion_seconds",
+    "Time from a message to its reply being sent, completions cancelled or failing excluded.",
+)
+chat_completions_cancelled_total = REGISTRY.counter(
+    "chat_completions_cancelled_total",
+    "Chat completions cancelled before their reply was sent, by reason (new_message, new, switch or reset).",
+    ("reason",),
+)
+
+
+class InFlightCompletion(object):
+    """A reply being generated for a user."""
+
+    def __init__(self: Self, user_id: int) -> None:
+        self.user_id = user_id
+        # Checked by the thread sending the request, which aborts it once set
+        self.cancelled = threading.Event()
+        self.task: asyncio.Task[None] | None = None
+
+
+class CompletionRegistry(object):
+    """Track the chat completion in flight of every user, so that it can be cancelled when the user moves on.
+
+    Replies are generated in tasks, so that the handler returns at once and the user's next update is handled
+    while the completion runs. Depending on ``policy``, a new message or a command changing the conversation
+    cancels the completion in flight: its request is aborted and its reply is neither stored nor sent.
+    Completions run one after the other for every user, so that replies arrive in order. A cancelled completion
+    still holds up the next one until its request thread stopped, so that their messages are never stored
+    interleaved.
+    """
+
+    def __init__(self: Self, policy: str = CANCEL_ALL) -> None:
+        self.policy = policy
+        self._completions: dict[int, InFlightCompletion] = {}
+        self._configured = False
+
+    def configure(self: Self) -> None:
+        """Read ``CANCEL_POLICY`` once."""
+        if self._configured:
+            return
+        from main import env  # noqa: PLC0415
+
+        policy = env.str("CANCEL_POLICY", self.policy)
+        if policy not in CANCEL_POLICIES:
+            logger.warning(f"Unknown CANCEL_POLICY {policy}, using {self.policy}")
+        else:
+            self.policy = policy
+        self._configured = True
+
+    def start(self: Self, user_id: int, run: Callable[[threading.Event], Awaitable[None]]) -> None:
+        """Generate a reply for a user in a task.
+
+        Args:
+            user_id (int): The user the reply is generated for.
+            run (Callable): The coroutine function generating and sending the reply, called with the event set
+                once the reply is no longer wanted.
+        """
+        self.configure()
+        previous = self._completions.get(user_id)
+        if previous is not None:
+            self.cancel(user_id, NEW_MESSAGE)
+        completion = InFlightCompletion(user_id)
+        completion.task = asyncio.get_running_loop().create_task(
+            self._run(completion, run, previous),
+            # Out of the context of the handler, so that the queries of the task are tracked on their own
+            context=contextvars.Context(),
+        )
+        # Not in the task, which never runs when it is cancelled before it starts
+        completion.task.add_done_callback(lambda _: self._finished(completion))
+        self._completions[user_id] = completion
+        chat_completions_in_flight.set(len(self._completions))
+
+    def _finished(self: Self, completion: InFlightCompletion) -> None:
+        if self._completions.get(completion.user_id) is completion:
+            del self._completions[completion.user_id]
+        chat_completions_in_flight.set(len(self._completions))
+
+    async def _run(
+        self: Self,
+        completion: InFlightCompletion,
+        run: Callable[[threading.Event], Awaitable[None]],
+        previous: InFlightCompletion | None,
+    ) -> None:
+        start = time.perf_counter()
+        try:
+            if previous is not None and previous.task is not None:
+                # Keep the replies in order, a cancelled task finishes once its request thread noticed it
+                await asyncio.wait([previous.task])
+            if completion.cancelled.is_set():
+                # Cancelled while waiting for the previous completion
+                return
+            with track_queries("chat_completion"):
+                await run(completion.cancelled)
+            if not completion.cancelled.is_set():
+                chat_completion_seconds.observe(time.perf_counter() - start)
+        except asyncio.CancelledError:
+            logger.debug(f"Completion of user {completion.user_id} cancelled")
+        except Exception as e:
+            logger.exception(f"Unable to reply to user {completion.user_id} {e}")
+
+    def cancel(self: Self, user_id: int, reason: str) -> bool:
+        """Cancel the completion in flight of a user, if the policy allows it for this reason.
+
+        Returns
+        -------
+            bool: Whether a completion was cancelled.
+        """
+        self.configure()
+        if self.policy == CANCEL_OFF or (reason == NEW_MESSAGE and self.policy != CANCEL_ALL):
+            return False
+        completion = self._completions.get(user_id)
+        if completion is None or completion.cancelled.is_set():
+            return False
+        # Not cancelling the task, which would end while its request thread still writes to the conversation:
+        # the thread notices the event, e.g. between two streamed chunks, and stores nor sends the reply
+        completion.cancelled.set()
+        chat_completions_cancelled_total.inc(reason=reason)
+        logger.debug(f"Cancelled completion of user {user_id}, {reason}")
+        return True
+
+    async def wait(self: Self, user_id: int) -> None:
+        """Wait until a user has no completion in flight."""
+        while (completion := self._completions.get(user_id)) is not None and completion.task is not None:
+            await asyncio.wait([completion.task])
+
+    async def join(self: Self) -> None:
+        """Wait until no completion is in flight."""
+        while tasks := [completion.task for completion in self._completions.values() if completion.task is not None]:
+            await asyncio.wait(tasks)
+
+
+completions = CompletionRegistry()
@@ -0,0 +1,120 @@
+"""Deduplication of the updates Telegram delivers again, e.g. after a reconnection."""
+
+from __future__ import annotations
+
+import functools
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Self
+
+from asgiref.sync import sync_to_async
+from loguru import logger
+
+from monitoring.metrics import REGISTRY
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+
+MESSAGE = "message"
+CALLBACK = "callback"
+
+# Kind, chat id and id of the message or callback query
+UpdateKey = tuple[str, int, int]
+
+duplicate_updates_total = REGISTRY.counter(
+    "telegram_duplicate_updates_total",
+    "Updates delivered again by Telegram and not handled twice, by kind (message or callback).",
+    ("kind",),
+)
+
+
+def update_key(event: Any) -> UpdateKey | None:
+    """Key of the update of an event, None if the event carries no id.
+
+    Messages are keyed by their id. Callback queries are keyed by the id of the query rather than of the message
+    carrying the buttons, so that pressing a button of the same message again is still handled.
+    """
+    query = getattr(event, "query", None)
+    if query is not None and getattr(query, "query_id", None) is not None:
+        return CALLBACK, int(event.chat_id), int(query.query_id)
+    message = getattr(event, "message", None)
+    if message is not None and getattr(message, "id", None) is not None:
+        return MESSAGE, int(event.chat_id), int(message.id)
+    return None
+
+
+class UpdateDeduplicator(object):
+    """Remember the latest updates handled, so that every message triggers at most one completion.
+
+    Keys are held in a bounded LRU. With ``persist``, they are also stored in the ``processed_update`` table, so
+    that the updates Telegram delivers again after a restart are recognized as well.
+    """
+
+    def __init__(self: Self, max_entries: int = 10000, *, persist: bool = False) -> None:
+        self.max_entries = max_entries
+        self.persist = persist
+        self._keys: OrderedDict[UpdateKey, None] = OrderedDict()
+        self._configured = False
+
+    def configure(self: Self) -> None:
+        """Read ``UPDATE_DEDUP_SIZE`` and ``UPDATE_DEDUP_PERSIST`` once."""
+        if self._configured:
+            return
+        from main import env  # noqa: PLC0415
+
+        self.max_entries = env.int("UPDATE_DEDUP_SIZE", self.max_entries)
+        self.persist = env.bool("UPDATE_DEDUP_PERSIST", self.persist)
+        self._configured = True
+
+    def _remember(self: Self, key: UpdateKey) -> bool:
+        """Record a key in memory, return False if it was already recorded."""
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            return False
+        self._keys[key] = None
+        while len(self._keys) > self.max_entries:
+            self._keys.popitem(last=False)
+        return True
+
+    async def claim(self: Self, event: Any) -> bool:
+        """Record the update of an event as handled.
+
+        Returns
+        -------
+            bool: False if the update was already handled and must be ignored.
+        """
+        self.configure()
+        key = update_key(event)
+        if key is None or not self.max_entries:
+            return True
+        # Recorded in memory before the database is queried, so that a concurrent redelivery is caught too
+        first = self._remember(key)
+        if first and self.persist:
+            from main import db  # noqa: PLC0415
+
+            first = await sync_to_async(db.mark_update_processed)(*key)
+        if not first:
+            duplicate_updates_total.inc(kind=key[0])
+            logger.info(f"Ignoring {key[0]} {key[2]} of chat {key[1]} delivered again")
+        return first
+
+
+updates = UpdateDeduplicator()
+
+
+def deduplicated(handler: Callable[[Any], Awaitable[None]]) -> Callable[[Any], Awaitable[None]]:
+    """Decorate an event handler so that updates delivered again are not handled twice.
+
+    Args:
+        handler (Callable): The event handler to deduplicate.
+
+    Returns
+    -------
+        Callable: The deduplicated event handler.
+    """
+
+    @functools.wraps(handler)
+    async def wrapper(event: Any) -> None:
+        if await updates.claim(event):
+            await handler(event)
+
+    return wrapper
@@ -0,0 +1,286 @@
+"""Queue of image generation jobs, run apart from the chat handlers."""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import contextvars
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Self
+
+from loguru import logger
+from telethon import Button
+
+from monitoring.metrics import REGISTRY
+from sqlitedb.instrumentation import track_queries
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+
+CANCEL_IMAGE_DATA = "cancel_image:"
+GENERATING = "🎨 Generating your image..."
+# Waiting jobs whose status message is edited when their position changes, the others are edited once they get there
+POSITION_UPDATES = 10
+
+image_jobs_running = REGISTRY.gauge("image_jobs_running", "Image generation jobs running.")
+image_jobs_waiting = REGISTRY.gauge("image_jobs_waiting", "Image generation jobs waiting for a free slot.")
+image_jobs_total = REGISTRY.counter(
+    "image_jobs_total",
+    "Image generation jobs by result (done, failed, cancelled, rejected or duplicate).",
+    ("result",),
+)
+image_job_wait_seconds = REGISTRY.histogram(
+    "image_job_wait_seconds",
+    "Time image generation jobs waited for a free slot.",
+)
+
+
+class QueueFullError(Exception):
+    """Raised when the image job queue is full."""
+
+
+class DuplicateJobError(Exception):
+    """Raised when a user submits an image job while one of theirs is queued or running."""
+
+
+class ImageJob(object):
+    """An image generation requested by a user, and its status message."""
+
+    def __init__(
+        self: Self,
+        job_id: int,
+        user_id: int,
+        run: Callable[[threading.Event], Awaitable[None]],
+        status: Any,
+    ) -> None:
+        self.id = job_id
+        self.user_id = user_id
+        self.run = run
+        self.status = status
+        self.submitted = time.monotonic()
+        self.position = 0
+        # Set once the images are no longer wanted, checked before they are sent
+        self.cancelled = threading.Event()
+        # Set once the job left the queue, whether it ran or not
+        self.finished = asyncio.Event()
+        self.task: asyncio.Task[None] | None = None
+
+    @property
+    def cancel_button(self: Self) -> list[Any]:
+        """Button cancelling the job."""
+        return [Button.inline("Cancel", data=f"{CANCEL_IMAGE_DATA}{self.id}")]
+
+
+class ImageJobQueue(object):
+    """Run image generations with a concurrency limit, at most one queued or running job per user.
+
+    Image generations take seconds and cost much more than chat completions. Running them as jobs lets the handler
+    return at once instead of holding up the handling of other updates, and bounds how many run at the same time.
+    Every job has a status message showing its queue position, kept up to date, with a button cancelling the job.
+    A cancelled running job keeps its slot until its request thread returned, so that cancelling and submitting
+    again never runs more generations than allowed.
+    """
+
+    def __init__(self: Self, concurrency: int = 2, max_waiting: int = 100) -> None:
+        self.concurrency = concurrency
+        self.max_waiting = max_waiting
+        self.waiting: OrderedDict[int, ImageJob] = OrderedDict()
+        self.running: dict[int, ImageJob] = {}
+        self._users: dict[int, ImageJob] = {}
+        self._ids = itertools.count(1)
+        self._idle: asyncio.Event | None = None
+        self._configured = False
+
+    def configure(self: Self) -> None:
+        """Read ``IMAGE_CONCURRENCY`` and ``IMAGE_QUEUE_SIZE`` once."""
+        if self._configured:
+            return
+        from main import env  # noqa: PLC0415
+
+        self.concurrency = max(env.int("IMAGE_CONCURRENCY", self.concurrency), 1)
+        self.max_waiting = env.int("IMAGE_QUEUE_SIZE", self.max_waiting)
+        self._configured = True
+
+    def has_job(self: Self, user_id: int) -> bool:
+        """Whether a user has a job queued or running."""
+        return user_id in self._users
+
+    async def submit(
+        self: Self,
+        user_id: int,
+        run: Callable[[threading.Event], Awaitable[None]],
+        send_status: Callable[[str, list[Any]], Awaitable[Any]],
+    ) -> ImageJob:
+        """Queue a job and send its status message.
+
+        Args:
+            user_id (int): The user the job runs for.
+            run (Callable): The coroutine function generating and sending the images, called with the event set
+                once the images are no longer wanted.
+            send_status (Callable): Sends the status message from its text and buttons, returns the message.
+
+        Raises
+        ------
+            DuplicateJobError: If the user already has a job queued or running.
+            QueueFullError: If too many jobs are waiting.
+        """
+        self.configure()
+        if user_id in self._users:
+            image_jobs_total.inc(result="duplicate")
+            raise DuplicateJobError
+        if len(self.waiting) >= self.max_waiting and len(self.running) >= self.concurrency:
+            image_jobs_total.inc(result="rejected")
+            raise QueueFullError
+        job = ImageJob(next(self._ids), user_id, run, None)
+        self._users[user_id] = job
+        if self._idle is not None:
+            self._idle.clear()
+        if len(self.running) < self.concurrency and not self.waiting:
+            # The slot is taken before the status message is sent, so that concurrent submits cannot take it too
+            self._reserve(job)
+            try:
+                job.status = await send_status(GENERATING, job.cancel_button)
+            except Exception:
+                # The job never starts, its slot and its user are freed so that later jobs are not refused
+                await self._abandon(job)
+                raise
+            self._launch(job)
+            return job
+        self.waiting[job.id] = job
+        job.position = len(self.waiting)
+        image_jobs_waiting.set(len(self.waiting))
+        try:
+            job.status = await send_status(self._position_text(job.position), job.cancel_button)
+        except Exception:
+            if job.id in self.waiting:
+                await self._abandon(job)
+            # Otherwise it started while the status message was sent, and runs without one
+            raise
+        if job.id in self.running:
+            # Started while the status message was sent
+            await self._edit(job, GENERATING, job.cancel_button)
+        return job
+
+    @staticmethod
+    def _position_text(position: int) -> str:
+        return f"⏳ Your image is queued, position {position}."
+
+    def _reserve(self: Self, job: ImageJob) -> None:
+        self.running[job.id] = job
+        image_jobs_running.set(len(self.running))
+        image_job_wait_seconds.observe(time.monotonic() - job.submitted)
+
+    async def _abandon(self: Self, job: ImageJob) -> None:
+        """Drop a job that was not started because its status message could not be sent."""
+        self.waiting.pop(job.id, None)
+        self.running.pop(job.id, None)
+        self._users.pop(job.user_id, None)
+        job.finished.set()
+        image_jobs_running.set(len(self.running))
+        image_jobs_total.inc(result="failed")
+        await self._schedule()
+
+    def _launch(self: Self, job: ImageJob) -> None:
+        job.task = asyncio.get_running_loop().create_task(
+            self._run(job),
+            # Out of the context of the handler, so that the queries of the job are tracked on their own
+            context=contextvars.Context(),
+        )
+
+    async def _run(self: Self, job: ImageJob) -> None:
+        result = "done"
+        try:
+            with track_queries("image_job"):
+                await job.run(job.cancelled)
+        except asyncio.CancelledError:
+            result = "cancelled"
+        except Exception as e:
+            result = "cancelled" if job.cancelled.is_set() else "failed"
+            logger.exception(f"Image job {job.id} of user {job.user_id} failed {e}")
+            if not job.cancelled.is_set():
+                await self._edit(job, "Unable to generate your image.☠️")
+        else:
+            if job.cancelled.is_set():
+                result = "cancelled"
+            else:
+                await self._delete(job)
+        finally:
+            self.running.pop(job.id, None)
+            self._users.pop(job.user_id, None)
+            job.finished.set()
+            image_jobs_running.set(len(self.running))
+            image_jobs_total.inc(result=result)
+            await self._schedule()
+
+    async def _schedule(self: Self) -> None:
+        """Start waiting jobs while there are free slots, then update the positions of the others."""
+        while self.waiting and len(self.running) < self.concurrency:
+            _, job = self.waiting.popitem(last=False)
+            self._reserve(job)
+            self._launch(job)
+            await self._edit(job, GENERATING, job.cancel_button)
+        image_jobs_waiting.set(len(self.waiting))
+        for position, job in enumerate(list(self.waiting.values()), start=1):
+            if position != job.position and position <= POSITION_UPDATES:
+                job.position = position
+                await self._edit(job, self._position_text(position), job.cancel_button)
+        if not self._users and self._idle is not None:
+            self._idle.set()
+
+    async def cancel(self: Self, job_id: int, user_id: int) -> bool:
+        """Cancel a job of a user.
+
+        Returns
+        -------
+            bool: False if the job does not exist, is finished or belongs to another user.
+        """
+        job = self.waiting.get(job_id) or self.running.get(job_id)
+        if job is None or job.user_id != user_id:
+            return False
+        if job_id in self.waiting:
+            del self.waiting[job_id]
+            self._users.pop(user_id, None)
+            job.finished.set()
+            image_jobs_total.inc(result="cancelled")
+            await self._schedule()
+        else:
+            # Not cancelling the task, which would free the slot while the request already sent keeps running in
+            # its thread: the job ends once the thread returned, without sending the images
+            job.cancelled.set()
+        await self._edit(job, "Image generation cancelled.")
+        return True
+
+    async def wait(self: Self, user_id: int) -> None:
+        """Wait until a user has no job queued or running."""
+        while (job := self._users.get(user_id)) is not None:
+            await job.finished.wait()
+
+    async def join(self: Self) -> None:
+        """Wait until no job is queued or running."""
+        if self._idle is None:
+            self._idle = asyncio.Event()
+        if not self._users:
+            self._idle.set()
+        await self._idle.wait()
+
+    @staticmethod
+    async def _edit(job: ImageJob, text: str, buttons: list[Any] | None = None) -> None:
+        if job.status is None:
+            return
+        try:
+            await job.status.edit(text, buttons=buttons)
+        except Exception as e:
+            logger.debug(f"Unable to edit the status of image job {job.id} {e}")
+
+    @staticmethod
+    async def _delete(job: ImageJob) -> None:
+        if job.status is None:
+            return
+        with contextlib.suppress(Exception):
+            await job.status.delete()
+
+
+image_jobs = ImageJobQueue()
@@ -6,8 +6,11 @@ from typing import Self
 from loguru import logger
 from telethon import TelegramClient
 
-from telegram.commands import general, image, new
+from telegram.admission import add_admission_handlers
+from telegram.catchup import catch_up
+from telegram.commands import general, new
 from telegram.commands.chat import add_chat_handler
+from telegram.commands.image import add_image_handlers
 from telegram.commands.list import add_list_handlers
 from telegram.commands.print import add_print_handlers
 from telegram.commands.reset import add_reset_handlers
@@ -15,6 +18,28 @@ from telegram.commands.reset_image_message import add_reset_image_message_handle
 from telegram.commands.settings import add_settings_handlers
 from telegram.commands.start import add_start_handlers
 from telegram.commands.switch import add_switch_handler
+from telegram.tasks import start_background_tasks
+
+
+def register_handlers(client: TelegramClient) -> None:
+    """Register the event handlers of every command the bot can handle.
+
+    Args:
+        client (TelegramClient): The client to register the handlers on.
+    """
+    # First, so that updates it does not admit reach no other handler
+    add_admission_handlers(client)
+    add_reset_handlers(client)
+    add_reset_image_message_handlers(client)
+    add_start_handlers(client)
+    add_list_handlers(client)
+    add_settings_handlers(client)
+    add_switch_handler(client)
+    add_chat_handler(client)
+    add_print_handlers(client)
+    add_image_handlers(client)
+    client.add_event_handler(new.handle_new_command)
+    client.add_event_handler(general.handle_any_message)
 
 
 class Telegram(object):
@@ -28,13 +53,19 @@ class Telegram(object):
         """
         from main import env  # noqa: PLC0415
 
+        # Messages sent from now on are answered live, the earlier ones are coalesced by the catch-up
+        catch_up.start()
         # Create a new TelegramClient instance with the given session file and API credentials
         self.client: TelegramClient = TelegramClient(
             session_file,
             env.int("API_ID"),
             env.str("API_HASH"),
             sequential_updates=True,
+            # Fetch the updates missed while the bot was down from the update state saved in the session
+            catch_up=catch_up.enabled,
         )
+        # Registered before connecting, the missed updates are dispatched as soon as the client is connected
+        register_handlers(self.client)
         # Connect to the Telegram API using bot authentication
         logger.debug("Trying to connect using bot token")
         self.client.start(bot_token=env.str("BOT_TOKEN"))
@@ -48,18 +79,8 @@ class Telegram(object):
 
     def bot_listener(self: Self) -> None:
         """Listen for incoming bot messages and handle them based on the command."""
-        # Register event handlers for each command the bot can handle
-        add_reset_handlers(self.client)
-        add_reset_image_message_handlers(self.client)
-        add_start_handlers(self.client)
-        add_list_handlers(self.client)
-        add_settings_handlers(self.client)
-        add_switch_handler(self.client)
-        add_chat_handler(self.client)
-        add_print_handlers(self.client)
-        self.client.add_event_handler(image.handle_image_command)
-        self.client.add_event_handler(new.handle_new_command)
-        self.client.add_event_handler(general.handle_any_message)
+        # Start periodic maintenance tasks, e.g. the retention purge
+        start_background_tasks(self.client)
 
         # Start listening for incoming bot messages
         self.client.run_until_disconnected()
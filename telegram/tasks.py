@@ -0,0 +1,70 @@
+"""Periodic background tasks run inside the bot process."""
+
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING, Any
+
+from asgiref.sync import sync_to_async
+from loguru import logger
+
+from chatgpt.titles import title_worker
+from monitoring.exposition import start_metrics_server
+from monitoring.loop import EventLoopMonitor
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from telethon import TelegramClient
+
+# Keep references to running tasks so that they are not garbage collected
+_background_tasks: set[asyncio.Task[None]] = set()
+
+
+async def run_periodically(name: str, func: Callable[[], Any], interval: float) -> None:
+    """Run a blocking function in a worker thread every ``interval`` seconds.
+
+    Args:
+        name (str): Name of the task, used for logging.
+        func (Callable): The blocking function to run.
+        interval (float): Seconds between two runs.
+    """
+    logger.info(f"Starting periodic task {name} every {interval}s")
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await sync_to_async(func)()
+        except Exception as e:
+            logger.exception(f"Periodic task {name} failed {e}")
+
+
+def start_task(client: TelegramClient, coroutine: Any) -> asyncio.Task[None]:
+    """Schedule a coroutine on the client loop and keep a reference to it."""
+    task: asyncio.Task[None] = client.loop.create_task(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+def start_background_tasks(client: TelegramClient) -> None:
+    """Start the background tasks enabled in the environment."""
+    from main import db, env  # noqa: PLC0415
+
+    start_task(client, title_worker.run())
+
+    metrics_port = env.int("METRICS_PORT", 0)
+    if metrics_port > 0:
+        start_metrics_server(env.str("METRICS_HOST", "127.0.0.1"), metrics_port)
+        start_task(client, EventLoopMonitor(env.float("EVENT_LOOP_LAG_INTERVAL", 0.5)).run())
+
+    purge_interval = env.float("RETENTION_PURGE_INTERVAL", 0)
+    if purge_interval > 0:
+        batch_size = env.int("RETENTION_BATCH_SIZE", 500)
+        start_task(
+            client,
+            run_periodically(
+                "retention-purge",
+                lambda: db.purge_expired_data(batch_size),
+                purge_interval,
+            ),
+        )